@@ -9,8 +9,10 @@ from flask_cors import CORS
 
 import model.knowledge_graph as kg
 import model.meta_model as mm
-from model import match
+from model import embedding, layout, match
 from model.application_model import ApplicationModel
+from model.graph_history import GraphHistory
+from model.graph_store import GraphStore
 from parser.parse import parse_xml_file
 from pipeline.llm_models import Models
 from pipeline.steps.file_loader import FileLoader
@@ -34,40 +36,312 @@ model_instances_directory.mkdir(exist_ok=True, parents=True)
 files_directory = pathlib.Path(__file__).parent.absolute() / "res" / "files"
 files_directory.mkdir(exist_ok=True, parents=True)
 
+layout_cache = layout.LayoutCache(
+    pathlib.Path(__file__).parent.absolute() / "res" / "result" / "layout-cache"
+)
+
+# starting worker processes on every request costs more than it saves
+REQUEST_PROCESSES = 1
+
+
+def open_graph_store(meta_model_name: str, create: bool = False) -> GraphStore | None:
+    store_path = model_instances_directory / f"{meta_model_name}.sqlite"
+    if os.path.isfile(store_path):
+        return GraphStore(store_path)
+
+    legacy_path = model_instances_directory / f"{meta_model_name}.json"
+    if os.path.isfile(legacy_path):
+        # graphs saved as JSON before there was a store are migrated on first use
+        store = GraphStore(store_path)
+        kg.Graph.load(legacy_path).to_store(store)
+        return store
+
+    if create:
+        return GraphStore(store_path)
+    return None
+
+
+def graph_history(meta_model_name: str) -> GraphHistory:
+    return GraphHistory(model_instances_directory / f"{meta_model_name}.history")
+
+
+def commit_version(
+    meta_model_name: str,
+    graph: kg.Graph,
+    message: str,
+    current_graph: kg.Graph | None,
+) -> int:
+    history = graph_history(meta_model_name)
+    if history.head is None and current_graph is not None:
+        # the graph existed before its history, keep that state as first version
+        history.commit(current_graph, "Initial version")
+    return history.commit(graph, message)
+
+
+def node_index_path(meta_model_name: str) -> pathlib.Path:
+    return model_instances_directory / f"{meta_model_name}.index.npz"
+
+
+def load_node_index(
+    meta_model_name: str, store: GraphStore, encoder: embedding.HashingEncoder
+) -> embedding.VectorIndex:
+    """
+    Vector index over the node names of a graph. It is brought up to date with
+    the store when loaded, which only encodes nodes that were added or renamed
+    since it was last saved.
+    """
+    index_path = node_index_path(meta_model_name)
+    index = None
+    if os.path.isfile(index_path):
+        try:
+            index = embedding.VectorIndex.load(index_path)
+        except KeyError:
+            # written before indexes stored the names they were built from
+            index = None
+
+    updated = embedding.update_index(index, store.node_names(), encoder)
+    if updated is not index:
+        temporary_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+        updated.save(temporary_path)
+        os.replace(temporary_path, index_path)
+    return updated
+
 
 @app.route("/graph/", methods=["GET"])
 def list_knowledge_graphs():
     graph_files = os.listdir(model_instances_directory)
     graphs = [os.path.splitext(p) for p in graph_files]
-    return [name for name, ext in graphs if ext == ".json"]
+    # deleted graphs are left out, their versions can still be listed and restored
+    names = [name for name, ext in graphs if ext in [".sqlite", ".json"]]
+    return list(dict.fromkeys(names))
 
 
 @app.route("/graph/<meta_model_name>/", methods=["GET"])
 def load_knowledge_graph(meta_model_name: str):
-    results_file_path = model_instances_directory / f"{meta_model_name}.json"
-    if not os.path.isfile(results_file_path):
+    store = open_graph_store(meta_model_name)
+    if store is None:
         flask.abort(404)
-    return kg.Graph.load(results_file_path).to_dict()
+    with store:
+        graph = store.load_graph()
+    # passed back as `since` on the next extraction, graphs that were never
+    # versioned have none and get the full graph
+    return {**graph.to_dict(), "version": graph_history(meta_model_name).head}
+
+
+@app.route("/graph/<meta_model_name>/stats/", methods=["GET"])
+def knowledge_graph_stats(meta_model_name: str):
+    store = open_graph_store(meta_model_name)
+    if store is None:
+        flask.abort(404)
+    with store:
+        return {
+            "nodes": store.num_nodes,
+            "edges": store.num_edges,
+            "entities": store.entity_counts(),
+        }
 
 
 @app.route("/graph/<meta_model_name>/", methods=["DELETE"])
 def delete_graph(meta_model_name: str):
-    results_file_path = model_instances_directory / f"{meta_model_name}.json"
-    if os.path.isfile(results_file_path):
-        os.replace(
-            results_file_path,
-            str(results_file_path) + ".bkp",
+    store = open_graph_store(meta_model_name)
+    if store is not None:
+        with store:
+            current_graph = store.load_graph()
+        # deleting is just another version, it can be undone by restoring
+        commit_version(
+            meta_model_name, kg.Graph(nodes=[], edges=[]), "Deleted", current_graph
         )
-    return {"success": True}
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.isfile(str(store.file_path) + suffix):
+                os.remove(str(store.file_path) + suffix)
+
+    legacy_path = model_instances_directory / f"{meta_model_name}.json"
+    if os.path.isfile(legacy_path):
+        os.remove(legacy_path)
+    if os.path.isfile(node_index_path(meta_model_name)):
+        os.remove(node_index_path(meta_model_name))
+    return {"success": True, "version": graph_history(meta_model_name).head}
 
 
 @app.route("/graph/<meta_model_name>/layout/", methods=["GET"])
 def layout_graph(meta_model_name: str):
-    results_file_path = model_instances_directory / f"{meta_model_name}.json"
-    graph = kg.Graph.load(results_file_path)
-    graph = graph.layout()
-    graph.save(results_file_path)
-    return {"success": True}
+    store = open_graph_store(meta_model_name)
+    if store is None:
+        flask.abort(404)
+    with store:
+        current_graph = store.load_graph()
+        graph = current_graph.layout(cache=layout_cache, processes=REQUEST_PROCESSES)
+        store.update_positions({n.id: n.position for n in graph.nodes})
+    version = commit_version(meta_model_name, graph, "Layout", current_graph)
+    return {"success": True, "version": version}
+
+
+@app.route("/graph/<meta_model_name>/versions/", methods=["GET"])
+def list_graph_versions(meta_model_name: str):
+    return [v.to_dict() for v in graph_history(meta_model_name).versions()]
+
+
+@app.route("/graph/<meta_model_name>/versions/<int:version>/", methods=["GET"])
+def load_graph_version(meta_model_name: str, version: int):
+    try:
+        return graph_history(meta_model_name).materialize(version).to_dict()
+    except KeyError:
+        flask.abort(404)
+
+
+@app.route("/graph/<meta_model_name>/versions/<int:version>/restore/", methods=["POST"])
+def restore_graph_version(meta_model_name: str, version: int):
+    try:
+        graph = graph_history(meta_model_name).materialize(version)
+    except KeyError:
+        flask.abort(404)
+
+    with open_graph_store(meta_model_name, create=True) as store:
+        current_graph = store.load_graph()
+        graph.to_store(store)
+    new_version = commit_version(
+        meta_model_name, graph, f"Restored version {version}", current_graph
+    )
+    return {"success": True, "version": new_version, "graph": graph.to_dict()}
+
+
+MAX_PAGE_SIZE = 1000
+MAX_HOPS = 3
+
+
+@app.route("/graph/<meta_model_name>/nodes/", methods=["GET"])
+def query_nodes(meta_model_name: str):
+    limit = request.args.get("limit", 100, type=int)
+    if limit < 1:
+        flask.abort(400)
+    store = open_graph_store(meta_model_name)
+    if store is None:
+        flask.abort(404)
+    with store:
+        page = store.query_nodes(
+            entity_type=request.args.get("type"),
+            aspect=request.args.get("aspect"),
+            source_file=request.args.get("source"),
+            name_prefix=request.args.get("prefix"),
+            after=request.args.get("after", type=int),
+            limit=min(limit, MAX_PAGE_SIZE),
+        )
+    return {"nodes": [n.to_dict() for n in page.items], "next": page.cursor}
+
+
+@app.route("/graph/<meta_model_name>/nodes/<node_id>/neighbourhood/", methods=["GET"])
+def node_neighbourhood(meta_model_name: str, node_id: str):
+    store = open_graph_store(meta_model_name)
+    if store is None:
+        flask.abort(404)
+    with store:
+        if store.get_node(node_id) is None:
+            flask.abort(404)
+        hops = min(request.args.get("hops", 1, type=int), MAX_HOPS)
+        nodes, edges = store.neighbourhood(node_id, hops=hops)
+    return {
+        "nodes": [n.to_dict() for n in nodes],
+        "edges": [e.to_dict() for e in edges],
+    }
+
+
+@app.route("/graph/<meta_model_name>/viewport/", methods=["GET"])
+def graph_viewport(meta_model_name: str):
+    bounds = [request.args.get(k, type=float) for k in ["minX", "minY", "maxX", "maxY"]]
+    limit = request.args.get("limit", type=int)
+    if None in bounds or (limit is not None and limit < 1):
+        flask.abort(400)
+    store = open_graph_store(meta_model_name)
+    if store is None:
+        flask.abort(404)
+    with store:
+        nodes, edges, truncated = store.viewport(*bounds, limit=limit)
+    return {
+        "nodes": [n.to_dict() for n in nodes],
+        "edges": [e.to_dict() for e in edges],
+        "truncated": truncated,
+    }
+
+
+@app.route("/graph/<meta_model_name>/similar/", methods=["GET"])
+def similar_nodes(meta_model_name: str):
+    name = request.args.get("name")
+    if name is None:
+        flask.abort(400)
+    store = open_graph_store(meta_model_name)
+    if store is None:
+        flask.abort(404)
+
+    encoder = embedding.HashingEncoder()
+    with store:
+        index = load_node_index(meta_model_name, store, encoder)
+        results = index.query(
+            encoder.encode([name])[0],
+            k=min(request.args.get("k", 10, type=int), MAX_PAGE_SIZE),
+            min_similarity=request.args.get("min", 0.0, type=float),
+        )
+        nodes = [(store.get_node(node_id), s) for node_id, s in results]
+    return [{"node": n.to_dict(), "similarity": s} for n, s in nodes if n is not None]
+
+
+@app.route("/graph/<meta_model_name>/edges/", methods=["POST"])
+def query_edges(meta_model_name: str):
+    query = request.get_json(silent=True)
+    if not isinstance(query, dict):
+        flask.abort(400)
+    node_ids = query.get("nodes")
+    after = query.get("after")
+    limit = query.get("limit", 100)
+    if (
+        not isinstance(node_ids, list)
+        or not all(isinstance(n, str) for n in node_ids)
+        or not (after is None or isinstance(after, int))
+        or not isinstance(limit, int)
+        or limit < 1
+    ):
+        flask.abort(400)
+
+    store = open_graph_store(meta_model_name)
+    if store is None:
+        flask.abort(404)
+    with store:
+        page = store.edges_between(
+            node_ids, after=after, limit=min(limit, MAX_PAGE_SIZE)
+        )
+    return {"edges": [e.to_dict() for e in page.items], "next": page.cursor}
+
+
+@app.route("/graph/<meta_model_name>/nodes/<node_id>/", methods=["PATCH"])
+def patch_node(meta_model_name: str, node_id: str):
+    store = open_graph_store(meta_model_name)
+    if store is None:
+        flask.abort(404)
+
+    changes = request.json
+    position = None
+    if "position" in changes:
+        position = (changes["position"]["x"], changes["position"]["y"])
+
+    with store:
+        node = store.update_node(node_id, name=changes.get("name"), position=position)
+    if node is None:
+        flask.abort(404)
+    return {"success": True, "node": node.to_dict()}
+
+
+def merge_node_matcher(name: str | None):
+    """
+    Node matcher used to merge an extracted graph into the stored one.
+    "embedding" compares name embeddings and only scores candidate pairs from
+    a vector index, which keeps merges into large graphs fast.
+    """
+    if name == "embedding":
+        return embedding.EmbeddingNodeMatcher(similarity_threshold=0.7)
+    if name not in (None, "", "text"):
+        flask.abort(400)
+    return match.node_matcher(
+        text_matcher=match.char_similarity, similarity_threshold=0.8
+    )
 
 
 @app.route("/graph/extract/", methods=["POST"])
@@ -75,6 +349,7 @@ def extract_knowledge_graph():
     file = request.files["file"]
 
     meta_model_name = request.form.get("metaModel")
+    match_node = merge_node_matcher(request.form.get("matcher"))
     application_model_path = application_models_directory / f"{meta_model_name}.json"
 
     loading_step = FileLoader()
@@ -92,10 +367,9 @@ def extract_knowledge_graph():
     prompt_step = PromptCreation()
 
     existing_graph: kg.Graph | None = None
-    results_file_path = model_instances_directory / f"{meta_model_name}.json"
-    if os.path.isfile(results_file_path):
-        existing_graph = kg.Graph.load(results_file_path)
-        existing_graph.save(str(results_file_path) + ".bkp")
+    with open_graph_store(meta_model_name, create=True) as store:
+        if store.num_nodes > 0:
+            existing_graph = store.load_graph()
 
     graph = prompt_step.run(
         model=Models.GPT_4o_2024_05_13.value,
@@ -107,14 +381,34 @@ def extract_knowledge_graph():
         graph = existing_graph.merge(
             graph,
             match_edge=match.strict_edge_matcher,
-            match_node=match.node_matcher(
-                text_matcher=match.char_similarity, similarity_threshold=0.8
-            ),
+            match_node=match_node,
+            partition_by_type=True,
+            processes=REQUEST_PROCESSES,
+        )
+
+    if existing_graph is None:
+        graph = graph.layout(cache=layout_cache, processes=REQUEST_PROCESSES)
+    else:
+        graph = graph.layout(
+            fixed_positions={n.id: n.position for n in existing_graph.nodes},
+            cache=layout_cache,
+            processes=REQUEST_PROCESSES,
         )
+    with open_graph_store(meta_model_name, create=True) as store:
+        graph.to_store(store)
+    version = commit_version(
+        meta_model_name, graph, f"Extracted {file.filename}", existing_graph
+    )
 
-    graph = graph.layout()
-    graph.save(results_file_path)
-    return {"success": True, "graph": graph.to_dict()}
+    # clients that still hold an earlier version only need what changed since
+    client_version = request.form.get("since", type=int)
+    if client_version is not None:
+        try:
+            delta = graph_history(meta_model_name).delta(client_version, version)
+            return {"success": True, "version": version, "delta": delta.to_dict()}
+        except KeyError:
+            pass
+    return {"success": True, "version": version, "graph": graph.to_dict()}
 
 
 @app.route("/model/extract", methods=["POST"])
@@ -124,7 +418,7 @@ def import_meta_model():
     model_name = data["name"]
     application_model_path = application_models_directory / f"{model_name}.json"
     application_model = parse_xml_file(file.stream)
-    application_model.layout()
+    application_model.layout(processes=REQUEST_PROCESSES)
     application_model.save(application_model_path)
 
     return {"success": True}
@@ -175,7 +469,9 @@ def patch_meta_model(name: str):
         list(entities.values()), list(relations.values())
     )
 
-    application_model = application_model.layout()
+    application_model = application_model.layout(
+        cache=layout_cache, processes=REQUEST_PROCESSES
+    )
     application_model.save(application_model_path)
 
     return {
@@ -1,11 +1,18 @@
+import concurrent.futures
+import contextlib
+import io
 import json
+import multiprocessing
+import os
 import pathlib
 import typing
 
+import numpy as np
 from dotenv import load_dotenv
 
 from evaluation import pet, metrics
 from model import knowledge_graph as kg
+from model import match
 from model import meta_model as mm
 from model.application_model import ApplicationModel
 from pipeline.llm_models import Models
@@ -67,90 +74,97 @@ def pet_document_to_graph(doc: pet.PetDocument) -> kg.Graph:
     return kg.Graph(nodes=list(nodes), edges=edges)
 
 
-def run_pet_experiments():
-    document_path = (
-        pathlib.Path(__file__).parent.parent.absolute()
-        / "res"
-        / "experiments"
-        / "pet"
-        / "all.new.jsonl"
-    )
-    documents = pet.NewPetFormatImporter(document_path).do_import()
+PET_DIRECTORY = (
+    pathlib.Path(__file__).parent.parent.absolute() / "res" / "experiments" / "pet"
+)
 
-    application_model_path = (
-        pathlib.Path(__file__).parent.parent.absolute()
-        / "res"
-        / "result"
-        / "application-models"
-        / "pet.json"
-    )
+# next to the script that prints them
+PET_RESULTS_FILE = (
+    pathlib.Path(__file__).parent / "res" / "experiments" / "pet" / "results.json"
+)
 
-    graph_folder = (
-        pathlib.Path(__file__).parent.parent.absolute()
-        / "res"
-        / "experiments"
-        / "pet"
-        / "generic-method"
-    )
-    graph_folder.mkdir(exist_ok=True, parents=True)
+METRIC_NAMES = ["gde", "gde_lower", "p", "r", "f1", "f2", "rel_p", "rel_r", "rel_f1"]
 
-    model = Models.GPT_4o_2024_05_13.value
+# tagged strings known to this worker process, only new ones are sent back
+_known_tags: typing.Set[str] = set()
 
-    spec_metrics = {"gde": [], "p": [], "r": [], "f1": [], "f2": []}
 
-    generic_metrics = {"gde": [], "p": [], "r": [], "f1": [], "f2": []}
+def _init_metrics_worker(tagging_cache_path: pathlib.Path) -> None:
+    match.tagging_cache.load(tagging_cache_path)
+    _known_tags.update(s for s, _ in match.tagging_cache.items())
 
-    for document in documents:
-        print(f"{document.name} ------------------------- ")
-
-        expected_graph_path = (
-            pathlib.Path(__file__).parent.parent.absolute()
-            / "res"
-            / "experiments"
-            / "pet"
-            / "expected"
-            / f"{document.id}.json"
-        )
-        expected_graph_path.parent.mkdir(exist_ok=True, parents=True)
-        expected_graph = pet_document_to_graph(document)
-        expected_graph.save(expected_graph_path)
-
-        specific_prompt_path = (
-            pathlib.Path(__file__).parent.parent.absolute()
-            / "res"
-            / "experiments"
-            / "pet"
-            / "specific-prompt"
-            / f"{document.id}.json"
-        )
-        specific_prompt_path.parent.mkdir(exist_ok=True, parents=True)
-        specific_prompt_graph = pet_document_to_graph(
-            pet.NewPetFormatImporter(specific_prompt_path).do_import()[0]
-        )
-        specific_prompt_graph.save(
-            specific_prompt_path.parent / f"graph-{document.id}.json"
-        )
-
-        if not (graph_folder / f"{document.name}.json").exists():
-            application_model = ApplicationModel.load(application_model_path)
-            prompt_step = PromptCreation()
-            file = ParsedFile(
-                name=document.name, number_of_pages=1, content=document.text
-            )
-            generic_method_graph = prompt_step.run(
-                model=model,
-                application_model=application_model,
-                parsed_file=file,
-                current_graph=None,
-            )
-            generic_method_graph.save(graph_folder / f"{document.name}.json")
-        else:
-            generic_method_graph = kg.Graph.load(graph_folder / f"{document.name}.json")
+
+def _load_graphs(
+    document: pet.PetDocument,
+    model,
+    application_model_path: pathlib.Path,
+    graph_folder: pathlib.Path,
+) -> typing.Tuple[kg.Graph, kg.Graph, kg.Graph]:
+    """
+    Expected graph, graph of the specific prompt and graph of the generic
+    method for one document. The generic method's graph is only extracted
+    by the LLM if there is no stored result from an earlier run.
+    """
+    expected_graph_path = PET_DIRECTORY / "expected" / f"{document.id}.json"
+    expected_graph_path.parent.mkdir(exist_ok=True, parents=True)
+    expected_graph = pet_document_to_graph(document)
+    expected_graph.save(expected_graph_path)
+
+    specific_prompt_path = PET_DIRECTORY / "specific-prompt" / f"{document.id}.json"
+    specific_prompt_path.parent.mkdir(exist_ok=True, parents=True)
+    specific_prompt_graph = pet_document_to_graph(
+        pet.NewPetFormatImporter(specific_prompt_path).do_import()[0]
+    )
+    specific_prompt_graph.save(
+        specific_prompt_path.parent / f"graph-{document.id}.json"
+    )
+
+    if not (graph_folder / f"{document.name}.json").exists():
+        application_model = ApplicationModel.load(application_model_path)
+        prompt_step = PromptCreation()
+        file = ParsedFile(name=document.name, number_of_pages=1, content=document.text)
+        generic_method_graph = prompt_step.run(
+            model=model,
+            application_model=application_model,
+            parsed_file=file,
+            current_graph=None,
+        )
+        generic_method_graph.save(graph_folder / f"{document.name}.json")
+    else:
+        generic_method_graph = kg.Graph.load(graph_folder / f"{document.name}.json")
+
+    return expected_graph, specific_prompt_graph, generic_method_graph
+
+
+def _compute_metrics(
+    expected_graph: kg.Graph,
+    specific_prompt_graph: kg.Graph,
+    generic_method_graph: kg.Graph,
+) -> typing.Tuple[dict, str, typing.List[typing.Tuple[str, typing.Any]]]:
+    """
+    Metrics of both methods for one document, along with everything printed
+    while computing them and the strings tagged that this process did not know
+    before, so the caller can add them to its tagging cache.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        # relations are scored with the same node assignment as the nodes
+        specific_matches = metrics.optimal_matching(
+            specific_prompt_graph, expected_graph
+        )
+        generic_matches = metrics.optimal_matching(generic_method_graph, expected_graph)
 
         specific_stats = metrics.get_stats(
             predicted_graph=specific_prompt_graph,
             reference_graph=expected_graph,
             threshold=0.2,
+            matches=specific_matches,
+        )
+        specific_relation_stats = metrics.get_relation_stats(
+            predicted_graph=specific_prompt_graph,
+            reference_graph=expected_graph,
+            threshold=0.2,
+            matches=specific_matches,
         )
 
         generic_stats = metrics.get_stats(
@@ -158,64 +172,219 @@ def run_pet_experiments():
             reference_graph=expected_graph,
             threshold=0.2,
             verbose=True,
+            matches=generic_matches,
+        )
+        generic_relation_stats = metrics.get_relation_stats(
+            predicted_graph=generic_method_graph,
+            reference_graph=expected_graph,
+            threshold=0.2,
+            matches=generic_matches,
         )
 
-        spec_metrics["r"].append(specific_stats.recall)
-        spec_metrics["p"].append(specific_stats.precision)
-        spec_metrics["f1"].append(specific_stats.f1)
-        spec_metrics["f2"].append(specific_stats.f_beta(2))
-
-        generic_metrics["r"].append(generic_stats.recall)
-        generic_metrics["p"].append(generic_stats.precision)
-        generic_metrics["f1"].append(generic_stats.f1)
-        generic_metrics["f2"].append(generic_stats.f_beta(2))
-
-        specific_prompt_gde = specific_prompt_graph.graph_edit_distance(
-            expected_graph, timeout_seconds=5 * 60
+        # exact GED is exponential, bounds are enough to compare the methods
+        specific_prompt_gde = specific_prompt_graph.approximate_graph_edit_distance(
+            expected_graph
         )
-        generic_method_gde = generic_method_graph.graph_edit_distance(
-            expected_graph, timeout_seconds=5 * 60
+        generic_method_gde = generic_method_graph.approximate_graph_edit_distance(
+            expected_graph
         )
 
-        spec_metrics["gde"].append(specific_prompt_gde)
-        generic_metrics["gde"].append(generic_method_gde)
-
         print(
             f"specific --- "
             f"p: {specific_stats.precision:.2f}, "
             f"r: {specific_stats.recall:.2f}, "
-            f"f1: {specific_stats.f1:.2f}"
+            f"f1: {specific_stats.f1:.2f}, "
+            f"relation f1: {specific_relation_stats.f1:.2f}, "
+            f"ged: [{specific_prompt_gde.lower:.1f}, {specific_prompt_gde.upper:.1f}]"
         )
         print(
             f"generic  --- "
             f"p: {generic_stats.precision:.2f}, "
             f"r: {generic_stats.recall:.2f}, "
-            f"f1: {generic_stats.f1:.2f}"
+            f"f1: {generic_stats.f1:.2f}, "
+            f"relation f1: {generic_relation_stats.f1:.2f}, "
+            f"ged: [{generic_method_gde.lower:.1f}, {generic_method_gde.upper:.1f}]"
         )
-        print()
-        print()
 
-    print("-------------------")
-    print(
-        "Special Prompt:",
-        f"p: {sum(spec_metrics['p']) / len(spec_metrics['p']):.2f}",
-        f"r: {sum(spec_metrics['r']) / len(spec_metrics['r']):.2f}",
-        f"f1: {sum(spec_metrics['f1']) / len(spec_metrics['f1']):.2f}",
-        f"f2: {sum(spec_metrics['f2']) / len(spec_metrics['f2']):.2f}",
-    )
-    print(
-        "Generic Method:",
-        f"p: {sum(generic_metrics['p']) / len(generic_metrics['p']):.2f}",
-        f"r: {sum(generic_metrics['r']) / len(generic_metrics['r']):.2f}",
-        f"f1: {sum(generic_metrics['f1']) / len(generic_metrics['f1']):.2f}",
-        f"f2: {sum(generic_metrics['f2']) / len(generic_metrics['f2']):.2f}",
+    document_metrics = {
+        "specific": {
+            "gde": specific_prompt_gde.upper,
+            "gde_lower": specific_prompt_gde.lower,
+            "p": specific_stats.precision,
+            "r": specific_stats.recall,
+            "f1": specific_stats.f1,
+            "f2": specific_stats.f_beta(2),
+            "rel_p": specific_relation_stats.precision,
+            "rel_r": specific_relation_stats.recall,
+            "rel_f1": specific_relation_stats.f1,
+        },
+        "generic": {
+            "gde": generic_method_gde.upper,
+            "gde_lower": generic_method_gde.lower,
+            "p": generic_stats.precision,
+            "r": generic_stats.recall,
+            "f1": generic_stats.f1,
+            "f2": generic_stats.f_beta(2),
+            "rel_p": generic_relation_stats.precision,
+            "rel_r": generic_relation_stats.recall,
+            "rel_f1": generic_relation_stats.f1,
+        },
+    }
+
+    new_tags = [(s, t) for s, t in match.tagging_cache.items() if s not in _known_tags]
+    _known_tags.update(s for s, _ in new_tags)
+    return document_metrics, output.getvalue(), new_tags
+
+
+def _has_checkpoint(file_path: pathlib.Path) -> bool:
+    # checkpoints written before a metric was added are evaluated again
+    if not file_path.exists():
+        return False
+    with open(file_path) as f:
+        document_metrics = json.load(f)
+    return all(
+        m in document_metrics.get(method, {})
+        for method in ["specific", "generic"]
+        for m in METRIC_NAMES
     )
 
-    results_file = (
-        pathlib.Path(__file__).parent / "res" / "experiments" / "pet" / "results.json"
+
+def _mean(values: typing.List[float]) -> float:
+    return sum(values) / len(values) if len(values) > 0 else float("nan")
+
+
+def _save_checkpoint(file_path: pathlib.Path, document_metrics: dict) -> None:
+    # written to a temporary file first, an interrupted run never leaves a
+    # truncated checkpoint behind
+    temporary_path = file_path.with_suffix(".tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(document_metrics, f)
+    os.replace(temporary_path, file_path)
+
+
+def run_pet_experiments(llm_workers: int = 4, cpu_workers: typing.Optional[int] = None):
+    """
+    Evaluates both methods on all PET documents. Documents are processed
+    concurrently, at most `llm_workers` of them in the LLM bound extraction
+    stage and `cpu_workers` in the CPU bound metrics stage at a time. Metrics
+    of every finished document are stored right away, and documents that
+    already have stored metrics are skipped, so an interrupted run can simply
+    be started again.
+    """
+    document_path = PET_DIRECTORY / "all.new.jsonl"
+    documents = pet.NewPetFormatImporter(document_path).do_import()
+
+    application_model_path = (
+        pathlib.Path(__file__).parent.parent.absolute()
+        / "res"
+        / "result"
+        / "application-models"
+        / "pet.json"
     )
-    results_file.parent.mkdir(exist_ok=True, parents=True)
-    with open(results_file, "w") as f:
+
+    graph_folder = PET_DIRECTORY / "generic-method"
+    graph_folder.mkdir(exist_ok=True, parents=True)
+
+    checkpoint_folder = PET_DIRECTORY / "checkpoints"
+    checkpoint_folder.mkdir(exist_ok=True, parents=True)
+
+    model = Models.GPT_4o_2024_05_13.value
+
+    # names repeat a lot across documents and runs, tagging them is expensive
+    tagging_cache_path = PET_DIRECTORY / "tagging-cache.json"
+    match.tagging_cache.load(tagging_cache_path)
+
+    remaining = [
+        d for d in documents if not _has_checkpoint(checkpoint_folder / f"{d.id}.json")
+    ]
+    print(f"{len(documents) - len(remaining)} documents already evaluated")
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=llm_workers
+        ) as llm_pool, concurrent.futures.ProcessPoolExecutor(
+            max_workers=cpu_workers,
+            # forking while the LLM threads run can copy locks they hold
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_metrics_worker,
+            initargs=(tagging_cache_path,),
+        ) as cpu_pool:
+            loading = {
+                llm_pool.submit(
+                    _load_graphs, d, model, application_model_path, graph_folder
+                ): d
+                for d in remaining
+            }
+            evaluating = {}
+            while len(loading) + len(evaluating) > 0:
+                done, _ = concurrent.futures.wait(
+                    list(loading) + list(evaluating),
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    stage = loading if future in loading else evaluating
+                    document = stage.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # no checkpoint is written, the next run tries again
+                        print(f"{document.name} failed: {e!r}")
+                        continue
+
+                    if stage is loading:
+                        evaluating[cpu_pool.submit(_compute_metrics, *result)] = (
+                            document
+                        )
+                        continue
+
+                    document_metrics, output, new_tags = result
+                    for s, tagged in new_tags:
+                        match.tagging_cache.put(s, tagged)
+                    _save_checkpoint(
+                        checkpoint_folder / f"{document.id}.json", document_metrics
+                    )
+                    print(f"{document.name} ------------------------- ")
+                    print(output)
+                    print()
+    finally:
+        match.tagging_cache.save(tagging_cache_path)
+
+    spec_metrics = {m: [] for m in METRIC_NAMES}
+    generic_metrics = {m: [] for m in METRIC_NAMES}
+    evaluated = [
+        d for d in documents if _has_checkpoint(checkpoint_folder / f"{d.id}.json")
+    ]
+    if len(evaluated) < len(documents):
+        print(f"{len(documents) - len(evaluated)} documents failed, run again")
+    for document in evaluated:
+        with open(checkpoint_folder / f"{document.id}.json") as f:
+            document_metrics = json.load(f)
+        for m in METRIC_NAMES:
+            spec_metrics[m].append(document_metrics["specific"][m])
+            generic_metrics[m].append(document_metrics["generic"][m])
+
+    if len(evaluated) == 0:
+        print("No documents evaluated")
+        return
+
+    print("-------------------")
+    for label, method_metrics in [
+        ("Special Prompt:", spec_metrics),
+        ("Generic Method:", generic_metrics),
+    ]:
+        print(
+            label,
+            f"p: {_mean(method_metrics['p']):.2f}",
+            f"r: {_mean(method_metrics['r']):.2f}",
+            f"f1: {_mean(method_metrics['f1']):.2f}",
+            f"f2: {_mean(method_metrics['f2']):.2f}",
+            f"relation f1: {_mean(method_metrics['rel_f1']):.2f}",
+            f"ged: [{_mean(method_metrics['gde_lower']):.1f}, "
+            f"{_mean(method_metrics['gde']):.1f}]",
+        )
+
+    PET_RESULTS_FILE.parent.mkdir(exist_ok=True, parents=True)
+    with open(PET_RESULTS_FILE, "w") as f:
         json.dump(
             {
                 "specific_metrics": spec_metrics,
@@ -225,6 +394,48 @@ def run_pet_experiments():
         )
 
 
+def sweep_pet_thresholds(
+    thresholds: typing.Sequence[float] = tuple(np.linspace(0.0, 1.0, 21)),
+):
+    """
+    Macro averaged metrics of the generic method on all PET documents for
+    every threshold, with one matching per document.
+    """
+    documents = pet.NewPetFormatImporter(PET_DIRECTORY / "all.new.jsonl").do_import()
+    application_model_path = (
+        pathlib.Path(__file__).parent.parent.absolute()
+        / "res"
+        / "result"
+        / "application-models"
+        / "pet.json"
+    )
+    model = Models.GPT_4o_2024_05_13.value
+
+    sweeps = []
+    for document in documents:
+        expected_graph, _, generic_method_graph = _load_graphs(
+            document, model, application_model_path, PET_DIRECTORY / "generic-method"
+        )
+        sweeps.append(
+            metrics.sweep_thresholds(
+                predicted_graph=generic_method_graph,
+                reference_graph=expected_graph,
+                thresholds=thresholds,
+            )
+        )
+
+    averaged = metrics.macro_average(sweeps)
+    for i, threshold in enumerate(thresholds):
+        print(
+            f"{threshold:.2f} --- "
+            f"p: {averaged['p'][i]:.2f}, "
+            f"r: {averaged['r'][i]:.2f}, "
+            f"f1: {averaged['f1'][i]:.2f}, "
+            f"f2: {averaged['f2'][i]:.2f}"
+        )
+    return averaged
+
+
 if __name__ == "__main__":
     load_dotenv()
     run_pet_experiments()
@@ -3,10 +3,11 @@ import json
 import pathlib
 import re
 import typing
-from collections import defaultdict
+from collections import Counter
 
 import nltk
 import numpy as np
+from scipy import sparse
 from scipy.optimize import linear_sum_assignment
 
 import model.knowledge_graph as kg
@@ -20,11 +21,14 @@ from model import match
 class MatchNode:
     text: str
     type: str
+    id: typing.Optional[str] = None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class MatchRelation:
-    pass
+    type: str
+    source: str
+    target: str
 
 
 @dataclasses.dataclass
@@ -45,80 +49,104 @@ def optimal_matching(
     predicted_graph: kg.Graph,
     reference_graph: kg.Graph,
 ) -> typing.List[Match]:
+    """
+    Assigns predictions to ground truth nodes so that the total similarity is
+    maximal, pairs of different types have a similarity of 0. The shorter
+    list is padded with `None`, so every prediction and every ground truth
+    node is part of exactly one match.
+    """
     predictions = [
-        MatchNode(text=n.name, type=n.entity.name) for n in predicted_graph.nodes
+        MatchNode(text=n.name, type=n.entity.name, id=n.id)
+        for n in predicted_graph.nodes
     ]
     ground_truth = [
-        MatchNode(text=n.name, type=n.entity.name) for n in reference_graph.nodes
+        MatchNode(text=n.name, type=n.entity.name, id=n.id)
+        for n in reference_graph.nodes
     ]
 
-    similarity_dict = get_similarity_dictionary(predicted_graph, reference_graph)
-
-    len_extracted = len(predictions)
-    len_ground_truth = len(ground_truth)
-
-    # pad with dummy nodes (None values)
-    if len_extracted < len_ground_truth:
-        predictions += [None] * (len_ground_truth - len_extracted)
-    if len_ground_truth < len_extracted:
-        ground_truth += [None] * (len_extracted - len_ground_truth)
-
-    # Similarity matrix
-    cost_matrix = np.zeros((len(predictions), len(ground_truth)))
-
-    for i, pred in enumerate(predictions):
-        for j, true in enumerate(ground_truth):
-            if pred is None or true is None:
-                similarity = 0.0
-            elif pred.type.lower() != true.type.lower():
-                similarity = 0.0
-            else:
-                similarity = similarity_dict.get(pred.text, {}).get(true.text, 0.0)
-            cost_matrix[i, j] = -similarity
+    predicted_types = np.array([p.type.lower() for p in predictions], dtype=object)
+    reference_types = np.array([t.type.lower() for t in ground_truth], dtype=object)
+    similarities = np.where(
+        predicted_types[:, np.newaxis] == reference_types[np.newaxis, :],
+        similarity_matrix(
+            [p.text for p in predictions], [t.text for t in ground_truth]
+        ),
+        0.0,
+    )
+
+    # one square problem, not one per type: pairs with a similarity of 0 are
+    # ties, and which of them are formed decides the counts at threshold 0
+    size = max(len(predictions), len(ground_truth))
+    cost_matrix = np.zeros((size, size))
+    cost_matrix[: len(predictions), : len(ground_truth)] = -similarities
+    predictions += [None] * (size - len(predictions))
+    ground_truth += [None] * (size - len(ground_truth))
 
-    # Apply Hungarian Algorithm to find an optimal matching
     row_indices, col_indices = linear_sum_assignment(cost_matrix)
+    return [
+        Match(predictions[i], ground_truth[j], similarity=-cost_matrix[i, j])
+        for i, j in zip(row_indices, col_indices)
+    ]
+
 
-    # Build matches
-    matches = []
-    for i, j in zip(row_indices, col_indices):
-        pred = predictions[i]
-        true = ground_truth[j]
-        similarity = -cost_matrix[i, j]
-        matches.append(
-            Match(
-                pred,
-                true,
-                similarity=similarity,
-            )
+def similarity_matrix(
+    predicted_names: typing.List[str], reference_names: typing.List[str]
+) -> np.ndarray:
+    """
+    `match.overlap_similarity` (ignoring determiners) of all pairs of names,
+    computed as one sparse matrix product. Pairs of names that both have no
+    tokens left get a similarity of 0.
+    """
+    tokens = {
+        name: match.prepare_overlap(name, ignored_pos_tags=["det"])
+        for name in predicted_names + reference_names
+    }
+    vocabulary: typing.Dict[str, int] = {}
+
+    def token_counts(names: typing.List[str]) -> sparse.csr_matrix:
+        rows, columns = [], []
+        for row, name in enumerate(names):
+            for token in tokens[name]:
+                rows.append(row)
+                columns.append(vocabulary.setdefault(token, len(vocabulary)))
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)), shape=(len(names), len(vocabulary))
         )
 
-    return matches
+    predicted_counts = token_counts(predicted_names)
+    reference_counts = token_counts(reference_names)
+    shape = (len(vocabulary),)
+    predicted_counts.resize((len(predicted_names), *shape))
+    reference_counts.resize((len(reference_names), *shape))
+
+    # tokens of the prediction that occur anywhere in the reference, counted
+    # with repetitions, like overlap_score does
+    reference_contains = (reference_counts > 0).astype(float)
+    same_tokens = (predicted_counts @ reference_contains.T).toarray()
+    lengths = np.maximum.outer(
+        np.array([len(tokens[n]) for n in predicted_names], dtype=float),
+        np.array([len(tokens[n]) for n in reference_names], dtype=float),
+    )
+    return np.divide(
+        same_tokens, lengths, out=np.zeros_like(same_tokens), where=lengths > 0
+    )
 
 
 def get_similarity_dictionary(
     predicted_graph: kg.Graph,
     reference_graph: kg.Graph,
 ) -> dict:
-    similarities = defaultdict(dict)
-
-    predictions = [
-        MatchNode(text=n.name, type=n.entity.name) for n in predicted_graph.nodes
-    ]
-    ground_truth = [
-        MatchNode(text=n.name, type=n.entity.name) for n in reference_graph.nodes
-    ]
+    predicted_names = [n.name for n in predicted_graph.nodes]
+    reference_names = [n.name for n in reference_graph.nodes]
+    similarities = similarity_matrix(predicted_names, reference_names)
 
-    for extracted_mention in predictions:
-        extracted_name = extracted_mention.text
-        for ground_truth_mention in ground_truth:
-            ground_truth_name = ground_truth_mention.text
-            similarity = match.overlap_similarity(
-                extracted_name, ground_truth_name, ignored_pos_tags=["det"]
-            )
-            similarities[extracted_name][ground_truth_name] = similarity
-
-    return dict(similarities)
+    return {
+        extracted_name: {
+            ground_truth_name: float(similarities[i, j])
+            for j, ground_truth_name in enumerate(reference_names)
+        }
+        for i, extracted_name in enumerate(predicted_names)
+    }
 
 
 def calculate_precision(correct_matches: int, incorrect_matches: int) -> float:
@@ -202,6 +230,7 @@ def get_stats(
     reference_graph: kg.Graph,
     threshold: float = 0.4,
     verbose: bool = False,
+    matches: typing.Optional[typing.List[Match]] = None,
 ) -> Stats:
     predictions = [
         MatchNode(text=n.name, type=n.entity.name) for n in predicted_graph.nodes
@@ -210,7 +239,8 @@ def get_stats(
         MatchNode(text=n.name, type=n.entity.name) for n in reference_graph.nodes
     ]
 
-    matches = optimal_matching(predicted_graph, reference_graph)
+    if matches is None:
+        matches = optimal_matching(predicted_graph, reference_graph)
 
     num_gold = len(ground_truth)
     num_pred = len(predictions)
@@ -255,6 +285,169 @@ def get_stats(
     return Stats(num_ok=num_ok, num_wrong=non_ok, num_gold=num_gold, num_pred=num_pred)
 
 
+def get_relation_stats(
+    *,
+    predicted_graph: kg.Graph,
+    reference_graph: kg.Graph,
+    threshold: float = 0.4,
+    matches: typing.Optional[typing.List[Match]] = None,
+) -> Stats:
+    """
+    Scores edges instead of nodes. Predicted nodes are mapped to the ground
+    truth nodes they were assigned to by `optimal_matching` (if at least
+    `threshold` similar), and a predicted edge is correct if the reference
+    has an edge of the same type between the mapped nodes. Pass the matches
+    of an earlier `optimal_matching` call to not compute them again.
+    """
+    if matches is None:
+        matches = optimal_matching(predicted_graph, reference_graph)
+    node_mapping = {
+        m.prediction.id: m.ground_truth.id
+        for m in matches
+        if m.prediction is not None
+        and m.ground_truth is not None
+        and m.similarity >= threshold
+        # like get_stats, nodes of different types are never correct
+        and m.prediction.type.lower() == m.ground_truth.type.lower()
+    }
+
+    reference_relations = Counter(
+        MatchRelation(type=e.type.lower(), source=e.source.id, target=e.target.id)
+        for e in reference_graph.edges
+    )
+
+    num_ok = 0
+    for e in predicted_graph.edges:
+        if e.source.id not in node_mapping or e.target.id not in node_mapping:
+            continue
+        relation = MatchRelation(
+            type=e.type.lower(),
+            source=node_mapping[e.source.id],
+            target=node_mapping[e.target.id],
+        )
+        # every reference edge can only be found once
+        if reference_relations[relation] > 0:
+            reference_relations[relation] -= 1
+            num_ok += 1
+
+    num_pred = len(predicted_graph.edges)
+    return Stats(
+        num_ok=num_ok,
+        num_wrong=num_pred - num_ok,
+        num_gold=len(reference_graph.edges),
+        num_pred=num_pred,
+    )
+
+
+@dataclasses.dataclass
+class ThresholdSweep:
+    """
+    `Stats` for a whole array of similarity thresholds at once. Adding two
+    sweeps sums their counts, i.e. micro averages them.
+    """
+
+    thresholds: np.ndarray
+    num_ok: np.ndarray
+    num_wrong: np.ndarray
+    num_gold: float
+    num_pred: float
+
+    def __add__(self, other: "ThresholdSweep") -> "ThresholdSweep":
+        assert np.array_equal(self.thresholds, other.thresholds)
+        return ThresholdSweep(
+            thresholds=self.thresholds,
+            num_ok=self.num_ok + other.num_ok,
+            num_wrong=self.num_wrong + other.num_wrong,
+            num_gold=self.num_gold + other.num_gold,
+            num_pred=self.num_pred + other.num_pred,
+        )
+
+    @staticmethod
+    def _ratio(num_ok: np.ndarray, total: float) -> np.ndarray:
+        # same conventions as Stats for empty graphs
+        if total == 0:
+            return np.where(num_ok == 0, 1.0, 0.0)
+        return num_ok / total
+
+    @property
+    def recall(self) -> np.ndarray:
+        return self._ratio(self.num_ok, self.num_gold)
+
+    @property
+    def precision(self) -> np.ndarray:
+        return self._ratio(self.num_ok, self.num_pred)
+
+    @property
+    def f1(self) -> np.ndarray:
+        return self.f_beta(1)
+
+    def f_beta(self, beta: float) -> np.ndarray:
+        assert beta > 0
+        p = self.precision
+        r = self.recall
+        numerator = (p * beta**2) + r
+        return np.divide(
+            (1 + beta**2) * p * r,
+            numerator,
+            out=np.zeros_like(numerator, dtype=float),
+            where=numerator != 0,
+        )
+
+    def stats(self, index: int) -> Stats:
+        return Stats(
+            num_ok=int(self.num_ok[index]),
+            num_wrong=int(self.num_wrong[index]),
+            num_gold=self.num_gold,
+            num_pred=self.num_pred,
+        )
+
+
+def sweep_thresholds(
+    *,
+    predicted_graph: kg.Graph,
+    reference_graph: kg.Graph,
+    thresholds: typing.Sequence[float],
+) -> ThresholdSweep:
+    """
+    Evaluates all thresholds with a single matching, gives the same counts
+    of correct predictions as calling `get_stats` once per threshold.
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    matches = optimal_matching(predicted_graph, reference_graph)
+    similarities = np.array(
+        [
+            m.similarity
+            for m in matches
+            if m.prediction is not None
+            and m.ground_truth is not None
+            and m.prediction.type.lower() == m.ground_truth.type.lower()
+        ]
+    )
+    num_ok = (similarities[:, np.newaxis] >= thresholds[np.newaxis, :]).sum(axis=0)
+    return ThresholdSweep(
+        thresholds=thresholds,
+        num_ok=num_ok,
+        # every match that is not correct is wrong, like in get_stats
+        num_wrong=len(matches) - num_ok,
+        num_gold=len(reference_graph.nodes),
+        num_pred=len(predicted_graph.nodes),
+    )
+
+
+def macro_average(
+    sweeps: typing.List[ThresholdSweep], beta: float = 2
+) -> typing.Dict[str, np.ndarray]:
+    """
+    Precision, recall, F1 and F-beta per threshold, averaged over documents.
+    """
+    return {
+        "p": np.mean([s.precision for s in sweeps], axis=0),
+        "r": np.mean([s.recall for s in sweeps], axis=0),
+        "f1": np.mean([s.f1 for s in sweeps], axis=0),
+        f"f{beta:g}": np.mean([s.f_beta(beta) for s in sweeps], axis=0),
+    }
+
+
 if __name__ == "__main__":
 
     def main():
@@ -1,16 +1,22 @@
 import os
 import pathlib
 
+from model import snapshot
 
-from model import knowledge_graph as kg
+res_path = pathlib.Path(__file__).parent.parent.absolute() / "res"
+specific_prompt_path = res_path / "experiments" / "pet" / "specific-prompt"
+generic_prompt_path = res_path / "experiments" / "pet" / "generic-method"
+
+# only node and edge counts are needed, which snapshots answer from their
+# header without building the graph
+snapshots_path = res_path / "result" / "snapshots"
+
+
+def count(graph_path: pathlib.Path, method: str):
+    snapshot_path = snapshots_path / method / graph_path.with_suffix(".kgs").name
+    with snapshot.cached_snapshot(graph_path, snapshot_path) as graph:
+        return graph.num_nodes, graph.num_edges
 
-specific_prompt_path = (
-    pathlib.Path(__file__).parent.parent.absolute()
-    / "res"
-    / "experiments"
-    / "pet"
-    / "specific-prompt"
-)
 
 spec_num_entities = []
 spec_num_relations = []
@@ -18,27 +24,19 @@ for file in os.listdir(specific_prompt_path):
     if not file.startswith("graph-"):
         continue
 
-    graph = kg.Graph.load(specific_prompt_path / file)
-    spec_num_entities.append(len(graph.nodes))
-    spec_num_relations.append(len(graph.edges))
+    num_nodes, num_edges = count(specific_prompt_path / file, "specific-prompt")
+    spec_num_entities.append(num_nodes)
+    spec_num_relations.append(num_edges)
 
 print("spec entities: ", f"{sum(spec_num_entities) / len(spec_num_entities): .2f}")
 print("spec relations:", f"{sum(spec_num_relations) / len(spec_num_relations): .2f}")
 
-generic_prompt_path = (
-    pathlib.Path(__file__).parent.parent.absolute()
-    / "res"
-    / "experiments"
-    / "pet"
-    / "generic-method"
-)
-
 gen_num_entities = []
 gen_num_relations = []
 for file in os.listdir(generic_prompt_path):
-    graph = kg.Graph.load(generic_prompt_path / file)
-    gen_num_entities.append(len(graph.nodes))
-    gen_num_relations.append(len(graph.edges))
+    num_nodes, num_edges = count(generic_prompt_path / file, "generic-method")
+    gen_num_entities.append(num_nodes)
+    gen_num_relations.append(num_edges)
 
 print("gen. entities: ", f"{sum(gen_num_entities) / len(gen_num_entities): .2f}")
 print("gen. relations:", f"{sum(gen_num_relations) / len(gen_num_relations): .2f}")
@@ -6,7 +6,9 @@ from pathlib import Path
 
 import networkx as nx
 
+from model import layout
 from model.color import CommonColors
+from model.interning import Interner
 from model.meta_model import Entity, Aspect, Relation, Position
 from model.shape import Shape
 
@@ -45,9 +47,10 @@ class ApplicationModel:
 
     @staticmethod
     def from_dict(data: dict) -> "ApplicationModel":
+        interner = Interner()
         return ApplicationModel(
-            entities=[Entity.from_dict(e) for e in data["entities"]],
-            relations=[Relation.from_dict(r) for r in data["relations"]],
+            entities=[Entity.from_dict(e, interner) for e in data["entities"]],
+            relations=[Relation.from_dict(r, interner) for r in data["relations"]],
         )
 
     def save(self, file_path: typing.Union[str, Path]) -> None:
@@ -59,17 +62,20 @@ class ApplicationModel:
         with open(file_path, "r") as file:
             return ApplicationModel.from_dict(json.load(file))
 
-    def layout(self) -> "ApplicationModel":
+    def layout(
+        self,
+        cache: typing.Optional[layout.LayoutCache] = None,
+        processes: typing.Optional[int] = None,
+    ) -> "ApplicationModel":
         g = nx.Graph()
         g.add_nodes_from([e.name for e in self.entities])
         g.add_edges_from([(r.source.name, r.target.name) for r in self.relations])
 
-        pos = nx.kamada_kawai_layout(g, scale=400)
+        pos = layout.compute(g, scale=400, cache=cache, processes=processes)
 
         new_entities = {}
         for e in self.entities:
             e_pos = pos[e.name]
-            assert e_pos.shape == (2,)
             entity = Entity(
                 name=e.name,
                 description=e.description,
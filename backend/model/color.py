@@ -1,6 +1,9 @@
 import dataclasses
+import typing
 from enum import Enum
 
+from model.interning import Interner, intern
+
 
 @dataclasses.dataclass(frozen=True, eq=True)
 class Color:
@@ -20,8 +23,8 @@ class Color:
         return {"r": self.r, "g": self.g, "b": self.b, "hex": self.hex}
 
     @staticmethod
-    def from_dict(d: dict):
-        return Color(r=d["r"], g=d["g"], b=d["b"])
+    def from_dict(d: dict, interner: typing.Optional[Interner] = None):
+        return intern(Color(r=d["r"], g=d["g"], b=d["b"]), interner)
 
 
 class CommonColors(Enum):
@@ -0,0 +1,253 @@
+import collections
+import re
+import typing
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+import model.knowledge_graph as kg
+from model import match
+
+
+class HashingEncoder:
+    """
+    CPU only text encoder that needs no training or model files. Words and
+    character n-grams of a name are hashed into a fixed number of dimensions,
+    so names that share words match regardless of word order, and names that
+    share word stems still end up close to each other.
+    """
+
+    def __init__(self, dimensions: int = 512, n: int = 3):
+        self.dimensions = dimensions
+        self.n = n
+
+    def features(self, name: str) -> typing.Counter[str]:
+        words = re.findall(r"\w+", name.lower())
+        features = collections.Counter(f"w:{w}" for w in words)
+        for w in words:
+            features.update(f"c:{g}" for g in match.char_ngrams(w, self.n).elements())
+        return features
+
+    def encode(self, names: typing.Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(names), self.dimensions), dtype=np.float32)
+        for row, name in enumerate(names):
+            for feature, count in self.features(name).items():
+                # crc32 instead of hash(), which differs between processes
+                h = zlib.crc32(feature.encode("utf8"))
+                sign = 1.0 if h & 1 else -1.0
+                vectors[row, (h >> 1) % self.dimensions] += sign * count
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class VectorIndex:
+    """
+    Approximate nearest neighbour index over unit vectors using random
+    hyperplane locality sensitive hashing. Every table hashes a vector to the
+    side of `num_bits` hyperplanes it lies on, vectors that share a bucket in
+    any table are candidates, and candidates are ranked by their exact cosine
+    similarity. Small indexes are searched exhaustively.
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        num_tables: int = 24,
+        num_bits: int = 10,
+        exact_threshold: int = 256,
+        seed: int = 42,
+    ):
+        self.dimensions = dimensions
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.exact_threshold = exact_threshold
+        self.seed = seed
+        self._planes = np.random.default_rng(seed).standard_normal(
+            (num_tables * num_bits, dimensions)
+        )
+        self.ids: typing.List[str] = []
+        # the text each vector was encoded from, if known
+        self.texts: typing.List[typing.Optional[str]] = []
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self._buckets: typing.List[typing.Dict[int, typing.List[int]]] = [
+            collections.defaultdict(list) for _ in range(num_tables)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        bits = (vectors @ self._planes.T > 0).reshape(
+            len(vectors), self.num_tables, self.num_bits
+        )
+        return bits @ (1 << np.arange(self.num_bits))
+
+    def add(
+        self,
+        ids: typing.Sequence[str],
+        vectors: np.ndarray,
+        texts: typing.Optional[typing.Sequence[str]] = None,
+    ) -> None:
+        start = len(self.ids)
+        self.ids += list(ids)
+        self.texts += [None] * len(ids) if texts is None else list(texts)
+        self.vectors = np.vstack([self.vectors, vectors.astype(np.float32)])
+        for offset, codes in enumerate(self._codes(vectors)):
+            for table, code in enumerate(codes):
+                self._buckets[table][int(code)].append(start + offset)
+
+    def candidates(self, vector: np.ndarray) -> typing.List[int]:
+        """
+        Indices of all vectors sharing a bucket with `vector` in any table.
+        """
+        if len(self.ids) <= self.exact_threshold:
+            return list(range(len(self.ids)))
+        found = set()
+        for table, code in enumerate(self._codes(vector[np.newaxis, :])[0]):
+            found.update(self._buckets[table].get(int(code), []))
+        return sorted(found)
+
+    def query(
+        self, vector: np.ndarray, k: int = 10, min_similarity: float = 0.0
+    ) -> typing.List[typing.Tuple[str, float]]:
+        candidates = self.candidates(vector)
+        if len(candidates) == 0:
+            return []
+        similarities = self.vectors[candidates] @ vector
+        order = np.argsort(-similarities, kind="stable")[:k]
+        return [
+            (self.ids[candidates[i]], float(similarities[i]))
+            for i in order
+            if similarities[i] >= min_similarity
+        ]
+
+    def save(self, file_path: typing.Union[str, Path]) -> None:
+        # buckets are cheap to rebuild and not stored
+        with open(file_path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                texts=np.array(["" if t is None else t for t in self.texts], dtype=str),
+                has_text=np.array([t is not None for t in self.texts], dtype=bool),
+                vectors=self.vectors,
+                parameters=np.array(
+                    [
+                        self.dimensions,
+                        self.num_tables,
+                        self.num_bits,
+                        self.exact_threshold,
+                        self.seed,
+                    ]
+                ),
+            )
+
+    @staticmethod
+    def load(file_path: typing.Union[str, Path]) -> "VectorIndex":
+        with np.load(file_path) as data:
+            dimensions, num_tables, num_bits, exact_threshold, seed = (
+                int(p) for p in data["parameters"]
+            )
+            index = VectorIndex(dimensions, num_tables, num_bits, exact_threshold, seed)
+            texts = [
+                str(t) if has_text else None
+                for t, has_text in zip(data["texts"], data["has_text"])
+            ]
+            index.add([str(i) for i in data["ids"]], data["vectors"], texts)
+        return index
+
+
+def build_index(
+    nodes: typing.Sequence[kg.Node], encoder: typing.Optional[HashingEncoder] = None
+) -> VectorIndex:
+    return update_index(None, {n.id: n.name for n in nodes}, encoder)
+
+
+def update_index(
+    index: typing.Optional[VectorIndex],
+    names: typing.Dict[str, str],
+    encoder: typing.Optional[HashingEncoder] = None,
+) -> VectorIndex:
+    """
+    Index over the given node names, keyed by node id. Vectors that `index`
+    already holds for a node of the same name are reused, so only new and
+    renamed nodes are encoded. Returns `index` itself if it is up to date.
+    """
+    if encoder is None:
+        encoder = HashingEncoder()
+    known: typing.Dict[str, typing.Tuple[typing.Optional[str], int]] = {}
+    if index is not None:
+        if dict(zip(index.ids, index.texts)) == names and len(index) == len(names):
+            return index
+        known = {i: (t, row) for row, (i, t) in enumerate(zip(index.ids, index.texts))}
+
+    ids = list(names.keys())
+    vectors = np.zeros((len(ids), encoder.dimensions), dtype=np.float32)
+    missing = []
+    for row, node_id in enumerate(ids):
+        text, known_row = known.get(node_id, (None, -1))
+        if known_row >= 0 and text == names[node_id]:
+            vectors[row] = index.vectors[known_row]
+        else:
+            missing.append(row)
+    if len(missing) > 0:
+        vectors[missing] = encoder.encode([names[ids[row]] for row in missing])
+
+    updated = VectorIndex(encoder.dimensions)
+    updated.add(ids, vectors, [names[i] for i in ids])
+    return updated
+
+
+class _PreparedEmbeddingMatcher:
+    def __init__(
+        self, matcher: "EmbeddingNodeMatcher", nodes: typing.Sequence[kg.Node]
+    ):
+        self._threshold = matcher.similarity_threshold
+        self._types = [n.entity.name.lower() for n in nodes]
+        # keyed by position, merged graphs can hold several nodes with one id
+        self._index = update_index(
+            None, {str(i): n.name for i, n in enumerate(nodes)}, matcher.encoder
+        )
+
+    def candidates(self, i: int) -> typing.Iterable[int]:
+        return [
+            j
+            for j in self._index.candidates(self._index.vectors[i])
+            if self._types[j] == self._types[i]
+        ]
+
+    def score_batch(self, i: int, others: typing.Sequence[int]) -> typing.List[bool]:
+        if len(others) == 0:
+            return []
+        similarities = self._index.vectors[list(others)] @ self._index.vectors[i]
+        return [
+            self._types[i] == self._types[j] and s >= self._threshold
+            for j, s in zip(others, similarities)
+        ]
+
+
+class EmbeddingNodeMatcher:
+    """
+    Matches nodes of the same type whose name embeddings have a cosine
+    similarity of at least `similarity_threshold`. When prepared for a list
+    of nodes, candidates are looked up in a `VectorIndex`, so nodes are not
+    compared with every other node.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.7,
+        encoder: typing.Optional[HashingEncoder] = None,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.encoder = HashingEncoder() if encoder is None else encoder
+
+    def __call__(self, n1: kg.Node, n2: kg.Node) -> bool:
+        if n1.entity.name.lower() != n2.entity.name.lower():
+            return False
+        v1, v2 = self.encoder.encode([n1.name, n2.name])
+        return float(v1 @ v2) >= self.similarity_threshold
+
+    def prepare(self, nodes: typing.Sequence[kg.Node]) -> _PreparedEmbeddingMatcher:
+        return _PreparedEmbeddingMatcher(self, nodes)
@@ -0,0 +1,338 @@
+import contextlib
+import dataclasses
+import fcntl
+import json
+import os
+import threading
+import typing
+from datetime import datetime
+from pathlib import Path
+
+import model.knowledge_graph as kg
+from model.interning import Interner
+
+
+def _node_content(node: kg.Node) -> tuple:
+    # nodes compare by id only, deltas need to know whether anything else changed
+    return node.name, node.entity, node.source
+
+
+def _edge_to_dict(edge: kg.Edge) -> dict:
+    return {
+        "id": edge.id,
+        "source": edge.source.id,
+        "target": edge.target.id,
+        "type": edge.type,
+    }
+
+
+@dataclasses.dataclass
+class GraphDelta:
+    """
+    Difference between two versions of a graph. Nodes whose position is the
+    only thing that changed are listed in `moved_nodes`, which only stores
+    the new position, all other changed nodes are stored in full.
+    """
+
+    added_nodes: typing.List[dict]
+    changed_nodes: typing.List[dict]
+    moved_nodes: typing.Dict[str, typing.Optional[typing.Tuple[float, float]]]
+    removed_nodes: typing.List[str]
+    added_edges: typing.List[dict]
+    changed_edges: typing.List[dict]
+    removed_edges: typing.List[str]
+
+    @property
+    def is_empty(self) -> bool:
+        return not any(
+            [
+                self.added_nodes,
+                self.changed_nodes,
+                self.moved_nodes,
+                self.removed_nodes,
+                self.added_edges,
+                self.changed_edges,
+                self.removed_edges,
+            ]
+        )
+
+    @staticmethod
+    def between(old: kg.Graph, new: kg.Graph) -> "GraphDelta":
+        old_nodes = {n.id: n for n in old.nodes}
+        new_nodes = {n.id: n for n in new.nodes}
+        old_edges = {e.id: e for e in old.edges}
+        new_edges = {e.id: e for e in new.edges}
+
+        added_nodes = []
+        changed_nodes = []
+        moved_nodes = {}
+        for node_id, n in new_nodes.items():
+            previous = old_nodes.get(node_id)
+            if previous is None:
+                added_nodes.append(n.to_dict())
+            elif _node_content(previous) != _node_content(n):
+                changed_nodes.append(n.to_dict())
+            elif previous.position != n.position:
+                moved_nodes[node_id] = n.position
+
+        added_edges = []
+        changed_edges = []
+        for edge_id, e in new_edges.items():
+            previous = old_edges.get(edge_id)
+            if previous is None:
+                added_edges.append(_edge_to_dict(e))
+            elif _edge_to_dict(previous) != _edge_to_dict(e):
+                changed_edges.append(_edge_to_dict(e))
+
+        return GraphDelta(
+            added_nodes=added_nodes,
+            changed_nodes=changed_nodes,
+            moved_nodes=moved_nodes,
+            removed_nodes=[i for i in old_nodes.keys() if i not in new_nodes],
+            added_edges=added_edges,
+            changed_edges=changed_edges,
+            removed_edges=[i for i in old_edges.keys() if i not in new_edges],
+        )
+
+    def apply(self, graph: kg.Graph) -> kg.Graph:
+        """
+        Applies this delta to `graph`. Nodes and edges that already exist keep
+        their order, added ones are appended.
+        """
+        interner = Interner()
+        removed_nodes = set(self.removed_nodes)
+        replaced = {d["id"]: kg.Node.from_dict(d, interner) for d in self.changed_nodes}
+
+        nodes: typing.Dict[str, kg.Node] = {}
+        for n in graph.nodes:
+            if n.id in removed_nodes:
+                continue
+            n = replaced.get(n.id, n)
+            if n.id in self.moved_nodes:
+                position = self.moved_nodes[n.id]
+                n = n.with_position(None if position is None else tuple(position))
+            nodes[n.id] = n
+        for d in self.added_nodes:
+            nodes[d["id"]] = kg.Node.from_dict(d, interner)
+
+        removed_edges = set(self.removed_edges)
+        replaced_edges = {d["id"]: d for d in self.changed_edges}
+        edge_dicts = [
+            replaced_edges.get(e.id, _edge_to_dict(e))
+            for e in graph.edges
+            if e.id not in removed_edges
+        ]
+        edge_dicts += self.added_edges
+
+        return kg.Graph(
+            nodes=list(nodes.values()),
+            edges=[
+                kg.Edge(
+                    id=d["id"],
+                    source=nodes[d["source"]],
+                    target=nodes[d["target"]],
+                    type=d["type"],
+                )
+                for d in edge_dicts
+            ],
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "addedNodes": self.added_nodes,
+            "changedNodes": self.changed_nodes,
+            "movedNodes": {
+                i: None if p is None else {"x": p[0], "y": p[1]}
+                for i, p in self.moved_nodes.items()
+            },
+            "removedNodes": self.removed_nodes,
+            "addedEdges": self.added_edges,
+            "changedEdges": self.changed_edges,
+            "removedEdges": self.removed_edges,
+        }
+
+    @staticmethod
+    def from_dict(d: dict) -> "GraphDelta":
+        return GraphDelta(
+            added_nodes=d["addedNodes"],
+            changed_nodes=d["changedNodes"],
+            moved_nodes={
+                i: None if p is None else (p["x"], p["y"])
+                for i, p in d["movedNodes"].items()
+            },
+            removed_nodes=d["removedNodes"],
+            added_edges=d["addedEdges"],
+            changed_edges=d["changedEdges"],
+            removed_edges=d["removedEdges"],
+        )
+
+
+@dataclasses.dataclass
+class VersionInfo:
+    version: int
+    timestamp: str
+    message: str
+    checkpoint: bool
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "timestamp": self.timestamp,
+            "message": self.message,
+            "checkpoint": self.checkpoint,
+        }
+
+
+# parsed log entries per log file, shared by all histories of this process, so
+# a request only has to parse what was appended since the last one
+_log_cache: typing.Dict[Path, typing.Tuple[int, typing.List[dict]]] = {}
+_log_cache_lock = threading.Lock()
+
+
+class GraphHistory:
+    """
+    Append-only version history of a graph. Every commit appends the delta to
+    the previous version to a log, and every `checkpoint_interval` versions a
+    full copy of the graph is written as well, so materializing a version
+    never has to replay more than that many deltas. Commits hold an exclusive
+    lock on the history, so concurrent commits get consecutive versions.
+    """
+
+    def __init__(
+        self, directory: typing.Union[str, Path], checkpoint_interval: int = 10
+    ):
+        self.directory = Path(directory)
+        self.checkpoint_interval = checkpoint_interval
+        self._log_path = self.directory / "log.jsonl"
+        self._head_path = self.directory / "HEAD"
+
+    def _entries(self) -> typing.List[dict]:
+        """
+        Parsed log, only the part appended since the last call is read.
+        """
+        try:
+            size = os.path.getsize(self._log_path)
+        except FileNotFoundError:
+            return []
+
+        with _log_cache_lock:
+            offset, entries = _log_cache.get(self._log_path, (0, []))
+            if size < offset:
+                # the history was deleted and started over
+                offset, entries = 0, []
+            if size > offset:
+                with open(self._log_path, "rb") as f:
+                    f.seek(offset)
+                    appended = f.read(size - offset)
+                # a commit may be writing its line right now, leave it for later
+                complete = appended.rfind(b"\n") + 1
+                entries = entries + [
+                    json.loads(line)
+                    for line in appended[:complete].decode("utf8").splitlines()
+                    if line.strip() != ""
+                ]
+                offset += complete
+                _log_cache[self._log_path] = (offset, entries)
+            return entries
+
+    @contextlib.contextmanager
+    def _lock(self) -> typing.Iterator[None]:
+        self.directory.mkdir(exist_ok=True, parents=True)
+        with open(self.directory / "lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _checkpoint_path(self, version: int) -> Path:
+        return self.directory / f"checkpoint-{version}.json"
+
+    def versions(self) -> typing.List[VersionInfo]:
+        return [
+            VersionInfo(
+                version=e["version"],
+                timestamp=e["timestamp"],
+                message=e["message"],
+                checkpoint=e["checkpoint"],
+            )
+            for e in self._entries()
+        ]
+
+    @property
+    def head(self) -> typing.Optional[int]:
+        # kept in a file of its own, so it can be read without the log
+        try:
+            with open(self._head_path) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            # histories written before there was a HEAD file
+            entries = self._entries()
+            if len(entries) == 0:
+                return None
+            return entries[-1]["version"]
+
+    def materialize(self, version: int) -> kg.Graph:
+        entries = self._entries()
+        if not 0 <= version < len(entries):
+            raise KeyError(f"Version {version} does not exist.")
+
+        start = version
+        while not entries[start]["checkpoint"]:
+            start -= 1
+        graph = kg.Graph.load(self._checkpoint_path(start))
+        for entry in entries[start + 1 : version + 1]:
+            graph = GraphDelta.from_dict(entry["delta"]).apply(graph)
+        return graph
+
+    def delta(self, from_version: int, to_version: int) -> GraphDelta:
+        """
+        Changes that turn `from_version` into `to_version`. Consecutive versions
+        are answered straight from the log without materializing either one.
+        """
+        entries = self._entries()
+        for version in [from_version, to_version]:
+            if not 0 <= version < len(entries):
+                raise KeyError(f"Version {version} does not exist.")
+
+        entry = entries[to_version]
+        if to_version == from_version + 1 and not entry["checkpoint"]:
+            return GraphDelta.from_dict(entry["delta"])
+        return GraphDelta.between(
+            self.materialize(from_version), self.materialize(to_version)
+        )
+
+    def commit(self, graph: kg.Graph, message: str) -> int:
+        """
+        Records `graph` as a new version and returns its number. The delta is
+        always taken against the graph materialized from this history, so
+        every version reproduces exactly the graph that was committed.
+        """
+        with self._lock():
+            version = len(self._entries())
+
+            checkpoint = version % self.checkpoint_interval == 0
+            delta = None
+            if checkpoint:
+                graph.save(self._checkpoint_path(version))
+            else:
+                previous = self.materialize(version - 1)
+                delta = GraphDelta.between(previous, graph).to_dict()
+
+            entry = {
+                "version": version,
+                "timestamp": datetime.now().isoformat(),
+                "message": message,
+                "checkpoint": checkpoint,
+                "delta": delta,
+            }
+            with open(self._log_path, "a", encoding="utf8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            temporary_path = self._head_path.with_suffix(".tmp")
+            with open(temporary_path, "w") as f:
+                f.write(str(version))
+            os.replace(temporary_path, self._head_path)
+        return version
@@ -0,0 +1,576 @@
+import contextlib
+import dataclasses
+import json
+import sqlite3
+import typing
+from pathlib import Path
+
+import model.knowledge_graph as kg
+from model import meta_model
+from model.interning import Interner
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entity_types (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    aspect TEXT NOT NULL,
+    definition TEXT NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS entity_types_name ON entity_types (name);
+CREATE INDEX IF NOT EXISTS entity_types_aspect ON entity_types (aspect);
+
+CREATE TABLE IF NOT EXISTS nodes (
+    key INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    entity_type_id INTEGER NOT NULL REFERENCES entity_types (id),
+    x REAL,
+    y REAL,
+    source_file TEXT NOT NULL,
+    -- no type affinity, page numbers are stored exactly as they were given
+    page_start,
+    page_end,
+    ordinal INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nodes_entity_type ON nodes (entity_type_id);
+CREATE INDEX IF NOT EXISTS nodes_name ON nodes (name);
+CREATE INDEX IF NOT EXISTS nodes_source_file ON nodes (source_file);
+CREATE INDEX IF NOT EXISTS nodes_ordinal ON nodes (ordinal);
+
+CREATE TABLE IF NOT EXISTS edges (
+    id TEXT PRIMARY KEY,
+    source_id TEXT NOT NULL REFERENCES nodes (id) ON DELETE CASCADE,
+    target_id TEXT NOT NULL REFERENCES nodes (id) ON DELETE CASCADE,
+    type TEXT NOT NULL,
+    ordinal INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edges_source ON edges (source_id);
+CREATE INDEX IF NOT EXISTS edges_target ON edges (target_id);
+CREATE INDEX IF NOT EXISTS edges_type ON edges (type);
+CREATE INDEX IF NOT EXISTS edges_ordinal ON edges (ordinal);
+
+-- spatial index over node positions, kept up to date by the triggers below
+CREATE VIRTUAL TABLE IF NOT EXISTS node_positions USING rtree (
+    key, min_x, max_x, min_y, max_y
+);
+CREATE TRIGGER IF NOT EXISTS nodes_position_insert AFTER INSERT ON nodes
+WHEN NEW.x IS NOT NULL AND NEW.y IS NOT NULL
+BEGIN
+    INSERT INTO node_positions VALUES (NEW.key, NEW.x, NEW.x, NEW.y, NEW.y);
+END;
+CREATE TRIGGER IF NOT EXISTS nodes_position_update AFTER UPDATE OF x, y ON nodes
+BEGIN
+    DELETE FROM node_positions WHERE key = OLD.key;
+    INSERT INTO node_positions
+    SELECT NEW.key, NEW.x, NEW.x, NEW.y, NEW.y
+    WHERE NEW.x IS NOT NULL AND NEW.y IS NOT NULL;
+END;
+CREATE TRIGGER IF NOT EXISTS nodes_position_delete AFTER DELETE ON nodes
+BEGIN
+    DELETE FROM node_positions WHERE key = OLD.key;
+END;
+"""
+
+SCHEMA_VERSION = 1
+
+NODE_COLUMNS = (
+    "nodes.id, nodes.name, nodes.entity_type_id, nodes.x, nodes.y, "
+    "nodes.source_file, nodes.page_start, nodes.page_end"
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class CompactEdge:
+    """
+    Edge that references its endpoints by id instead of embedding them.
+    """
+
+    id: str
+    source: str
+    target: str
+    type: str
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "source": self.source,
+            "target": self.target,
+            "type": self.type,
+        }
+
+
+@dataclasses.dataclass(frozen=True)
+class Page:
+    """
+    One page of a query result. `cursor` is passed as `after` to fetch the next
+    page and is `None` on the last one.
+    """
+
+    items: typing.List[typing.Any]
+    cursor: typing.Optional[int]
+
+
+class GraphStore:
+    """
+    Knowledge graph persisted in a SQLite database, one database per graph.
+    Unlike the JSON files written by `Graph.save`, single nodes and edges can
+    be updated without rewriting the whole graph, and readers never observe
+    a partially written graph, as every change runs in a transaction and the
+    database is used in write-ahead-log mode.
+    """
+
+    def __init__(self, file_path: typing.Union[str, Path]):
+        self.file_path = Path(file_path)
+        # set up before migrating, a failed migration rolls back through
+        # `transaction`, which resets these
+        self._entities: typing.Dict[int, meta_model.Entity] = {}
+        self._entity_type_ids: typing.Dict[meta_model.Entity, int] = {}
+        self._interner = Interner()
+        self._connection = sqlite3.connect(
+            self.file_path, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(SCHEMA)
+        self._migrate()
+
+    def __enter__(self) -> "GraphStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _migrate(self) -> None:
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version >= SCHEMA_VERSION:
+            return
+        with self.transaction() as connection:
+            if version < 1:
+                # databases created before the spatial index existed
+                connection.execute(
+                    "INSERT OR IGNORE INTO node_positions "
+                    "SELECT key, x, x, y, y FROM nodes "
+                    "WHERE x IS NOT NULL AND y IS NOT NULL"
+                )
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextlib.contextmanager
+    def transaction(self) -> typing.Iterator[sqlite3.Connection]:
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            # entity types inserted by this transaction are gone again
+            self._entity_type_ids.clear()
+            raise
+        self._connection.execute("COMMIT")
+
+    @property
+    def num_nodes(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    @property
+    def num_edges(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM edges").fetchone()[0]
+
+    def entity_counts(self) -> typing.Dict[str, int]:
+        rows = self._connection.execute(
+            "SELECT entity_types.name, COUNT(*) FROM nodes "
+            "JOIN entity_types ON entity_types.id = nodes.entity_type_id "
+            "GROUP BY entity_types.name"
+        )
+        return {name: count for name, count in rows}
+
+    def node_names(self) -> typing.Dict[str, str]:
+        rows = self._connection.execute("SELECT id, name FROM nodes ORDER BY ordinal")
+        return {node_id: name for node_id, name in rows}
+
+    def load_graph(self) -> kg.Graph:
+        rows = self._connection.execute(
+            f"SELECT {NODE_COLUMNS} FROM nodes ORDER BY ordinal"
+        ).fetchall()
+        nodes = [self._node_from_row(row) for row in rows]
+        nodes_by_id = {n.id: n for n in nodes}
+        edges = [
+            kg.Edge(
+                id=edge_id,
+                source=nodes_by_id[source_id],
+                target=nodes_by_id[target_id],
+                type=edge_type,
+            )
+            for edge_id, source_id, target_id, edge_type in self._connection.execute(
+                "SELECT id, source_id, target_id, type FROM edges ORDER BY ordinal"
+            )
+        ]
+        return kg.Graph(nodes=nodes, edges=edges)
+
+    def save_graph(self, graph: kg.Graph) -> None:
+        """
+        Makes the stored graph equal to `graph`, touching only rows that
+        actually changed. Nodes and edges already stored keep their place in
+        the ordering, new ones are appended.
+        """
+        with self.transaction() as connection:
+            stored_nodes = {
+                row[0]: row
+                for row in connection.execute(f"SELECT {NODE_COLUMNS} FROM nodes")
+            }
+            stored_edges = {
+                row[0]: row
+                for row in connection.execute(
+                    "SELECT id, source_id, target_id, type FROM edges"
+                )
+            }
+
+            changed_nodes = []
+            for n in graph.nodes:
+                row = self._node_to_row(n)
+                if stored_nodes.get(n.id) != row:
+                    changed_nodes.append(n)
+            changed_edges = []
+            for e in graph.edges:
+                row = (e.id, e.source.id, e.target.id, e.type)
+                if stored_edges.get(e.id) != row:
+                    changed_edges.append(e)
+
+            self._upsert_nodes(connection, changed_nodes)
+            self._upsert_edges(connection, changed_edges)
+
+            edge_ids = {e.id for e in graph.edges}
+            connection.executemany(
+                "DELETE FROM edges WHERE id = ?",
+                [(i,) for i in stored_edges.keys() if i not in edge_ids],
+            )
+            node_ids = {n.id for n in graph.nodes}
+            connection.executemany(
+                "DELETE FROM nodes WHERE id = ?",
+                [(i,) for i in stored_nodes.keys() if i not in node_ids],
+            )
+
+    def query_nodes(
+        self,
+        *,
+        entity_type: typing.Optional[str] = None,
+        aspect: typing.Optional[str] = None,
+        source_file: typing.Optional[str] = None,
+        name_prefix: typing.Optional[str] = None,
+        after: typing.Optional[int] = None,
+        limit: int = 100,
+    ) -> Page:
+        """
+        Nodes matching all given filters, in the order they were stored. Pages
+        are addressed by the key of their last node, so fetching a page costs
+        the same no matter how far into the result it is.
+        """
+        conditions = []
+        parameters = []
+        if entity_type is not None:
+            conditions.append("entity_types.name = ?")
+            parameters.append(entity_type)
+        if aspect is not None:
+            conditions.append("entity_types.aspect = ?")
+            parameters.append(aspect)
+        if source_file is not None:
+            conditions.append("nodes.source_file = ?")
+            parameters.append(source_file)
+        if name_prefix is not None:
+            # a range instead of LIKE, so the index on names can be used
+            conditions.append("nodes.name >= ? AND nodes.name < ?")
+            parameters += [name_prefix, name_prefix + "\U0010ffff"]
+        if after is not None:
+            conditions.append("nodes.key > ?")
+            parameters.append(after)
+
+        where = ""
+        if len(conditions) > 0:
+            where = "WHERE " + " AND ".join(conditions)
+        rows = self._connection.execute(
+            f"SELECT nodes.key, {NODE_COLUMNS} FROM nodes "
+            "JOIN entity_types ON entity_types.id = nodes.entity_type_id "
+            f"{where} ORDER BY nodes.key LIMIT ?",
+            parameters + [limit + 1],
+        ).fetchall()
+
+        cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            if len(rows) > 0:
+                cursor = rows[-1][0]
+        return Page(items=[self._node_from_row(row[1:]) for row in rows], cursor=cursor)
+
+    def neighbourhood(
+        self, node_id: str, hops: int = 1
+    ) -> typing.Tuple[typing.List[kg.Node], typing.List[CompactEdge]]:
+        """
+        All nodes at most `hops` edges away from the given node, regardless of
+        edge direction, along with the edges between them.
+        """
+        reached = {node_id}
+        frontier = [node_id]
+        for _ in range(hops):
+            if len(frontier) == 0:
+                break
+            rows = self._connection.execute(
+                "SELECT target_id FROM edges "
+                "WHERE source_id IN (SELECT value FROM json_each(?)) "
+                "UNION "
+                "SELECT source_id FROM edges "
+                "WHERE target_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(frontier), json.dumps(frontier)),
+            )
+            frontier = [i for (i,) in rows if i not in reached]
+            reached.update(frontier)
+
+        rows = self._connection.execute(
+            f"SELECT {NODE_COLUMNS} FROM nodes "
+            "WHERE id IN (SELECT value FROM json_each(?)) ORDER BY key",
+            (json.dumps(list(reached)),),
+        )
+        nodes = [self._node_from_row(row) for row in rows]
+        return nodes, self.edges_between([n.id for n in nodes], limit=None).items
+
+    def edges_between(
+        self,
+        node_ids: typing.Iterable[str],
+        *,
+        after: typing.Optional[int] = None,
+        limit: typing.Optional[int] = 100,
+    ) -> Page:
+        """
+        Edges whose source and target are both among the given nodes, paged
+        like `query_nodes`. Pass `None` as `limit` to get all of them at once.
+        """
+        node_ids = json.dumps(list(node_ids))
+        query = (
+            "SELECT ordinal, id, source_id, target_id, type FROM edges "
+            "WHERE source_id IN (SELECT value FROM json_each(?)) "
+            "AND target_id IN (SELECT value FROM json_each(?)) "
+            "AND ordinal > ? ORDER BY ordinal"
+        )
+        parameters = [node_ids, node_ids, -1 if after is None else after]
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit + 1)
+        rows = self._connection.execute(query, parameters).fetchall()
+
+        cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            if len(rows) > 0:
+                cursor = rows[-1][0]
+        return Page(items=[CompactEdge(*row[1:]) for row in rows], cursor=cursor)
+
+    def viewport(
+        self,
+        min_x: float,
+        min_y: float,
+        max_x: float,
+        max_y: float,
+        limit: typing.Optional[int] = None,
+    ) -> typing.Tuple[typing.List[kg.Node], typing.List[CompactEdge], bool]:
+        """
+        Nodes positioned inside the given rectangle and all edges incident to
+        them. If more than `limit` nodes are inside, only the ones with the
+        highest degree are returned and the last element of the result is
+        `True`.
+        """
+        # the R*Tree stores 32 bit floats and may return nodes just outside the
+        # rectangle, so positions are compared exactly once more
+        query = (
+            f"SELECT {NODE_COLUMNS} FROM node_positions "
+            "JOIN nodes ON nodes.key = node_positions.key "
+            "WHERE node_positions.max_x >= ? AND node_positions.min_x <= ? "
+            "AND node_positions.max_y >= ? AND node_positions.min_y <= ? "
+            "AND nodes.x BETWEEN ? AND ? AND nodes.y BETWEEN ? AND ? "
+        )
+        parameters = [min_x, max_x, min_y, max_y, min_x, max_x, min_y, max_y]
+        if limit is None:
+            query += "ORDER BY nodes.key"
+        else:
+            query += (
+                "ORDER BY "
+                "(SELECT COUNT(*) FROM edges WHERE source_id = nodes.id) + "
+                "(SELECT COUNT(*) FROM edges WHERE target_id = nodes.id) DESC, "
+                "nodes.key LIMIT ?"
+            )
+            parameters.append(limit + 1)
+        rows = self._connection.execute(query, parameters).fetchall()
+
+        truncated = limit is not None and len(rows) > limit
+        if truncated:
+            rows = rows[:limit]
+        nodes = [self._node_from_row(row) for row in rows]
+
+        node_ids = json.dumps([n.id for n in nodes])
+        edges = [
+            CompactEdge(*row)
+            for row in self._connection.execute(
+                "SELECT id, source_id, target_id, type FROM edges "
+                "WHERE source_id IN (SELECT value FROM json_each(?)) "
+                "UNION "
+                "SELECT id, source_id, target_id, type FROM edges "
+                "WHERE target_id IN (SELECT value FROM json_each(?))",
+                (node_ids, node_ids),
+            )
+        ]
+        return nodes, edges, truncated
+
+    def get_node(self, node_id: str) -> typing.Optional[kg.Node]:
+        row = self._connection.execute(
+            f"SELECT {NODE_COLUMNS} FROM nodes WHERE id = ?", (node_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._node_from_row(row)
+
+    def upsert_nodes(self, nodes: typing.Iterable[kg.Node]) -> None:
+        with self.transaction() as connection:
+            self._upsert_nodes(connection, nodes)
+
+    def upsert_edges(self, edges: typing.Iterable[kg.Edge]) -> None:
+        with self.transaction() as connection:
+            self._upsert_edges(connection, edges)
+
+    def delete_nodes(self, node_ids: typing.Iterable[str]) -> None:
+        """
+        Deletes the given nodes, along with all edges connected to them.
+        """
+        with self.transaction() as connection:
+            connection.executemany(
+                "DELETE FROM nodes WHERE id = ?", [(i,) for i in node_ids]
+            )
+
+    def delete_edges(self, edge_ids: typing.Iterable[str]) -> None:
+        with self.transaction() as connection:
+            connection.executemany(
+                "DELETE FROM edges WHERE id = ?", [(i,) for i in edge_ids]
+            )
+
+    def update_positions(
+        self, positions: typing.Dict[str, typing.Tuple[float, float]]
+    ) -> None:
+        with self.transaction() as connection:
+            connection.executemany(
+                "UPDATE nodes SET x = ?, y = ? WHERE id = ?",
+                [(float(x), float(y), i) for i, (x, y) in positions.items()],
+            )
+
+    def update_node(
+        self,
+        node_id: str,
+        *,
+        name: typing.Optional[str] = None,
+        position: typing.Optional[typing.Tuple[float, float]] = None,
+    ) -> typing.Optional[kg.Node]:
+        """
+        Renames and / or moves a single node, returns the updated node or
+        `None` if there is no node with the given id.
+        """
+        with self.transaction() as connection:
+            if name is not None:
+                connection.execute(
+                    "UPDATE nodes SET name = ? WHERE id = ?", (name, node_id)
+                )
+            if position is not None:
+                connection.execute(
+                    "UPDATE nodes SET x = ?, y = ? WHERE id = ?",
+                    (float(position[0]), float(position[1]), node_id),
+                )
+        return self.get_node(node_id)
+
+    def _upsert_nodes(
+        self, connection: sqlite3.Connection, nodes: typing.Iterable[kg.Node]
+    ) -> None:
+        next_ordinal = self._next_ordinal(connection, "nodes")
+        rows = []
+        for n in nodes:
+            rows.append(self._node_to_row(n) + (next_ordinal,))
+            next_ordinal += 1
+        connection.executemany(
+            "INSERT INTO nodes "
+            "(id, name, entity_type_id, x, y, source_file, page_start, page_end, ordinal) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET "
+            "name = excluded.name, entity_type_id = excluded.entity_type_id, "
+            "x = excluded.x, y = excluded.y, source_file = excluded.source_file, "
+            "page_start = excluded.page_start, page_end = excluded.page_end",
+            rows,
+        )
+
+    def _upsert_edges(
+        self, connection: sqlite3.Connection, edges: typing.Iterable[kg.Edge]
+    ) -> None:
+        next_ordinal = self._next_ordinal(connection, "edges")
+        rows = []
+        for e in edges:
+            rows.append((e.id, e.source.id, e.target.id, e.type, next_ordinal))
+            next_ordinal += 1
+        connection.executemany(
+            "INSERT INTO edges (id, source_id, target_id, type, ordinal) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET "
+            "source_id = excluded.source_id, target_id = excluded.target_id, "
+            "type = excluded.type",
+            rows,
+        )
+
+    @staticmethod
+    def _next_ordinal(connection: sqlite3.Connection, table: str) -> int:
+        return connection.execute(
+            f"SELECT COALESCE(MAX(ordinal), -1) + 1 FROM {table}"
+        ).fetchone()[0]
+
+    def _node_to_row(self, node: kg.Node) -> tuple:
+        x, y = (None, None) if node.position is None else node.position
+        return (
+            node.id,
+            node.name,
+            self._entity_type_id(node.entity),
+            None if x is None else float(x),
+            None if y is None else float(y),
+            node.source.file,
+            node.source.page_start,
+            node.source.page_end,
+        )
+
+    def _node_from_row(self, row: tuple) -> kg.Node:
+        node_id, name, entity_type_id, x, y, file, page_start, page_end = row
+        return kg.Node(
+            id=node_id,
+            name=name,
+            position=None if x is None or y is None else (x, y),
+            entity=self._entity(entity_type_id),
+            source=self._interner.intern(
+                kg.DataSource(file=file, page_start=page_start, page_end=page_end)
+            ),
+        )
+
+    def _entity_type_id(self, entity: meta_model.Entity) -> int:
+        if entity in self._entity_type_ids:
+            return self._entity_type_ids[entity]
+        definition = json.dumps(entity.to_dict(), sort_keys=True)
+        self._connection.execute(
+            "INSERT OR IGNORE INTO entity_types (name, aspect, definition) "
+            "VALUES (?, ?, ?)",
+            (entity.name, entity.aspect.name, definition),
+        )
+        (entity_type_id,) = self._connection.execute(
+            "SELECT id FROM entity_types WHERE definition = ?", (definition,)
+        ).fetchone()
+        self._entity_type_ids[entity] = entity_type_id
+        return entity_type_id
+
+    def _entity(self, entity_type_id: int) -> meta_model.Entity:
+        if entity_type_id not in self._entities:
+            (definition,) = self._connection.execute(
+                "SELECT definition FROM entity_types WHERE id = ?", (entity_type_id,)
+            ).fetchone()
+            self._entities[entity_type_id] = meta_model.Entity.from_dict(
+                json.loads(definition), self._interner
+            )
+        return self._entities[entity_type_id]
@@ -0,0 +1,38 @@
+import typing
+
+T = typing.TypeVar("T", bound=typing.Hashable)
+
+
+class Interner:
+    """
+    Canonicalizes equal, immutable objects to a single shared instance.
+    Meant to be used for the duration of one deserialization, e.g. a single
+    `Graph.from_dict`, so that thousands of nodes of the same type share one
+    `Entity` (and its `Aspect` and `Color` objects) instead of holding copies.
+
+    Objects are only ever replaced by an instance with exactly the same
+    content. Types whose equality ignores part of their content, like nodes,
+    which compare by id, pass a `key` that covers all of it, so two
+    conflicting definitions stay separate objects.
+    """
+
+    def __init__(self):
+        self._instances: typing.Dict[typing.Hashable, typing.Hashable] = {}
+
+    def __len__(self) -> int:
+        return len(self._instances)
+
+    def intern(self, value: T, key: typing.Optional[typing.Hashable] = None) -> T:
+        if key is None:
+            return self._instances.setdefault(value, value)
+        return self._instances.setdefault((type(value), key), value)
+
+
+def intern(
+    value: T,
+    interner: typing.Optional[Interner],
+    key: typing.Optional[typing.Hashable] = None,
+) -> T:
+    if interner is None:
+        return value
+    return interner.intern(value, key)
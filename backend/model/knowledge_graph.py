@@ -1,23 +1,44 @@
+import concurrent.futures
 import dataclasses
 import difflib
+import itertools
 import json
+import os
 import typing
 from pathlib import Path
 
 import networkx as nx
 import nltk
 
-from model import meta_model
+from model import ged, layout, matcher, meta_model
+from model.interning import Interner, intern
+
+if typing.TYPE_CHECKING:
+    from model.graph_store import GraphStore
+
+
+def tokenize(name: str) -> typing.Tuple[str, ...]:
+    return tuple(t.lower() for t in nltk.word_tokenize(name))
 
 
 def node_match(threshold: float = 0.6):
+    # GED search compares the same node pairs over and over, similarities are
+    # memoized for as long as this matcher lives, i.e. one GED run
+    similarities: typing.Dict[
+        typing.Tuple[typing.Tuple[str, ...], typing.Tuple[str, ...]], float
+    ] = {}
+
     def match(n1, n2) -> float:
         if n1["type"].lower() != n2["type"].lower():
             return False
 
-        n1_tokens = [t.lower() for t in nltk.word_tokenize(n1["name"])]
-        n2_tokens = [t.lower() for t in nltk.word_tokenize(n2["name"])]
-        sim = difflib.SequenceMatcher(None, n1_tokens, n2_tokens).ratio()
+        n1_tokens = n1["tokens"] if "tokens" in n1 else tokenize(n1["name"])
+        n2_tokens = n2["tokens"] if "tokens" in n2 else tokenize(n2["name"])
+        key = (n1_tokens, n2_tokens)
+        sim = similarities.get(key)
+        if sim is None:
+            sim = difflib.SequenceMatcher(None, n1_tokens, n2_tokens).ratio()
+            similarities[key] = sim
         is_matching = sim > threshold
         return is_matching
 
@@ -30,16 +51,68 @@ def edge_match(e1, e2):
     return False
 
 
-def should_merge(
-    c1: typing.List["Node"],
-    c2: typing.List["Node"],
-    match_node: typing.Optional[typing.Callable[["Node", "Node"], bool]],
-) -> bool:
-    for n1 in c1:
-        for n2 in c2:
-            if match_node(n1, n2):
-                return True
-    return False
+# below this many nodes starting worker processes costs more than it saves
+PARALLEL_COMPACTION_THRESHOLD = 500
+
+
+def _cluster_nodes(
+    nodes: typing.Sequence["Node"], match_node: matcher.NodeMatcher
+) -> typing.List[typing.List[int]]:
+    """
+    Groups nodes by index. Going through the nodes in order, each node that is
+    not part of a cluster yet starts a new one and takes in all later nodes
+    that match it and are not part of a cluster either.
+    """
+    prepared = match_node.prepare(nodes)
+    assigned = [False] * len(nodes)
+    clusters = []
+    for i in range(len(nodes)):
+        if assigned[i]:
+            continue
+        assigned[i] = True
+        cluster = [i]
+        others = sorted(j for j in prepared.candidates(i) if j > i and not assigned[j])
+        for j, matches in zip(others, prepared.score_batch(i, others)):
+            if matches:
+                assigned[j] = True
+                cluster.append(j)
+        clusters.append(cluster)
+    return clusters
+
+
+def _cluster_nodes_by_type(
+    nodes: typing.Sequence["Node"],
+    match_node: matcher.NodeMatcher,
+    processes: typing.Optional[int] = None,
+) -> typing.List[typing.List[int]]:
+    """
+    Same result as `_cluster_nodes`, as long as `match_node` never matches
+    nodes of different types. Every type is clustered on its own, for large
+    graphs in a process pool, which requires `match_node` to be picklable.
+    """
+    partitions: typing.Dict[str, typing.List[int]] = {}
+    for i, n in enumerate(nodes):
+        partitions.setdefault(n.entity.name.lower(), []).append(i)
+    indices = list(partitions.values())
+    partition_nodes = [[nodes[i] for i in p] for p in indices]
+
+    workers = min(processes or os.cpu_count() or 1, len(indices))
+    if len(nodes) >= PARALLEL_COMPACTION_THRESHOLD and workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(
+                pool.map(_cluster_nodes, partition_nodes, itertools.repeat(match_node))
+            )
+    else:
+        results = [_cluster_nodes(p, match_node) for p in partition_nodes]
+
+    clusters = [
+        [partition[i] for i in cluster]
+        for partition, partition_clusters in zip(indices, results)
+        for cluster in partition_clusters
+    ]
+    # the sequential algorithm creates clusters in the order of their first node
+    clusters.sort(key=lambda c: c[0])
+    return clusters
 
 
 @dataclasses.dataclass(frozen=True)
@@ -50,41 +123,83 @@ class Graph:
     def compact(
         self,
         *,
-        match_node: typing.Optional[typing.Callable[["Node", "Node"], bool]] = None,
+        match_node: typing.Optional[
+            typing.Union[matcher.NodeMatcher, typing.Callable[["Node", "Node"], bool]]
+        ] = None,
         match_edge: typing.Optional[typing.Callable[["Edge", "Edge"], bool]] = None,
+        partition_by_type: bool = False,
+        processes: typing.Optional[int] = None,
+    ) -> "Graph":
+        """
+        Merges matching nodes and edges. With `partition_by_type`, nodes of
+        each entity type are matched separately and in parallel, which only
+        gives the same result if `match_node` never matches nodes of
+        different types, like the matchers in `model.match` do.
+        """
+        if match_node is None:
+            return self._collapse_clusters(
+                [[n] for n in self.nodes], match_edge, verbose=False
+            )
+
+        match_node = matcher.as_node_matcher(match_node)
+        if partition_by_type:
+            clusters = _cluster_nodes_by_type(self.nodes, match_node, processes)
+        else:
+            clusters = _cluster_nodes(self.nodes, match_node)
+        return self._collapse_clusters(
+            [[self.nodes[i] for i in indices] for indices in clusters], match_edge
+        )
+
+    def collapse(
+        self,
+        partition: typing.Union[
+            typing.Sequence[typing.Sequence["Node"]], typing.Dict[str, typing.Hashable]
+        ],
+        *,
+        match_edge: typing.Optional[typing.Callable[["Edge", "Edge"], bool]] = None,
+    ) -> "Graph":
+        """
+        Merges nodes that are known to belong together, given either as
+        clusters of nodes or as a map from node id to cluster id. Nodes that
+        are not part of the partition are kept as they are. Gives the same
+        result as `compact` with a matcher that matches nodes of the same
+        cluster, but takes a single pass over the nodes.
+        """
+        if isinstance(partition, dict):
+            cluster_ids = partition
+        else:
+            cluster_ids = {n.id: i for i, c in enumerate(partition) for n in c}
+
+        clusters: typing.Dict[typing.Tuple[str, typing.Hashable], typing.List[Node]]
+        clusters = {}
+        for n in self.nodes:
+            if n.id in cluster_ids:
+                key = ("cluster", cluster_ids[n.id])
+            else:
+                key = ("node", n.id)
+            clusters.setdefault(key, []).append(n)
+        return self._collapse_clusters(list(clusters.values()), match_edge)
+
+    def _collapse_clusters(
+        self,
+        clusters: typing.List[typing.List["Node"]],
+        match_edge: typing.Optional[typing.Callable[["Edge", "Edge"], bool]],
+        verbose: bool = True,
     ) -> "Graph":
         new_nodes = []
         new_edges = []
 
         node_mappings: typing.Dict[str, Node] = {}
 
-        if match_node is not None:
-            un_merged_clusters = [[n] for n in self.nodes]
-            merged_clusters = []
-
-            while len(un_merged_clusters) > 0:
-                cluster = un_merged_clusters.pop(0)
-                clusters_to_merge = []
-                for other in un_merged_clusters:
-                    if should_merge(cluster, other, match_node):
-                        clusters_to_merge.append(other)
-                for other in clusters_to_merge:
-                    un_merged_clusters.remove(other)
-                    cluster += other
-                merged_clusters.append(cluster)
-
-            for cluster in merged_clusters:
-                n: Node
-                cluster = sorted(cluster, key=lambda n: len(n.name), reverse=True)
-                representative = cluster[0]
-                new_nodes.append(representative)
-                for n in cluster:
-                    node_mappings[n.id] = representative
+        for cluster in clusters:
+            n: Node
+            cluster = sorted(cluster, key=lambda n: len(n.name), reverse=True)
+            representative = cluster[0]
+            new_nodes.append(representative)
+            for n in cluster:
+                node_mappings[n.id] = representative
+            if verbose:
                 print([n.name for n in cluster])
-        else:
-            for node in self.nodes:
-                new_nodes.append(node)
-                node_mappings[node.id] = node
 
         if match_edge is not None:
             for edge in self.edges:
@@ -125,11 +240,20 @@ class Graph:
         self,
         other: "Graph",
         *,
-        match_node: typing.Optional[typing.Callable[["Node", "Node"], bool]],
+        match_node: typing.Optional[
+            typing.Union[matcher.NodeMatcher, typing.Callable[["Node", "Node"], bool]]
+        ],
         match_edge: typing.Optional[typing.Callable[["Edge", "Edge"], bool]],
+        partition_by_type: bool = False,
+        processes: typing.Optional[int] = None,
     ) -> "Graph":
         graph = self.union(other)
-        graph = graph.compact(match_node=match_node, match_edge=match_edge)
+        graph = graph.compact(
+            match_node=match_node,
+            match_edge=match_edge,
+            partition_by_type=partition_by_type,
+            processes=processes,
+        )
         return graph
 
     def to_dict(self) -> dict:
@@ -140,9 +264,12 @@ class Graph:
 
     @staticmethod
     def from_dict(d: dict) -> "Graph":
+        # edges embed full copies of their nodes, interning lets them share the
+        # instances from the node list along with all meta model objects
+        interner = Interner()
         return Graph(
-            nodes=[Node.from_dict(n) for n in d["nodes"]],
-            edges=[Edge.from_dict(e) for e in d["edges"]],
+            nodes=[Node.from_dict(n, interner) for n in d["nodes"]],
+            edges=[Edge.from_dict(e, interner) for e in d["edges"]],
         )
 
     @staticmethod
@@ -156,6 +283,13 @@ class Graph:
         with open(file_path, "w") as f:
             json.dump(self.to_dict(), f)
 
+    @staticmethod
+    def from_store(store: "GraphStore") -> "Graph":
+        return store.load_graph()
+
+    def to_store(self, store: "GraphStore") -> None:
+        store.save_graph(self)
+
     def replace_node(self, node: "Node") -> "Graph":
         updated_edges = []
         for e in self.edges:
@@ -172,36 +306,72 @@ class Graph:
                 updated_nodes.append(n)
         return Graph(nodes=updated_nodes, edges=updated_edges)
 
-    def to_nx(self) -> nx.Graph:
+    def to_nx(self, with_tokens: bool = False) -> nx.Graph:
+        """
+        With `with_tokens`, every node also carries its tokenized, lower cased
+        name as "tokens", which `node_match` uses instead of tokenizing again.
+        """
         g = nx.Graph()
         g.add_nodes_from(
             (n.id, {"name": n.name, "type": n.entity.name, "id": n.id})
             for n in self.nodes
         )
+        if with_tokens:
+            for n in self.nodes:
+                g.nodes[n.id]["tokens"] = tokenize(n.name)
         g.add_edges_from(
             (r.source.id, r.target.id, {"type": r.type}) for r in self.edges
         )
         return g
 
-    def layout(self) -> "Graph":
-        g = self.to_nx()
-        pos = nx.kamada_kawai_layout(g, scale=500)
-
-        knowledge_graph = self
+    def with_positions(
+        self, positions: typing.Dict[str, typing.Tuple[float, float]]
+    ) -> "Graph":
+        updated_nodes: typing.Dict[str, Node] = {}
         for n in self.nodes:
-            n_pos = pos[n.id]
-            assert n_pos.shape == (2,)
-            pos_as_tuple = (n_pos[0], n_pos[1])
-            knowledge_graph = knowledge_graph.replace_node(
-                n.with_position(pos_as_tuple)
-            )
-        return knowledge_graph
+            if n.id in positions:
+                updated_nodes[n.id] = n.with_position(positions[n.id])
+        return Graph(
+            nodes=[updated_nodes.get(n.id, n) for n in self.nodes],
+            edges=[
+                Edge(
+                    id=e.id,
+                    source=updated_nodes.get(e.source.id, e.source),
+                    target=updated_nodes.get(e.target.id, e.target),
+                    type=e.type,
+                )
+                for e in self.edges
+            ],
+        )
+
+    def layout(
+        self,
+        *,
+        fixed_positions: typing.Optional[
+            typing.Dict[str, typing.Tuple[float, float]]
+        ] = None,
+        cache: typing.Optional[layout.LayoutCache] = None,
+        processes: typing.Optional[int] = None,
+    ) -> "Graph":
+        """
+        Computes positions for all nodes. If `fixed_positions` is given, nodes
+        listed there keep their position and only the remaining nodes are
+        placed, see `layout.incremental`.
+        """
+        pos = layout.compute(
+            self.to_nx(),
+            scale=500,
+            fixed=fixed_positions,
+            cache=cache,
+            processes=processes,
+        )
+        return self.with_positions(pos)
 
     def graph_edit_distance(
         self, other: "Graph", timeout_seconds: float = 60 * 2
     ) -> float:
-        g1 = self.to_nx()
-        g2 = other.to_nx()
+        g1 = self.to_nx(with_tokens=True)
+        g2 = other.to_nx(with_tokens=True)
 
         return nx.graph_edit_distance(
             g1,
@@ -211,6 +381,18 @@ class Graph:
             timeout=timeout_seconds,
         )
 
+    def approximate_graph_edit_distance(self, other: "Graph") -> ged.GedBounds:
+        """
+        Lower and upper bound on `graph_edit_distance`, computed in polynomial
+        time, see `ged.approximate_graph_edit_distance`.
+        """
+        return ged.approximate_graph_edit_distance(
+            self.to_nx(with_tokens=True),
+            other.to_nx(with_tokens=True),
+            node_match=node_match(threshold=0.6),
+            edge_label=lambda e: e["type"].lower(),
+        )
+
 
 @dataclasses.dataclass(frozen=True, eq=True)
 class Aspect:
@@ -230,7 +412,7 @@ class Aspect:
         return Aspect(name=d["name"], shape=d["shape"], color=d["color"])
 
 
-@dataclasses.dataclass(frozen=True, eq=True)
+@dataclasses.dataclass(frozen=True, eq=True, slots=True)
 class DataSource:
     file: str
     page_start: int
@@ -244,41 +426,81 @@ class DataSource:
         }
 
     @staticmethod
-    def from_dict(d: dict) -> "DataSource":
-        return DataSource(
-            file=d["file"], page_start=d["pageStart"], page_end=d["pageEnd"]
+    def from_dict(d: dict, interner: typing.Optional[Interner] = None) -> "DataSource":
+        return intern(
+            DataSource(
+                file=d["file"], page_start=d["pageStart"], page_end=d["pageEnd"]
+            ),
+            interner,
         )
 
 
-@dataclasses.dataclass(frozen=True, eq=True)
+@dataclasses.dataclass(frozen=True, eq=False, slots=True)
 class Node:
+    """
+    Nodes are identified by their id alone, hashing and comparing them does not
+    recurse into the data source or the entity definition.
+    """
+
     id: str
     name: str
     position: typing.Tuple[float, float] | None
     entity: meta_model.Entity
     source: DataSource
+    _hash: int = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "_hash", hash(("Node", self.id)))
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, Node):
+            return NotImplemented
+        return self._hash == other._hash and self.id == other.id
+
+    def __reduce__(self):
+        # string hashes are salted per process, never ship the cached one
+        return Node, (self.id, self.name, self.position, self.entity, self.source)
 
     def to_dict(self):
         return {
             "id": self.id,
             "name": self.name,
             "entity": self.entity.to_dict(),
-            "position": {
-                "x": self.position[0],
-                "y": self.position[1],
-            },
+            "position": (
+                None
+                if self.position is None
+                else {"x": self.position[0], "y": self.position[1]}
+            ),
             "source": self.source.to_dict(),
         }
 
     @staticmethod
-    def from_dict(d: dict) -> "Node":
-        return Node(
+    def from_dict(d: dict, interner: typing.Optional[Interner] = None) -> "Node":
+        node = Node(
             id=d["id"],
             name=d["name"],
-            position=(d["position"]["x"], d["position"]["y"]),
-            entity=meta_model.Entity.from_dict(d["entity"]),
-            source=DataSource.from_dict(d["source"]),
+            position=(
+                None
+                if d["position"] is None
+                else (d["position"]["x"], d["position"]["y"])
+            ),
+            entity=meta_model.Entity.from_dict(d["entity"], interner),
+            source=DataSource.from_dict(d["source"], interner),
         )
+        # an edge may embed an outdated copy of a node, which has to stay a
+        # copy instead of being swapped for the node with the same id
+        return intern(node, interner, key=node.values())
+
+    def values(self) -> tuple:
+        """
+        All fields of this node, for comparing nodes by content instead of id.
+        """
+        return self.id, self.name, self.position, self.entity, self.source
 
     def with_position(self, pos: typing.Tuple[float, float]) -> "Node":
         return Node(
@@ -290,12 +512,33 @@ class Node:
         )
 
 
-@dataclasses.dataclass(frozen=True, eq=True)
+@dataclasses.dataclass(frozen=True, eq=False, slots=True)
 class Edge:
+    """
+    Like nodes, edges are identified by their id alone.
+    """
+
     id: str
     source: Node
     target: Node
     type: str
+    _hash: int = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "_hash", hash(("Edge", self.id)))
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, Edge):
+            return NotImplemented
+        return self._hash == other._hash and self.id == other.id
+
+    def __reduce__(self):
+        return Edge, (self.id, self.source, self.target, self.type)
 
     def to_dict(self):
         return {
@@ -306,10 +549,10 @@ class Edge:
         }
 
     @staticmethod
-    def from_dict(d: dict) -> "Edge":
+    def from_dict(d: dict, interner: typing.Optional[Interner] = None) -> "Edge":
         return Edge(
             id=d["id"],
-            source=Node.from_dict(d["source"]),
-            target=Node.from_dict(d["target"]),
+            source=Node.from_dict(d["source"], interner),
+            target=Node.from_dict(d["target"], interner),
             type=d["type"],
         )
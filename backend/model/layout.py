@@ -0,0 +1,565 @@
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+import typing
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+from scipy.sparse import csgraph
+
+Position = typing.Tuple[float, float]
+
+# kamada kawai needs all pairwise distances, above this many nodes the sparse
+# stress layout is used instead
+LARGE_GRAPH_THRESHOLD = 1000
+
+# below this many nodes starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 500
+
+# new nodes of an incremental layout are only pushed away by nodes closer than
+# this many times the typical edge length
+REPULSION_CUTOFF = 2
+
+
+class LayoutCache:
+    """
+    On-disk store of computed layouts, keyed by a canonical hash of the graph
+    structure and the layout parameters. Node names and types do not
+    influence a layout, so they are not part of the key. At most
+    `max_entries` layouts are kept, the least recently used ones are removed
+    first.
+    """
+
+    def __init__(self, directory: typing.Union[str, Path], max_entries: int = 256):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(g: nx.Graph, **parameters) -> str:
+        structure = {
+            "nodes": sorted(g.nodes),
+            "edges": sorted(sorted(e) for e in g.edges),
+            "parameters": parameters,
+        }
+        encoded = json.dumps(structure, sort_keys=True).encode("utf8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key: str) -> typing.Optional[typing.Dict[str, Position]]:
+        path = self.directory / f"{key}.json"
+        try:
+            with open(path) as f:
+                positions = {n: (p[0], p[1]) for n, p in json.load(f).items()}
+            _touch(path)
+        except FileNotFoundError:
+            # not cached, or evicted by another process in the meantime
+            return None
+        return positions
+
+    def put(self, key: str, positions: typing.Dict[str, Position]) -> None:
+        # write to a temporary file first, concurrent readers must never see
+        # a partially written layout
+        path = self.directory / f"{key}.json"
+        temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary_path, "w") as f:
+            json.dump(positions, f)
+        os.replace(temporary_path, path)
+        _touch(path)
+        self._evict()
+
+    def _evict(self) -> None:
+        # modification times record the last use, see `_touch`
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime_ns, path.name, path))
+            except FileNotFoundError:
+                pass
+        entries.sort()
+        for _, _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _touch(path: Path) -> None:
+    # file systems stamp files with a coarse clock, set the exact time so the
+    # order of uses survives
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+def compute(
+    g: nx.Graph,
+    scale: float,
+    *,
+    fixed: typing.Optional[typing.Dict[str, Position]] = None,
+    cache: typing.Optional[LayoutCache] = None,
+    processes: typing.Optional[int] = None,
+) -> typing.Dict[str, Position]:
+    """
+    Entry point for laying out graphs with string node ids. The graph is
+    rebuilt in a canonical node and edge order first, so the same structure
+    always yields the same layout, which is what makes caching it valid.
+    Incremental layouts are not cached, as the positions they start from
+    differ after every change, and they are cheap to compute anyway.
+    """
+    canonical = nx.Graph()
+    canonical.add_nodes_from(sorted(g.nodes))
+    canonical.add_edges_from(sorted(sorted(e) for e in g.edges))
+
+    if fixed is not None:
+        return incremental(canonical, fixed, scale)
+
+    key = None
+    if cache is not None:
+        key = cache.key(canonical, scale=scale)
+        positions = cache.get(key)
+        if positions is not None:
+            return positions
+
+    positions = automatic(canonical, scale, processes)
+
+    if cache is not None:
+        cache.put(key, positions)
+    return positions
+
+
+def automatic(
+    g: nx.Graph, scale: float, processes: typing.Optional[int] = None
+) -> typing.Dict[typing.Hashable, Position]:
+    if nx.number_connected_components(g) > 1:
+        return components(g, scale, processes)
+    return _connected(g, scale)
+
+
+def _connected(g: nx.Graph, scale: float) -> typing.Dict[typing.Hashable, Position]:
+    if len(g) > LARGE_GRAPH_THRESHOLD:
+        return sparse_stress(g, scale)
+    return kamada_kawai(g, scale)
+
+
+def components(
+    g: nx.Graph,
+    scale: float,
+    processes: typing.Optional[int] = None,
+) -> typing.Dict[typing.Hashable, Position]:
+    """
+    Lays out every connected component on its own, in a process pool for large
+    graphs, and packs the results next to each other without overlap.
+    Components keep a size proportional to the square root of their node
+    count, so the overall drawing has roughly the extent of `scale`.
+    """
+    parts = [
+        g.subgraph(c).copy()
+        for c in sorted(nx.connected_components(g), key=len, reverse=True)
+    ]
+    if len(parts) <= 1:
+        return _connected(g, scale)
+
+    unit = scale / np.sqrt(len(g))
+    jobs = [(part, unit * np.sqrt(len(part))) for part in parts]
+    workers = processes or os.cpu_count() or 1
+    if len(g) >= PARALLEL_THRESHOLD and workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            layouts = list(
+                pool.map(
+                    _layout_component,
+                    jobs,
+                    chunksize=max(1, len(jobs) // (4 * workers)),
+                )
+            )
+    else:
+        layouts = [_layout_component(job) for job in jobs]
+
+    return _pack(layouts, padding=unit)
+
+
+def _layout_component(
+    job: typing.Tuple[nx.Graph, float],
+) -> typing.Dict[typing.Hashable, Position]:
+    g, scale = job
+    if len(g) == 1:
+        return {n: (0.0, 0.0) for n in g.nodes}
+    return _connected(g, scale)
+
+
+def _pack(
+    layouts: typing.List[typing.Dict[typing.Hashable, Position]],
+    padding: float,
+) -> typing.Dict[typing.Hashable, Position]:
+    """
+    Shelf packing: boxes are sorted by height and placed in rows of roughly
+    equal width, so the packed drawing ends up about square.
+    """
+    boxes = []
+    for pos in layouts:
+        xy = np.array(list(pos.values()))
+        low = xy.min(axis=0)
+        size = xy.max(axis=0) - low + padding
+        boxes.append((pos, low, size))
+
+    row_width = max(
+        np.sqrt(sum(size[0] * size[1] for _, _, size in boxes)),
+        max(size[0] for _, _, size in boxes),
+    )
+
+    result = {}
+    x, y, row_height = 0.0, 0.0, 0.0
+    for pos, low, size in sorted(boxes, key=lambda b: b[2][1], reverse=True):
+        if x > 0 and x + size[0] > row_width:
+            x, y, row_height = 0.0, y + row_height, 0.0
+        offset = np.array([x, y]) - low
+        for n, p in pos.items():
+            result[n] = (p[0] + offset[0], p[1] + offset[1])
+        x += size[0]
+        row_height = max(row_height, size[1])
+
+    xy = np.array(list(result.values()))
+    center = (xy.min(axis=0) + xy.max(axis=0)) / 2
+    return {
+        n: (float(p[0] - center[0]), float(p[1] - center[1])) for n, p in result.items()
+    }
+
+
+def kamada_kawai(g: nx.Graph, scale: float) -> typing.Dict[typing.Hashable, Position]:
+    pos = nx.kamada_kawai_layout(g, scale=scale)
+    return {n: (float(p[0]), float(p[1])) for n, p in pos.items()}
+
+
+def sparse_stress(
+    g: nx.Graph,
+    scale: float,
+    num_pivots: int = 50,
+    iterations: int = 30,
+) -> typing.Dict[typing.Hashable, Position]:
+    """
+    Layout for large graphs, memory is linear in the number of nodes and edges.
+    Initial positions come from pivot MDS (Brandes & Pich, 2007), which are then
+    refined by sparse stress majorization (Ortmann et al., 2016): every node is
+    only attracted to its neighbours and a small set of pivot nodes instead of
+    to all other nodes.
+    """
+    nodes = list(g.nodes)
+    if len(nodes) == 0:
+        return {}
+    if len(nodes) == 1:
+        return {nodes[0]: (0.0, 0.0)}
+
+    adjacency = nx.to_scipy_sparse_array(g, nodelist=nodes, weight=None, format="csr")
+    pivots, distances = _pivot_distances(adjacency, min(num_pivots, len(nodes)))
+    pos = _pivot_mds(distances)
+
+    sources, targets = adjacency.nonzero()
+    not_loop = sources != targets
+    term_sources = [sources[not_loop]]
+    term_targets = [targets[not_loop]]
+    term_distances = [np.ones(np.count_nonzero(not_loop))]
+    term_weights = [np.ones(np.count_nonzero(not_loop))]
+
+    # each pivot stands in for roughly n / k nodes, weigh its terms accordingly
+    pivot_weight = len(nodes) / len(pivots)
+    for column, p in enumerate(pivots):
+        d = distances[:, column]
+        reachable = np.isfinite(d) & (d > 0)
+        node_indices = np.flatnonzero(reachable)
+        term_sources.append(node_indices)
+        term_targets.append(np.full(len(node_indices), p))
+        term_distances.append(d[reachable])
+        term_weights.append(pivot_weight / d[reachable] ** 2)
+
+    term_sources = np.concatenate(term_sources)
+    term_targets = np.concatenate(term_targets)
+    term_distances = np.concatenate(term_distances)
+    term_weights = np.concatenate(term_weights)
+    weight_sums = np.bincount(term_sources, weights=term_weights, minlength=len(nodes))
+    has_terms = weight_sums > 0
+
+    for _ in range(iterations):
+        delta = pos[term_sources] - pos[term_targets]
+        length = np.linalg.norm(delta, axis=1)
+        np.clip(length, 1e-9, None, out=length)
+        wanted = pos[term_targets] + delta * (term_distances / length)[:, np.newaxis]
+        updated = pos.copy()
+        for axis in range(2):
+            total = np.bincount(
+                term_sources,
+                weights=term_weights * wanted[:, axis],
+                minlength=len(nodes),
+            )
+            updated[has_terms, axis] = total[has_terms] / weight_sums[has_terms]
+        pos = updated
+
+    pos = nx.rescale_layout(pos, scale=scale)
+    return {n: (float(p[0]), float(p[1])) for n, p in zip(nodes, pos)}
+
+
+def _pivot_distances(
+    adjacency, num_pivots: int
+) -> typing.Tuple[typing.List[int], np.ndarray]:
+    """
+    Picks pivots by max-min selection, starting with the node of highest degree,
+    and returns their BFS distances to all nodes as a (nodes x pivots) matrix.
+    """
+    num_nodes = adjacency.shape[0]
+    distances = np.empty((num_nodes, num_pivots))
+    closest = np.full(num_nodes, np.inf)
+    pivot = int(np.argmax(np.diff(adjacency.indptr)))
+    pivots = []
+    for column in range(num_pivots):
+        pivots.append(pivot)
+        d = csgraph.dijkstra(adjacency, indices=pivot, unweighted=True)
+        distances[:, column] = d
+        # unreachable nodes are the farthest away of all
+        closest = np.minimum(closest, np.where(np.isfinite(d), d, num_nodes))
+        closest[pivots] = -1
+        pivot = int(np.argmax(closest))
+    return pivots, distances
+
+
+def _pivot_mds(distances: np.ndarray) -> np.ndarray:
+    finite = distances[np.isfinite(distances)]
+    longest = finite.max() if len(finite) > 0 else 0.0
+    d = np.where(np.isfinite(distances), distances, longest + 1)
+
+    squared = d**2
+    centered = (
+        squared
+        - squared.mean(axis=0, keepdims=True)
+        - squared.mean(axis=1, keepdims=True)
+        + squared.mean()
+    )
+    centered *= -0.5
+    u, singular_values, _ = np.linalg.svd(centered, full_matrices=False)
+    pos = u[:, :2] * singular_values[:2]
+    if pos.shape[1] < 2:
+        pos = np.hstack([pos, np.zeros((len(pos), 2 - pos.shape[1]))])
+
+    # bring the coordinates into graph distance units, so stress majorization
+    # starts from roughly the right size
+    spread = np.abs(pos).max()
+    if spread > 0:
+        pos *= (longest / 2) / spread
+    return pos
+
+
+def incremental(
+    g: nx.Graph,
+    fixed: typing.Dict[typing.Hashable, typing.Optional[Position]],
+    scale: float,
+    iterations: int = 50,
+    seed: int = 42,
+) -> typing.Dict[typing.Hashable, Position]:
+    """
+    Places the nodes of `g` that have no position in `fixed` and leaves all
+    others where they are. New nodes are seeded next to their already placed
+    neighbours and then moved by a force-directed refinement that only
+    computes forces acting on new nodes, so the cost grows with the number of
+    new nodes instead of the size of the whole graph. New components without
+    any placed node are laid out on their own and packed next to the existing
+    drawing, so repeated uploads do not spread the drawing out.
+    """
+    fixed = {n: p for n, p in fixed.items() if n in g and p is not None}
+    new_nodes = [n for n in g.nodes if n not in fixed]
+    if len(fixed) == 0:
+        return automatic(g, scale)
+    if len(new_nodes) == 0:
+        return dict(fixed)
+
+    rng = np.random.default_rng(seed)
+    nodes = list(fixed.keys()) + new_nodes
+    index = {n: i for i, n in enumerate(nodes)}
+    num_fixed = len(fixed)
+
+    # work in unit scale, like networkx layouts do before rescaling
+    pos = np.zeros((len(nodes), 2))
+    pos[:num_fixed] = np.array(list(fixed.values()), dtype=float) / scale
+
+    fixed_edges = [
+        (index[u], index[v]) for u, v in g.edges if u in fixed and v in fixed
+    ]
+    if len(fixed_edges) > 0:
+        u, v = np.array(fixed_edges).T
+        k = float(np.median(np.linalg.norm(pos[u] - pos[v], axis=1)))
+    else:
+        k = 0.0
+    if k <= 0.0:
+        k = 1.0 / np.sqrt(len(nodes))
+
+    unanchored = [
+        c
+        for c in nx.connected_components(g.subgraph(new_nodes))
+        if not any(m in fixed for n in c for m in g.neighbors(n))
+    ]
+    if len(unanchored) > 0:
+        _place_unanchored(g, unanchored, index, num_fixed, pos, k)
+        packed = {n for c in unanchored for n in c}
+        new_nodes = [n for n in new_nodes if n not in packed]
+        # packed nodes do not move any more, from here on they count as fixed
+        nodes = list(fixed.keys()) + [n for n in g.nodes if n in packed] + new_nodes
+        order = [index[n] for n in nodes]
+        pos = pos[order]
+        index = {n: i for i, n in enumerate(nodes)}
+        num_fixed = len(nodes) - len(new_nodes)
+
+    if len(new_nodes) > 0:
+        _seed_new_nodes(g, nodes, index, num_fixed, pos, k, rng)
+        _refine_new_nodes(g, index, num_fixed, pos, k, iterations)
+
+    result = dict(fixed)
+    for n in nodes[len(fixed) :]:
+        p = pos[index[n]] * scale
+        result[n] = (float(p[0]), float(p[1]))
+    return result
+
+
+def _place_unanchored(
+    g: nx.Graph,
+    unanchored: typing.List[typing.Set[typing.Hashable]],
+    index: typing.Dict[typing.Hashable, int],
+    num_fixed: int,
+    pos: np.ndarray,
+    k: float,
+) -> None:
+    """
+    Lays out the given components of new nodes, packs them into one block and
+    puts that block into the free spot closest to the center of the fixed
+    nodes. Gaps at the border of the drawing are filled first, so it only
+    grows with the area of what is added.
+    """
+    # layouts span twice their scale, this keeps edges about `k` long
+    layouts = [
+        _layout_component((g.subgraph(c), k * np.sqrt(len(c)) / 2))
+        for c in sorted(unanchored, key=lambda c: (-len(c), min(map(str, c))))
+    ]
+    block = _pack(layouts, padding=k)
+
+    xy = np.array(list(block.values()))
+    block_low = xy.min(axis=0)
+    low = _free_spot(pos[:num_fixed], xy.max(axis=0) - block_low, k)
+    for n, p in block.items():
+        pos[index[n]] = np.array(p) - block_low + low
+
+
+def _free_spot(points: np.ndarray, size: np.ndarray, cell: float) -> np.ndarray:
+    """
+    Lower corner of the box of the given size that is closest to the center
+    of `points` and keeps a distance of at least `cell` to all of them. Boxes
+    are searched on a grid of that cell size, using a summed-area table of
+    the occupied cells.
+    """
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    # one free cell on every side of the box
+    window = np.ceil(size / cell).astype(int) + 2
+    origin = low - (window + 1) * cell
+    shape = np.floor((high + (window + 1) * cell - origin) / cell).astype(int) + 1
+
+    occupied = np.zeros(shape + 1)
+    cells = np.floor((points - origin) / cell).astype(int)
+    np.add.at(occupied, (cells[:, 0] + 1, cells[:, 1] + 1), 1)
+    summed = occupied.cumsum(axis=0).cumsum(axis=1)
+    wx, wy = window
+    counts = (
+        summed[wx:, wy:] - summed[:-wx, wy:] - summed[wx:, :-wy] + summed[:-wx, :-wy]
+    )
+
+    free = np.argwhere(counts == 0)
+    corners = origin + (free + 1) * cell
+    centers = corners + size / 2
+    best = np.argmin(np.linalg.norm(centers - (low + high) / 2, axis=1))
+    return corners[best]
+
+
+def _refine_new_nodes(
+    g: nx.Graph,
+    index: typing.Dict[typing.Hashable, int],
+    num_fixed: int,
+    pos: np.ndarray,
+    k: float,
+    iterations: int,
+) -> None:
+    new_edges = np.array(
+        [
+            (index[u], index[v])
+            for u, v in g.edges
+            if u != v and (index[u] >= num_fixed or index[v] >= num_fixed)
+        ],
+        dtype=int,
+    ).reshape(-1, 2)
+
+    # the pairwise buffers are the only arrays of size new x all nodes, they
+    # are allocated once and reused in every iteration
+    num_new = len(pos) - num_fixed
+    delta = np.empty((num_new, len(pos), 2))
+    distance = np.empty((num_new, len(pos)))
+    displacement = np.empty((num_new, 2))
+
+    temperature = k
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        np.subtract(pos[num_fixed:, np.newaxis, :], pos[np.newaxis, :, :], out=delta)
+        np.einsum("ijk,ijk->ij", delta, delta, out=distance)
+        # repulsion from nodes nearby, attraction along incident edges, like
+        # the grid variant of Fruchterman & Reingold does it
+        np.clip(distance, (0.01 * k) ** 2, None, out=distance)
+        far = distance > (REPULSION_CUTOFF * k) ** 2
+        np.divide(k * k, distance, out=distance)
+        distance[far] = 0.0
+        np.einsum("ijk,ij->ik", delta, distance, out=displacement)
+        for a, b in ((0, 1), (1, 0)):
+            sources = new_edges[:, a]
+            targets = new_edges[:, b]
+            is_new = sources >= num_fixed
+            edge_delta = pos[targets[is_new]] - pos[sources[is_new]]
+            edge_length = np.linalg.norm(edge_delta, axis=1, keepdims=True)
+            np.add.at(
+                displacement,
+                sources[is_new] - num_fixed,
+                edge_delta * edge_length / k,
+            )
+
+        length = np.linalg.norm(displacement, axis=1, keepdims=True)
+        np.clip(length, 1e-9, None, out=length)
+        pos[num_fixed:] += displacement / length * np.minimum(length, temperature)
+        temperature -= cooling
+
+
+def _seed_new_nodes(
+    g: nx.Graph,
+    nodes: typing.List[typing.Hashable],
+    index: typing.Dict[typing.Hashable, int],
+    num_fixed: int,
+    pos: np.ndarray,
+    k: float,
+    rng: np.random.Generator,
+) -> None:
+    placed = np.zeros(len(nodes), dtype=bool)
+    placed[:num_fixed] = True
+    queued = placed.copy()
+
+    # breadth first outwards from the fixed part of the graph, so chains of
+    # new nodes are seeded one after the other next to placed neighbours
+    queue = collections.deque()
+    for n in nodes[num_fixed:]:
+        if any(placed[index[m]] for m in g.neighbors(n)):
+            queue.append(n)
+            queued[index[n]] = True
+
+    # every new node is connected to a placed one, components of only new
+    # nodes are packed by `_place_unanchored` beforehand
+    while len(queue) > 0:
+        n = queue.popleft()
+        i = index[n]
+        neighbours = [index[m] for m in g.neighbors(n) if placed[index[m]]]
+        pos[i] = pos[neighbours].mean(axis=0) + rng.normal(scale=k, size=2)
+        placed[i] = True
+        for m in g.neighbors(n):
+            if not queued[index[m]]:
+                queue.append(m)
+                queued[index[m]] = True
@@ -1,15 +1,41 @@
+import collections
 import difflib
+import json
+import os
+import pathlib
 import typing
 
 import nltk
+import numpy as np
+from scipy import sparse
 
 import model.knowledge_graph as kg
 
 
-def char_similarity(s1: str, s2: str) -> float:
+def char_similarity(
+    s1: str, s2: str, threshold: typing.Optional[float] = None
+) -> float:
+    """
+    `SequenceMatcher` ratio of the lower cased strings. With a `threshold`,
+    pairs that cannot reach it are rejected early using cheap upper bounds of
+    the ratio, and 0.0 is returned for them instead of their exact similarity.
+    """
     s1 = s1.lower()
     s2 = s2.lower()
-    return difflib.SequenceMatcher(None, s1, s2).ratio()
+    if threshold is None:
+        return difflib.SequenceMatcher(None, s1, s2).ratio()
+
+    # the same bound as real_quick_ratio, without building a matcher first
+    length = len(s1) + len(s2)
+    if length > 0 and 2.0 * min(len(s1), len(s2)) / length < threshold:
+        return 0.0
+    matcher = difflib.SequenceMatcher(None, s1, s2)
+    if matcher.quick_ratio() < threshold:
+        return 0.0
+    ratio = matcher.ratio()
+    if ratio < threshold:
+        return 0.0
+    return ratio
 
 
 def token_similarity(s1: str, s2: str) -> float:
@@ -20,60 +46,246 @@ def token_similarity(s1: str, s2: str) -> float:
     return difflib.SequenceMatcher(None, tokens_1, tokens_2).ratio()
 
 
-def overlap_similarity(
-    s1: str, s2: str, ignored_pos_tags: typing.List[str] = None
-) -> float:
+class TaggingCache:
+    """
+    Bounded, least recently used cache of tokenized and POS tagged strings.
+    Tagging is by far the most expensive part of `overlap_similarity`, and
+    evaluations tag the same names over and over again.
+    """
+
+    def __init__(self, max_size: int = 100_000):
+        self.max_size = max_size
+        self._tagged: typing.OrderedDict[
+            str, typing.Tuple[typing.Tuple[str, str], ...]
+        ] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tagged)
+
+    def tag(self, s: str) -> typing.Tuple[typing.Tuple[str, str], ...]:
+        if s in self._tagged:
+            self._tagged.move_to_end(s)
+            return self._tagged[s]
+        tagged = tuple(nltk.pos_tag(nltk.word_tokenize(s)))
+        self._put(s, tagged)
+        return tagged
+
+    def items(
+        self,
+    ) -> typing.List[typing.Tuple[str, typing.Tuple[typing.Tuple[str, str], ...]]]:
+        return list(self._tagged.items())
+
+    def put(self, s: str, tagged: typing.Sequence[typing.Sequence[str]]) -> None:
+        self._put(s, tuple((token, pos) for token, pos in tagged))
+
+    def _put(self, s: str, tagged: typing.Tuple[typing.Tuple[str, str], ...]):
+        self._tagged[s] = tagged
+        if len(self._tagged) > self.max_size:
+            self._tagged.popitem(last=False)
+
+    def save(self, file_path: typing.Union[str, pathlib.Path]) -> None:
+        with open(file_path, "w", encoding="utf8") as f:
+            json.dump([[s, tagged] for s, tagged in self._tagged.items()], f)
+
+    def load(self, file_path: typing.Union[str, pathlib.Path]) -> None:
+        if not os.path.isfile(file_path):
+            return
+        with open(file_path, encoding="utf8") as f:
+            for s, tagged in json.load(f):
+                self.put(s, tagged)
+
+
+tagging_cache = TaggingCache()
+
+
+def prepare_overlap(
+    s: str,
+    ignored_pos_tags: typing.List[str] = None,
+    cache: typing.Optional[TaggingCache] = None,
+) -> typing.Tuple[str, ...]:
+    """
+    Tokens of `s` as compared by `overlap_score`, i.e. lower cased and without
+    the ones whose POS tag is ignored.
+    """
     if ignored_pos_tags is not None:
         ignored_pos_tags = [p.lower() for p in ignored_pos_tags]
+    if cache is None:
+        cache = tagging_cache
 
-    s1 = s1.lower()
-    s2 = s2.lower()
-    pos_tagged_1 = nltk.pos_tag(nltk.word_tokenize(s1))
-    pos_tagged_2 = nltk.pos_tag(nltk.word_tokenize(s2))
-    pos_tagged_1 = [
-        (token, pos)
-        for token, pos in pos_tagged_1
-        if ignored_pos_tags is None or pos.lower() not in ignored_pos_tags
-    ]
-    pos_tagged_2 = [
-        (token, pos)
-        for token, pos in pos_tagged_2
+    return tuple(
+        token
+        for token, pos in cache.tag(s.lower())
         if ignored_pos_tags is None or pos.lower() not in ignored_pos_tags
-    ]
+    )
+
 
-    tokens1 = [t for t, _ in pos_tagged_1]
-    tokens2 = [t for t, _ in pos_tagged_2]
-    same_tokens = [t for t in tokens1 if t in tokens2]
+def overlap_score(
+    tokens1: typing.Sequence[str], tokens2: typing.Sequence[str]
+) -> float:
+    lookup = set(tokens2)
+    same_tokens = [t for t in tokens1 if t in lookup]
     return len(same_tokens) / (max(len(tokens1), len(tokens2)))
 
 
+def overlap_similarity(
+    s1: str, s2: str, ignored_pos_tags: typing.List[str] = None
+) -> float:
+    return overlap_score(
+        prepare_overlap(s1, ignored_pos_tags), prepare_overlap(s2, ignored_pos_tags)
+    )
+
+
+def char_ngrams(s: str, n: int = 3) -> typing.Counter[str]:
+    # padding lets n-grams at the start and end of words count as well
+    padded = f" {s.lower()} "
+    if len(padded) <= n:
+        return collections.Counter([padded])
+    return collections.Counter(padded[i : i + n] for i in range(len(padded) - n + 1))
+
+
+def _ngram_vectors(
+    names: typing.Sequence[str], vocabulary: typing.Dict[str, int], n: int
+) -> typing.Tuple[typing.List[int], typing.List[int], typing.List[float]]:
+    rows, columns, values = [], [], []
+    for row, name in enumerate(names):
+        for gram, count in char_ngrams(name, n).items():
+            rows.append(row)
+            columns.append(vocabulary.setdefault(gram, len(vocabulary)))
+            values.append(count)
+    return rows, columns, values
+
+
+def _normalized(
+    vectors: typing.Tuple[typing.List[int], typing.List[int], typing.List[float]],
+    shape: typing.Tuple[int, int],
+) -> sparse.csr_matrix:
+    rows, columns, values = vectors
+    matrix = sparse.csr_matrix(
+        (np.array(values, dtype=float), (rows, columns)), shape=shape
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def ngram_similarity_matrix(
+    names1: typing.Sequence[str],
+    names2: typing.Sequence[str],
+    n: int = 3,
+    top_k: typing.Optional[int] = None,
+    threshold: typing.Optional[float] = None,
+) -> typing.Union[np.ndarray, sparse.csr_matrix]:
+    """
+    Cosine similarities between the character n-gram count vectors of all
+    pairs of names, computed as a single sparse matrix product.
+
+    Without `top_k` and `threshold` the full matrix is returned as a dense
+    array. Otherwise only the `top_k` most similar names per row and / or
+    similarities of at least `threshold` are kept, and the result is a sparse
+    matrix where all other entries are zero.
+    """
+    vocabulary: typing.Dict[str, int] = {}
+    vectors1 = _ngram_vectors(names1, vocabulary, n)
+    vectors2 = _ngram_vectors(names2, vocabulary, n)
+    m1 = _normalized(vectors1, (len(names1), len(vocabulary)))
+    m2 = _normalized(vectors2, (len(names2), len(vocabulary)))
+    similarities = sparse.csr_matrix(m1 @ m2.T)
+
+    if top_k is None and threshold is None:
+        return similarities.toarray()
+
+    if threshold is not None:
+        similarities.data[similarities.data < threshold] = 0.0
+        similarities.eliminate_zeros()
+    if top_k is not None:
+        for row in range(similarities.shape[0]):
+            start, end = similarities.indptr[row], similarities.indptr[row + 1]
+            if end - start > top_k:
+                data = similarities.data[start:end]
+                data[np.argsort(-data, kind="stable")[top_k:]] = 0.0
+        similarities.eliminate_zeros()
+    return similarities
+
+
+def ngram_similarity(s1: str, s2: str, n: int = 3) -> float:
+    """
+    Pairwise version of `ngram_similarity_matrix`, usable as a text matcher.
+    """
+    return float(ngram_similarity_matrix([s1], [s2], n)[0, 0])
+
+
+class _PreparedTextMatcher:
+    def __init__(self, matcher: "TextNodeMatcher", nodes: typing.Sequence[kg.Node]):
+        self._matcher = matcher
+        self._names = [matcher.normalize(n.name) for n in nodes]
+        self._types = [matcher.normalize(n.entity.name) for n in nodes]
+        # nodes of different types never match, so only same typed ones are
+        # candidates for each other
+        self._by_type: typing.Dict[str, typing.List[int]] = collections.defaultdict(
+            list
+        )
+        for i, t in enumerate(self._types):
+            self._by_type[t].append(i)
+
+    def candidates(self, i: int) -> typing.Iterable[int]:
+        return self._by_type[self._types[i]]
+
+    def score_batch(self, i: int, others: typing.Sequence[int]) -> typing.List[bool]:
+        name = self._names[i]
+        return [
+            self._types[i] == self._types[j]
+            and self._matcher.similarity(name, self._names[j])
+            >= self._matcher.similarity_threshold
+            for j in others
+        ]
+
+
+class TextNodeMatcher:
+    """
+    Matches nodes of the same type whose names are at least
+    `similarity_threshold` similar according to `text_matcher`. Can be called
+    with two nodes, or prepared for a whole list of nodes at once, see
+    `model.matcher.NodeMatcher`.
+    """
+
+    def __init__(
+        self,
+        text_matcher: typing.Callable[[str, str], float],
+        similarity_threshold: float,
+        case_sensitive: bool = False,
+    ):
+        self.text_matcher = text_matcher
+        self.similarity_threshold = similarity_threshold
+        self.case_sensitive = case_sensitive
+
+    def normalize(self, s: str) -> str:
+        if self.case_sensitive:
+            return s
+        return s.lower()
+
+    def similarity(self, name1: str, name2: str) -> float:
+        if self.text_matcher is char_similarity:
+            # only whether the threshold is reached matters, most pairs can be
+            # rejected without computing their exact similarity
+            return char_similarity(name1, name2, self.similarity_threshold)
+        return self.text_matcher(name1, name2)
+
+    def __call__(self, n1: kg.Node, n2: kg.Node) -> bool:
+        if self.normalize(n1.entity.name) != self.normalize(n2.entity.name):
+            return False
+        sim = self.similarity(self.normalize(n1.name), self.normalize(n2.name))
+        return sim >= self.similarity_threshold
+
+    def prepare(self, nodes: typing.Sequence[kg.Node]) -> _PreparedTextMatcher:
+        return _PreparedTextMatcher(self, nodes)
+
+
 def node_matcher(
     text_matcher: typing.Callable,
     similarity_threshold: float,
     case_sensitive: bool = False,
-):
-    def f(n1: kg.Node, n2: kg.Node) -> bool:
-        name1 = n1.name
-        if not case_sensitive:
-            name1 = name1.lower()
-        name2 = n2.name
-        if not case_sensitive:
-            name2 = name2.lower()
-
-        type1 = n1.entity.name
-        if not case_sensitive:
-            type1 = type1.lower()
-        type2 = n2.entity.name
-        if not case_sensitive:
-            type2 = type2.lower()
-
-        if type1 != type2:
-            return False
-
-        sim = text_matcher(name1, name2)
-        return sim >= similarity_threshold
-
-    return f
+) -> TextNodeMatcher:
+    return TextNodeMatcher(text_matcher, similarity_threshold, case_sensitive)
 
 
 # def node_similarity_matcher(
@@ -0,0 +1,72 @@
+import typing
+
+if typing.TYPE_CHECKING:
+    import model.knowledge_graph as kg
+
+
+class PreparedMatcher(typing.Protocol):
+    """
+    Node matcher bound to one sequence of nodes, which it refers to by index.
+    """
+
+    def candidates(self, i: int) -> typing.Iterable[int]:
+        """
+        Indices of all nodes that could possibly match node `i`. Nodes left out
+        here are never scored against it.
+        """
+        ...
+
+    def score_batch(self, i: int, others: typing.Sequence[int]) -> typing.List[bool]:
+        """
+        Whether node `i` matches each of the nodes in `others`.
+        """
+        ...
+
+
+class NodeMatcher(typing.Protocol):
+    def prepare(self, nodes: typing.Sequence["kg.Node"]) -> PreparedMatcher:
+        """
+        Precomputes everything needed to compare the given nodes, e.g.
+        normalized names, so it is done once per node instead of once per pair.
+        """
+        ...
+
+
+class _PreparedCallable:
+    def __init__(
+        self,
+        match: typing.Callable[["kg.Node", "kg.Node"], bool],
+        nodes: typing.Sequence["kg.Node"],
+    ):
+        self._match = match
+        self._nodes = nodes
+
+    def candidates(self, i: int) -> typing.Iterable[int]:
+        return range(len(self._nodes))
+
+    def score_batch(self, i: int, others: typing.Sequence[int]) -> typing.List[bool]:
+        return [self._match(self._nodes[i], self._nodes[j]) for j in others]
+
+
+class CallableMatcher:
+    """
+    Adapter that lets a plain `match(n1, n2) -> bool` function be used where a
+    `NodeMatcher` is expected. Every node is a candidate for every other one.
+    """
+
+    def __init__(self, match: typing.Callable[["kg.Node", "kg.Node"], bool]):
+        self._match = match
+
+    def __call__(self, n1: "kg.Node", n2: "kg.Node") -> bool:
+        return self._match(n1, n2)
+
+    def prepare(self, nodes: typing.Sequence["kg.Node"]) -> PreparedMatcher:
+        return _PreparedCallable(self._match, nodes)
+
+
+def as_node_matcher(
+    match: typing.Union[NodeMatcher, typing.Callable[["kg.Node", "kg.Node"], bool]],
+) -> NodeMatcher:
+    if hasattr(match, "prepare"):
+        return match
+    return CallableMatcher(match)
@@ -1,6 +1,8 @@
 import dataclasses
+import typing
 
 from model.color import Color
+from model.interning import Interner, intern
 from model.shape import Shape
 
 
@@ -39,12 +41,15 @@ class Aspect:
         }
 
     @staticmethod
-    def from_dict(d: dict):
-        return Aspect(
-            name=d["name"],
-            text_color=Color.from_dict(d["textColor"]),
-            shape_color=Color.from_dict(d["shapeColor"]),
-            shape=Shape(d["shape"]),
+    def from_dict(d: dict, interner: typing.Optional[Interner] = None):
+        return intern(
+            Aspect(
+                name=d["name"],
+                text_color=Color.from_dict(d["textColor"], interner),
+                shape_color=Color.from_dict(d["shapeColor"], interner),
+                shape=Shape(d["shape"]),
+            ),
+            interner,
         )
 
 
@@ -57,8 +62,8 @@ class Position:
         return {"x": self.x, "y": self.y}
 
     @staticmethod
-    def from_dict(d: dict):
-        return Position(x=d["x"], y=d["y"])
+    def from_dict(d: dict, interner: typing.Optional[Interner] = None):
+        return intern(Position(x=d["x"], y=d["y"]), interner)
 
 
 @dataclasses.dataclass(frozen=True, eq=True)
@@ -73,12 +78,15 @@ class Entity(ExtractableElement):
         return res
 
     @staticmethod
-    def from_dict(d: dict):
-        return Entity(
-            name=d["name"],
-            description=d["description"],
-            aspect=Aspect.from_dict(d["aspect"]),
-            position=Position.from_dict(d["position"]),
+    def from_dict(d: dict, interner: typing.Optional[Interner] = None):
+        return intern(
+            Entity(
+                name=d["name"],
+                description=d["description"],
+                aspect=Aspect.from_dict(d["aspect"], interner),
+                position=Position.from_dict(d["position"], interner),
+            ),
+            interner,
         )
 
 
@@ -94,10 +102,13 @@ class Relation(ExtractableElement):
         return res
 
     @staticmethod
-    def from_dict(d: dict):
-        return Relation(
-            name=d["name"],
-            description=d["description"],
-            source=Entity.from_dict(d["source"]),
-            target=Entity.from_dict(d["target"]),
+    def from_dict(d: dict, interner: typing.Optional[Interner] = None):
+        return intern(
+            Relation(
+                name=d["name"],
+                description=d["description"],
+                source=Entity.from_dict(d["source"], interner),
+                target=Entity.from_dict(d["target"], interner),
+            ),
+            interner,
         )
@@ -0,0 +1,307 @@
+import collections.abc
+import json
+import mmap
+import os
+import struct
+import typing
+from pathlib import Path
+
+import numpy as np
+
+import model.knowledge_graph as kg
+from model import meta_model
+
+MAGIC = b"KGSNAP01"
+ALIGNMENT = 8
+
+_HEADER_PREFIX = struct.Struct("<8sQ")
+
+
+class LazySequence(collections.abc.Sequence):
+    """
+    Read-only sequence that materializes its elements on first access.
+    """
+
+    def __init__(self, length: int, factory: typing.Callable[[int], typing.Any]):
+        self._length = length
+        self._factory = factory
+        self._cache: typing.List[typing.Any] = [None] * length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("snapshot index out of range")
+        item = self._cache[index]
+        if item is None:
+            item = self._factory(index)
+            self._cache[index] = item
+        return item
+
+
+class GraphSnapshot:
+    """
+    Memory-mapped, columnar view of a knowledge graph written by `save_snapshot`.
+    Nodes and edges are only turned into `kg.Node` and `kg.Edge` objects when
+    they are accessed.
+    """
+
+    def __init__(self, file_path: typing.Union[str, Path]):
+        self._file = open(file_path, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_length = _HEADER_PREFIX.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{file_path} is not a knowledge graph snapshot.")
+        header_start = _HEADER_PREFIX.size
+        header = json.loads(
+            bytes(self._buffer[header_start : header_start + header_length])
+        )
+
+        self.num_nodes: int = header["num_nodes"]
+        self.num_edges: int = header["num_edges"]
+        self.entities = [meta_model.Entity.from_dict(e) for e in header["entities"]]
+        self._entity_dicts: typing.List[dict] = header["entities"]
+        self.sources = [kg.DataSource.from_dict(s) for s in header["sources"]]
+        self.edge_types: typing.List[str] = header["edge_types"]
+
+        self._columns: typing.Dict[str, np.ndarray] = {}
+        for name, column in header["columns"].items():
+            dtype = np.dtype(column["dtype"])
+            shape = tuple(column["shape"])
+            self._columns[name] = np.frombuffer(
+                self._buffer,
+                dtype=dtype,
+                count=int(np.prod(shape)),
+                offset=column["offset"],
+            ).reshape(shape)
+
+        self.nodes = LazySequence(self.num_nodes, self.node)
+        self.edges = LazySequence(self.num_edges, self.edge)
+
+    def __enter__(self) -> "GraphSnapshot":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        # views into the mapped buffer have to be released before it can be closed
+        self._columns = {}
+        self._buffer.close()
+        self._file.close()
+
+    def _string(self, column: str, index: int) -> str:
+        offsets = self._columns[f"{column}_offsets"]
+        data = self._columns[f"{column}_data"]
+        return bytes(data[offsets[index] : offsets[index + 1]]).decode("utf8")
+
+    def node_id(self, index: int) -> str:
+        return self._string("node_id", index)
+
+    def node_name(self, index: int) -> str:
+        return self._string("node_name", index)
+
+    def node_position(self, index: int) -> typing.Tuple[float, float] | None:
+        x, y = self._columns["node_position"][index]
+        if np.isnan(x) or np.isnan(y):
+            return None
+        return float(x), float(y)
+
+    def node(self, index: int) -> kg.Node:
+        return kg.Node(
+            id=self.node_id(index),
+            name=self.node_name(index),
+            position=self.node_position(index),
+            entity=self.entities[self._columns["node_type"][index]],
+            source=self.sources[self._columns["node_source"][index]],
+        )
+
+    def edge(self, index: int) -> kg.Edge:
+        return kg.Edge(
+            id=self._string("edge_id", index),
+            source=self.nodes[self._columns["edge_source"][index]],
+            target=self.nodes[self._columns["edge_target"][index]],
+            type=self.edge_types[self._columns["edge_type"][index]],
+        )
+
+    def entity_counts(self) -> typing.Dict[str, int]:
+        counts = np.bincount(self._columns["node_type"], minlength=len(self.entities))
+        # several definitions can share a name, like in GraphStore.entity_counts
+        entity_counts: typing.Dict[str, int] = {}
+        for e, c in zip(self.entities, counts):
+            entity_counts[e.name] = entity_counts.get(e.name, 0) + int(c)
+        return entity_counts
+
+    def to_graph(self) -> kg.Graph:
+        return kg.Graph(nodes=list(self.nodes), edges=list(self.edges))
+
+    def to_dict(self) -> dict:
+        """
+        Same result as `kg.Graph.to_dict`, but built straight from the columns
+        without materializing any `kg.Node` or `kg.Edge`.
+        """
+        source_dicts = [s.to_dict() for s in self.sources]
+        node_types = self._columns["node_type"]
+        node_sources = self._columns["node_source"]
+        positions = self._columns["node_position"]
+
+        node_dicts = []
+        for i in range(self.num_nodes):
+            node_dicts.append(
+                {
+                    "id": self.node_id(i),
+                    "name": self.node_name(i),
+                    "entity": self._entity_dicts[node_types[i]],
+                    "position": (
+                        None
+                        if np.isnan(positions[i]).any()
+                        else {"x": float(positions[i, 0]), "y": float(positions[i, 1])}
+                    ),
+                    "source": source_dicts[node_sources[i]],
+                }
+            )
+
+        edge_sources = self._columns["edge_source"]
+        edge_targets = self._columns["edge_target"]
+        edge_types = self._columns["edge_type"]
+        edge_dicts = [
+            {
+                "id": self._string("edge_id", i),
+                "source": node_dicts[edge_sources[i]],
+                "target": node_dicts[edge_targets[i]],
+                "type": self.edge_types[edge_types[i]],
+            }
+            for i in range(self.num_edges)
+        ]
+
+        return {"nodes": node_dicts, "edges": edge_dicts}
+
+
+def _string_column(
+    values: typing.List[str],
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    encoded = [v.encode("utf8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return offsets, data
+
+
+def _codes(
+    values: typing.Iterable[typing.Hashable],
+) -> typing.Tuple[np.ndarray, typing.List[typing.Hashable]]:
+    table: typing.Dict[typing.Hashable, int] = {}
+    codes = [table.setdefault(v, len(table)) for v in values]
+    return np.array(codes, dtype="<i4"), list(table.keys())
+
+
+def save_snapshot(graph: kg.Graph, file_path: typing.Union[str, Path]) -> None:
+    node_indices: typing.Dict[str, int] = {}
+    for i, n in enumerate(graph.nodes):
+        node_indices.setdefault(n.id, i)
+
+    def endpoint_index(edge: kg.Edge, node: kg.Node) -> int:
+        if node.id not in node_indices:
+            raise ValueError(
+                f"Edge {edge.id} references node {node.id}, which is not part of the graph."
+            )
+        return node_indices[node.id]
+
+    node_types, entities = _codes(n.entity for n in graph.nodes)
+    node_sources, sources = _codes(n.source for n in graph.nodes)
+    edge_types, edge_type_names = _codes(e.type for e in graph.edges)
+
+    positions = np.full((len(graph.nodes), 2), np.nan, dtype="<f8")
+    for i, n in enumerate(graph.nodes):
+        if n.position is not None:
+            positions[i] = n.position
+
+    node_id_offsets, node_id_data = _string_column([n.id for n in graph.nodes])
+    node_name_offsets, node_name_data = _string_column([n.name for n in graph.nodes])
+    edge_id_offsets, edge_id_data = _string_column([e.id for e in graph.edges])
+
+    columns: typing.Dict[str, np.ndarray] = {
+        "node_id_offsets": node_id_offsets,
+        "node_id_data": node_id_data,
+        "node_name_offsets": node_name_offsets,
+        "node_name_data": node_name_data,
+        "node_type": node_types,
+        "node_source": node_sources,
+        "node_position": positions,
+        "edge_id_offsets": edge_id_offsets,
+        "edge_id_data": edge_id_data,
+        "edge_type": edge_types,
+        "edge_source": np.array(
+            [endpoint_index(e, e.source) for e in graph.edges], dtype="<i4"
+        ),
+        "edge_target": np.array(
+            [endpoint_index(e, e.target) for e in graph.edges], dtype="<i4"
+        ),
+    }
+
+    header = {
+        "num_nodes": len(graph.nodes),
+        "num_edges": len(graph.edges),
+        "entities": [e.to_dict() for e in entities],
+        "sources": [s.to_dict() for s in sources],
+        "edge_types": edge_type_names,
+        "columns": {},
+    }
+
+    # column offsets depend on the header size, which in turn depends on the
+    # offsets, so reserve generously sized offset fields and fill them in later
+    for name, column in columns.items():
+        header["columns"][name] = {
+            "dtype": column.dtype.str,
+            "shape": list(column.shape),
+            "offset": 2**62,
+        }
+    header_length = len(json.dumps(header).encode("utf8"))
+    offset = _aligned(_HEADER_PREFIX.size + header_length)
+    for name, column in columns.items():
+        header["columns"][name]["offset"] = offset
+        offset = _aligned(offset + column.nbytes)
+    header_bytes = json.dumps(header).encode("utf8").ljust(header_length)
+
+    with open(file_path, "wb") as f:
+        f.write(_HEADER_PREFIX.pack(MAGIC, header_length))
+        f.write(header_bytes)
+        for name, column in columns.items():
+            f.write(b"\0" * (header["columns"][name]["offset"] - f.tell()))
+            f.write(column.tobytes())
+
+
+def load_snapshot(file_path: typing.Union[str, Path]) -> GraphSnapshot:
+    return GraphSnapshot(file_path)
+
+
+def cached_snapshot(
+    graph_path: typing.Union[str, Path], snapshot_path: typing.Union[str, Path]
+) -> GraphSnapshot:
+    """
+    Opens the snapshot of a graph saved by `Graph.save`. The snapshot is only
+    written from the JSON file if it does not exist yet or is older than the
+    JSON file, so repeated reads never deserialize the full graph.
+    """
+    snapshot_path = Path(snapshot_path)
+    if (
+        not snapshot_path.exists()
+        or snapshot_path.stat().st_mtime < Path(graph_path).stat().st_mtime
+    ):
+        snapshot_path.parent.mkdir(exist_ok=True, parents=True)
+        # readers must never open a partially written snapshot
+        temporary_path = snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+        save_snapshot(kg.Graph.load(graph_path), temporary_path)
+        os.replace(temporary_path, snapshot_path)
+    return load_snapshot(snapshot_path)
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
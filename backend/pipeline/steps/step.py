@@ -65,6 +65,11 @@ class RelationResult:
         }
 
 
+def _log_name() -> str:
+    # steps can run concurrently, a timestamp alone is not unique
+    return f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{uuid.uuid4().hex[:8]}"
+
+
 class BasePipelineStep(ABC):
 
     def run(self, **kwargs):
@@ -183,7 +188,7 @@ class PromptCreation(BasePipelineStep):
             [("system", system_template), ("user", "{text}")]
         )
 
-        date_formatted = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        date_formatted = _log_name()
 
         entity_descriptions = "\n".join(
             f"- *{e.name}*: {e.description}" for e in entities.values()
@@ -255,7 +260,7 @@ class PromptCreation(BasePipelineStep):
             [("system", system_template), ("user", "{text}")]
         )
 
-        date_formatted = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        date_formatted = _log_name()
         prompts_dir = (
             pathlib.Path(__file__).parent.parent.parent.absolute() / "res" / "requests" / "entities"
         )
@@ -329,7 +334,7 @@ class PromptCreation(BasePipelineStep):
             [("system", system_template), ("user", "{text}")]
         )
 
-        date_formatted = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        date_formatted = _log_name()
 
         formatted_entities = "\n".join(
             [f"{e.id}|{e.entity.name}|{e.name}" for e in entities]
@@ -429,11 +434,7 @@ class PromptCreation(BasePipelineStep):
             edges=edges,
         )
 
-        graph = graph.compact(
-            match_node=lambda n1, n2: any(
-                n1 in cluster and n2 in cluster for cluster in node_clusters
-            )
-        )
+        graph = graph.collapse(node_clusters)
 
         return graph
 
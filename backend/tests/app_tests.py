@@ -0,0 +1,126 @@
+import concurrent.futures
+import os
+
+import pytest
+
+import app as api
+from conftest import make_graph
+from model import layout
+from model.graph_store import GraphStore
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "model_instances_directory", tmp_path)
+    monkeypatch.setattr(
+        api, "layout_cache", layout.LayoutCache(tmp_path / "layout-cache")
+    )
+    with GraphStore(tmp_path / "g.sqlite") as store:
+        make_graph(
+            [("clerk", "actor"), ("check order", "activity")],
+            edges=[("clerk", "performs", "check order")],
+        ).to_store(store)
+    return api.app.test_client()
+
+
+def test_deleted_graph_can_be_restored(client):
+    original = client.get("/graph/g/").json
+
+    assert client.delete("/graph/g/").json["success"]
+
+    assert client.get("/graph/").json == []
+    assert client.get("/graph/g/").status_code == 404
+    versions = client.get("/graph/g/versions/").json
+    assert [v["message"] for v in versions] == ["Initial version", "Deleted"]
+
+    restored = client.post("/graph/g/versions/0/restore/").json
+    assert restored["version"] == 2
+    assert client.get("/graph/").json == ["g"]
+    assert client.get("/graph/g/").json == {**original, "version": 2}
+
+
+def test_load_and_layout_return_the_version(client):
+    assert client.get("/graph/g/").json["version"] is None
+
+    version = client.get("/graph/g/layout/").json["version"]
+
+    loaded = client.get("/graph/g/").json
+    assert version == loaded["version"] == 1
+    versioned = client.get(f"/graph/g/versions/{version}/").json
+    assert versioned == {"nodes": loaded["nodes"], "edges": loaded["edges"]}
+
+
+def test_layout_starts_no_process_pool(client, monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("started a process pool")
+
+    monkeypatch.setattr(layout, "PARALLEL_THRESHOLD", 0)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", no_pool)
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    with GraphStore(api.model_instances_directory / "h.sqlite") as store:
+        make_graph([("clerk", "actor"), ("invoice", "data")]).to_store(store)
+
+    assert client.get("/graph/h/layout/").json["success"]
+
+
+def test_unknown_graph(client):
+    assert client.get("/graph/unknown/").status_code == 404
+
+
+def test_edges_between(client):
+    nodes = client.get("/graph/g/").json["nodes"]
+
+    response = client.post("/graph/g/edges/", json={"nodes": [n["id"] for n in nodes]})
+
+    assert response.status_code == 200
+    assert [e["id"] for e in response.json["edges"]] == ["e0"]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {},
+        {"nodes": "0"},
+        {"nodes": [0]},
+        {"nodes": ["0"], "limit": "5"},
+        {"nodes": ["0"], "limit": 0},
+        {"nodes": ["0"], "limit": -1},
+        ["0"],
+    ],
+)
+def test_edges_between_rejects_invalid_queries(client, body):
+    assert client.post("/graph/g/edges/", json=body).status_code == 400
+    assert client.post("/graph/g/edges/", data="nodes").status_code == 400
+
+
+def test_query_nodes_pages(client):
+    first = client.get("/graph/g/nodes/?limit=1").json
+    second = client.get(f"/graph/g/nodes/?limit=1&after={first['next']}").json
+
+    assert [n["name"] for n in first["nodes"] + second["nodes"]] == [
+        "clerk",
+        "check order",
+    ]
+    assert second["next"] is None
+
+
+@pytest.mark.parametrize("limit", [0, -5])
+def test_query_nodes_rejects_invalid_limits(client, limit):
+    assert client.get(f"/graph/g/nodes/?limit={limit}").status_code == 400
+    assert (
+        client.get(
+            f"/graph/g/viewport/?minX=0&minY=0&maxX=1&maxY=1&limit={limit}"
+        ).status_code
+        == 400
+    )
+
+
+def test_similar_nodes_follow_renames(client):
+    clerk = client.get("/graph/g/similar/?name=clerk&k=1").json[0]["node"]
+    assert clerk["name"] == "clerk"
+
+    client.patch(f"/graph/g/nodes/{clerk['id']}/", json={"name": "customer"})
+
+    similar = client.get("/graph/g/similar/?name=customer&k=1").json
+    assert similar[0]["node"] == {**clerk, "name": "customer"}
+    assert similar[0]["similarity"] > 0.99
@@ -0,0 +1,58 @@
+import typing
+
+import model.knowledge_graph as kg
+import model.meta_model as mm
+from model.color import CommonColors
+from model.shape import Shape
+
+# helpers shared by the test modules, import them with `from conftest import ...`
+
+
+def make_entity(name: str = "t1") -> mm.Entity:
+    return mm.Entity(
+        name=name,
+        description="",
+        aspect=mm.Aspect(
+            name="a1",
+            text_color=CommonColors.BLACK.value,
+            shape_color=CommonColors.RED.value,
+            shape=Shape.CIRCLE,
+        ),
+        position=mm.Position(0, 0),
+    )
+
+
+def make_source(file: str = "doc.pdf", page_start: int = 1, page_end: int = 1):
+    return kg.DataSource(file=file, page_start=page_start, page_end=page_end)
+
+
+def make_node(
+    node_id: str, name: str, entity_type: str = "t1", position=(0, 0)
+) -> kg.Node:
+    return kg.Node(
+        id=node_id,
+        name=name,
+        position=position,
+        entity=make_entity(entity_type),
+        source=make_source(),
+    )
+
+
+def make_nodes(names_and_types) -> typing.List[kg.Node]:
+    return [make_node(str(i), name, t) for i, (name, t) in enumerate(names_and_types)]
+
+
+def make_graph(names_and_types, edges=()) -> kg.Graph:
+    """
+    Graph with nodes as created by `make_nodes`, `edges` are given as
+    (source name, type, target name).
+    """
+    nodes = make_nodes(names_and_types)
+    by_name = {n.name: n for n in nodes}
+    return kg.Graph(
+        nodes=nodes,
+        edges=[
+            kg.Edge(id=f"e{i}", source=by_name[s], target=by_name[t], type=edge_type)
+            for i, (s, edge_type, t) in enumerate(edges)
+        ],
+    )
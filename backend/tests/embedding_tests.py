@@ -0,0 +1,104 @@
+import numpy as np
+
+import model.knowledge_graph as kg
+from conftest import make_graph, make_nodes
+from model.embedding import (
+    EmbeddingNodeMatcher,
+    HashingEncoder,
+    VectorIndex,
+    update_index,
+)
+
+
+def test_word_order_does_not_matter():
+    encoder = HashingEncoder()
+    v = encoder.encode(["vacuum chamber", "chamber under vacuum", "pressure valve"])
+
+    assert v[0] @ v[1] > 0.8
+    assert v[0] @ v[2] < 0.2
+
+
+def test_index_finds_near_duplicates(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 64)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = VectorIndex(64)
+    index.add([str(i) for i in range(len(vectors))], vectors)
+
+    query = vectors[7] + 0.1 * rng.standard_normal(64)
+    query /= np.linalg.norm(query)
+    assert index.query(query, k=1)[0][0] == "7"
+    assert len(index.candidates(query)) < len(vectors)
+
+    index.save(tmp_path / "index.npz")
+    loaded = VectorIndex.load(tmp_path / "index.npz")
+    assert loaded.query(query, k=3) == index.query(query, k=3)
+
+
+def test_update_index_only_encodes_changed_names(tmp_path):
+    class CountingEncoder(HashingEncoder):
+        encoded = []
+
+        def encode(self, texts):
+            self.encoded.extend(texts)
+            return super().encode(texts)
+
+    encoder = CountingEncoder()
+    index = update_index(None, {"0": "clerk", "1": "check order"}, encoder)
+    index.save(tmp_path / "index.npz")
+    index = VectorIndex.load(tmp_path / "index.npz")
+    assert index.texts == ["clerk", "check order"]
+
+    assert update_index(index, {"0": "clerk", "1": "check order"}, encoder) is index
+
+    encoder.encoded.clear()
+    updated = update_index(
+        index, {"0": "clerk", "1": "ship order", "2": "customer"}, encoder
+    )
+
+    assert encoder.encoded == ["ship order", "customer"]
+    assert updated.ids == ["0", "1", "2"]
+    np.testing.assert_array_equal(updated.vectors[0], index.vectors[0])
+    assert updated.query(encoder.encode(["ship order"])[0], k=1)[0][0] == "1"
+
+
+def test_embedding_matcher_merges_same_type_only():
+    graph = make_graph(
+        [
+            ("check order", "activity"),
+            ("order check", "activity"),
+            ("check order", "actor"),
+        ]
+    )
+
+    compacted = graph.compact(
+        match_node=EmbeddingNodeMatcher(similarity_threshold=0.7), match_edge=None
+    )
+
+    assert sorted((n.name, n.entity.name) for n in compacted.nodes) == [
+        ("check order", "activity"),
+        ("check order", "actor"),
+    ]
+
+
+def test_embedding_matcher_merges_nodes_with_duplicate_ids():
+    existing = make_graph(
+        [("check order", "activity"), ("clerk", "actor"), ("ship goods", "activity")]
+    )
+    # extraction returns the existing nodes along with the new ones
+    extracted = kg.Graph(
+        nodes=existing.nodes + make_nodes([("order check", "activity")]),
+        edges=[],
+    )
+
+    merged = existing.merge(
+        extracted,
+        match_node=EmbeddingNodeMatcher(similarity_threshold=0.7),
+        match_edge=None,
+    )
+
+    assert sorted(n.name for n in merged.nodes) == [
+        "check order",
+        "clerk",
+        "ship goods",
+    ]
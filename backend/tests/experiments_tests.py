@@ -0,0 +1,93 @@
+import json
+import shutil
+
+import pytest
+
+from conftest import make_graph
+from evaluation import experiments
+
+DOCUMENTS = ["doc-1.1", "doc-1.2", "doc-1.3"]
+
+# names of documents the stub model fails to extract
+failing = set()
+extracted = []
+
+
+class StubPromptCreation:
+    def run(self, model, application_model, parsed_file, current_graph):
+        extracted.append(parsed_file.name)
+        if parsed_file.name in failing:
+            raise RuntimeError("model unavailable")
+        return make_graph([("clerk", "actor"), ("check order", "activity")])
+
+
+def _stub_metrics(expected_graph, specific_prompt_graph, generic_method_graph):
+    # pos tagging needs NLTK data that is not installed here
+    document_metrics = {
+        method: {m: float(len(expected_graph.nodes)) for m in experiments.METRIC_NAMES}
+        for method in ["specific", "generic"]
+    }
+    return document_metrics, "", []
+
+
+@pytest.fixture
+def pet_directory(tmp_path, monkeypatch):
+    source = experiments.PET_DIRECTORY
+    (tmp_path / "specific-prompt").mkdir()
+    with open(source / "all.new.jsonl") as f, open(
+        tmp_path / "all.new.jsonl", "w"
+    ) as out:
+        for line in f:
+            if json.loads(line)["id"] in DOCUMENTS:
+                out.write(line)
+    for document_id in DOCUMENTS:
+        shutil.copy(
+            source / "specific-prompt" / f"{document_id}.json",
+            tmp_path / "specific-prompt",
+        )
+
+    monkeypatch.setattr(experiments, "PET_DIRECTORY", tmp_path)
+    monkeypatch.setattr(experiments, "PET_RESULTS_FILE", tmp_path / "results.json")
+    monkeypatch.setattr(experiments, "PromptCreation", StubPromptCreation)
+    # submitted by name, spawned worker processes import the stub from here
+    monkeypatch.setattr(experiments, "_compute_metrics", _stub_metrics)
+    failing.clear()
+    extracted.clear()
+    return tmp_path
+
+
+def test_interrupted_run_is_resumed(pet_directory):
+    failing.add("doc-1.2")
+
+    experiments.run_pet_experiments(llm_workers=2, cpu_workers=1)
+
+    checkpoints = pet_directory / "checkpoints"
+    assert sorted(p.stem for p in checkpoints.glob("*.json")) == ["doc-1.1", "doc-1.3"]
+    results = json.loads((pet_directory / "results.json").read_text())
+    assert len(results["generic_metrics"]["f1"]) == 2
+
+    failing.clear()
+    extracted.clear()
+    # a checkpoint from before a metric was added is evaluated again
+    outdated = json.loads((checkpoints / "doc-1.3.json").read_text())
+    del outdated["generic"]["rel_f1"]
+    (checkpoints / "doc-1.3.json").write_text(json.dumps(outdated))
+    (pet_directory / "generic-method" / "doc-1.3.json").unlink()
+
+    experiments.run_pet_experiments(llm_workers=2, cpu_workers=1)
+
+    assert sorted(extracted) == ["doc-1.2", "doc-1.3"]
+    assert all(
+        experiments._has_checkpoint(checkpoints / f"{d}.json") for d in DOCUMENTS
+    )
+    results = json.loads((pet_directory / "results.json").read_text())
+    assert len(results["generic_metrics"]["f1"]) == 3
+
+
+def test_run_without_any_evaluated_document(pet_directory, capsys):
+    failing.update(DOCUMENTS)
+
+    experiments.run_pet_experiments(llm_workers=2, cpu_workers=1)
+
+    assert "No documents evaluated" in capsys.readouterr().out
+    assert not (pet_directory / "results.json").exists()
@@ -0,0 +1,52 @@
+import random
+
+import networkx as nx
+
+from model import ged
+
+
+def _random_graph(rng: random.Random) -> nx.Graph:
+    g = nx.gnm_random_graph(
+        rng.randint(1, 6), rng.randint(0, 6), seed=rng.randint(0, 1000)
+    )
+    for n in g.nodes:
+        g.nodes[n]["type"] = rng.choice(["actor", "activity"])
+    for e in g.edges:
+        g.edges[e]["type"] = rng.choice(["flow", "performs"])
+    return g
+
+
+def test_bounds_enclose_exact_distance():
+    rng = random.Random(42)
+
+    def node_match(n1, n2):
+        return n1["type"] == n2["type"]
+
+    def edge_match(e1, e2):
+        return e1["type"] == e2["type"]
+
+    for _ in range(20):
+        g1 = _random_graph(rng)
+        g2 = _random_graph(rng)
+
+        bounds = ged.approximate_graph_edit_distance(
+            g1, g2, node_match=node_match, edge_label=lambda e: e["type"]
+        )
+        exact = nx.graph_edit_distance(
+            g1, g2, node_match=node_match, edge_match=edge_match
+        )
+
+        assert bounds.lower <= exact <= bounds.upper
+
+
+def test_identical_graphs_have_zero_distance():
+    g = nx.path_graph(5)
+    nx.set_node_attributes(g, "actor", "type")
+    nx.set_edge_attributes(g, "flow", "type")
+
+    bounds = ged.approximate_graph_edit_distance(
+        g, g.copy(), node_match=lambda a, b: True, edge_label=lambda e: e["type"]
+    )
+
+    assert bounds.lower == 0
+    assert bounds.upper == 0
@@ -0,0 +1,115 @@
+import concurrent.futures
+import typing
+
+import model.knowledge_graph as kg
+from conftest import make_node
+from model.graph_history import GraphDelta, GraphHistory
+
+
+def _commit_versions(history: GraphHistory) -> typing.List[kg.Graph]:
+
+    graphs = []
+    nodes = [make_node("n0", "start", position=(0, 0))]
+    edges = []
+    for i in range(1, 8):
+        previous = nodes[-1]
+        nodes = [n.with_position((i, i)) for n in nodes]
+        nodes[0] = kg.Node(
+            id="n0",
+            name=f"start {i}",
+            position=nodes[0].position,
+            entity=nodes[0].entity,
+            source=nodes[0].source,
+        )
+        nodes.append(make_node(f"n{i}", f"node {i}", position=(i, 0)))
+        by_id = {n.id: n for n in nodes}
+        edges = [
+            kg.Edge(
+                id=e.id,
+                source=by_id[e.source.id],
+                target=by_id[e.target.id],
+                type=e.type,
+            )
+            for e in edges
+        ]
+        edges.append(
+            kg.Edge(id=f"e{i}", source=by_id[previous.id], target=nodes[-1], type="r")
+        )
+        if i == 5:
+            # removing a node drops its edges as well
+            nodes = [n for n in nodes if n.id != "n2"]
+            edges = [e for e in edges if "n2" not in (e.source.id, e.target.id)]
+        graph = kg.Graph(nodes=nodes, edges=edges)
+        graphs.append(graph)
+        assert history.commit(graph, f"v{i - 1}") == i - 1
+    return graphs
+
+
+def test_materialize_every_version(tmp_path):
+    history = GraphHistory(tmp_path, checkpoint_interval=3)
+    graphs = _commit_versions(history)
+
+    assert [v.checkpoint for v in history.versions()] == [
+        True,
+        False,
+        False,
+        True,
+        False,
+        False,
+        True,
+    ]
+    assert history.head == 6
+    for version, graph in enumerate(graphs):
+        assert history.materialize(version).to_dict() == graph.to_dict()
+
+
+def test_delta_between_versions(tmp_path):
+    history = GraphHistory(tmp_path, checkpoint_interval=3)
+    graphs = _commit_versions(history)
+
+    for old, new in [(0, 1), (2, 3), (1, 6)]:
+        delta = history.delta(old, new)
+        assert delta.apply(graphs[old]).to_dict() == graphs[new].to_dict()
+
+
+def _commit(directory, graph: kg.Graph) -> int:
+    return GraphHistory(directory, checkpoint_interval=3).commit(graph, "v")
+
+
+def test_concurrent_commits_get_consecutive_versions(tmp_path):
+    graphs = [
+        kg.Graph(nodes=[make_node(f"n{i}", f"node {i}")], edges=[]) for i in range(8)
+    ]
+
+    # separate processes, like separate server workers
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as pool:
+        versions = list(pool.map(_commit, [tmp_path] * len(graphs), graphs))
+
+    history = GraphHistory(tmp_path, checkpoint_interval=3)
+    assert sorted(versions) == list(range(8))
+    assert history.head == 7
+    assert [v.version for v in history.versions()] == list(range(8))
+    for graph, version in zip(graphs, versions):
+        assert history.materialize(version).to_dict() == graph.to_dict()
+
+
+def test_head_without_head_file(tmp_path):
+    history = GraphHistory(tmp_path)
+    _commit_versions(history)
+
+    (tmp_path / "HEAD").unlink()
+
+    assert GraphHistory(tmp_path).head == 6
+
+
+def test_nodes_without_position(tmp_path):
+    history = GraphHistory(tmp_path)
+    placed = make_node("n0", "start", position=(1, 2))
+    history.commit(kg.Graph(nodes=[placed], edges=[]), "placed")
+    history.commit(kg.Graph(nodes=[placed.with_position(None)], edges=[]), "unset")
+    history.commit(kg.Graph(nodes=[placed], edges=[]), "placed again")
+
+    assert history.materialize(1).nodes[0].position is None
+    assert history.materialize(2).nodes[0].position == (1, 2)
+    delta = history.delta(0, 1)
+    assert GraphDelta.from_dict(delta.to_dict()).moved_nodes == {"n0": None}
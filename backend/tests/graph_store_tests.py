@@ -0,0 +1,138 @@
+import model.knowledge_graph as kg
+from conftest import make_entity, make_source
+from model.graph_store import GraphStore
+
+
+def _graph() -> kg.Graph:
+    source = make_source()
+    n1 = kg.Node(
+        id="n1", name="abcd", position=(0, 0), entity=make_entity("t1"), source=source
+    )
+    n2 = kg.Node(
+        id="n2", name="wxyz", position=(1, 2), entity=make_entity("t1"), source=source
+    )
+    n3 = kg.Node(
+        id="n3", name="fghi", position=(3, 4), entity=make_entity("t2"), source=source
+    )
+    return kg.Graph(
+        nodes=[n1, n2, n3],
+        edges=[
+            kg.Edge(id="e1", source=n1, target=n2, type="r1"),
+            kg.Edge(id="e2", source=n3, target=n1, type="r2"),
+        ],
+    )
+
+
+def test_round_trip(tmp_path):
+    graph = _graph()
+
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        graph.to_store(store)
+
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        loaded = kg.Graph.from_store(store)
+        assert loaded.to_dict() == graph.to_dict()
+        assert store.entity_counts() == {"t1": 2, "t2": 1}
+
+
+def test_save_applies_changes(tmp_path):
+    graph = _graph()
+    n1, n2, n3 = graph.nodes
+
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        graph.to_store(store)
+
+        changed = kg.Graph(
+            nodes=[n1.with_position((5, 5)), n2],
+            edges=[kg.Edge(id="e1", source=n1, target=n2, type="r1")],
+        )
+        store.save_graph(changed)
+
+        loaded = store.load_graph()
+        assert [n.id for n in loaded.nodes] == ["n1", "n2"]
+        assert loaded.nodes[0].position == (5, 5)
+        assert [e.id for e in loaded.edges] == ["e1"]
+
+
+def test_delete_node_removes_edges(tmp_path):
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        _graph().to_store(store)
+
+        store.delete_nodes(["n1"])
+
+        assert store.num_nodes == 2
+        assert store.num_edges == 0
+
+
+def test_update_node(tmp_path):
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        _graph().to_store(store)
+
+        node = store.update_node("n2", name="renamed", position=(7, 8))
+
+        assert node.name == "renamed"
+        assert node.position == (7, 8)
+        assert store.update_node("unknown", name="x") is None
+
+
+def test_query_nodes_pages(tmp_path):
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        _graph().to_store(store)
+
+        first = store.query_nodes(limit=2)
+        second = store.query_nodes(after=first.cursor, limit=2)
+
+        assert [n.id for n in first.items] == ["n1", "n2"]
+        assert [n.id for n in second.items] == ["n3"]
+        assert second.cursor is None
+        assert [n.id for n in store.query_nodes(entity_type="t1").items] == [
+            "n1",
+            "n2",
+        ]
+        assert [n.id for n in store.query_nodes(name_prefix="fg").items] == ["n3"]
+        empty = store.query_nodes(limit=0)
+        assert (empty.items, empty.cursor) == ([], None)
+        assert store.edges_between(["n1", "n2"], limit=0).cursor is None
+
+
+def test_neighbourhood(tmp_path):
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        _graph().to_store(store)
+
+        nodes, edges = store.neighbourhood("n2", hops=1)
+        assert [n.id for n in nodes] == ["n1", "n2"]
+        assert [e.id for e in edges] == ["e1"]
+
+        nodes, edges = store.neighbourhood("n2", hops=2)
+        assert [n.id for n in nodes] == ["n1", "n2", "n3"]
+        assert [e.id for e in edges] == ["e1", "e2"]
+
+
+def test_viewport_follows_positions(tmp_path):
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        _graph().to_store(store)
+
+        nodes, edges, truncated = store.viewport(-1, -1, 2, 3)
+        assert [n.id for n in nodes] == ["n1", "n2"]
+        assert [e.id for e in edges] == ["e1", "e2"]
+        assert not truncated
+
+        store.update_positions({"n2": (10, 10)})
+        nodes, _, _ = store.viewport(-1, -1, 2, 3)
+        assert [n.id for n in nodes] == ["n1"]
+
+        nodes, _, truncated = store.viewport(-1, -1, 5, 5, limit=1)
+        assert [n.id for n in nodes] == ["n1"]
+        assert truncated
+
+
+def test_migration_backfills_spatial_index(tmp_path):
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        _graph().to_store(store)
+        # state of a database written before the spatial index existed
+        store._connection.execute("DELETE FROM node_positions")
+        store._connection.execute("PRAGMA user_version = 0")
+
+    with GraphStore(tmp_path / "graph.sqlite") as store:
+        nodes, _, _ = store.viewport(-1, -1, 2, 3)
+        assert [n.id for n in nodes] == ["n1", "n2"]
@@ -0,0 +1,60 @@
+import model.knowledge_graph as kg
+import model.meta_model as mm
+from conftest import make_entity, make_graph
+from model.application_model import ApplicationModel
+
+
+def test_graph_shares_equal_objects():
+    graph = make_graph(
+        [("clerk", "actor"), ("check order", "activity"), ("archive", "activity")],
+        edges=[
+            ("clerk", "performs", "check order"),
+            ("clerk", "performs", "archive"),
+        ],
+    )
+
+    loaded = kg.Graph.from_dict(graph.to_dict())
+
+    assert loaded.to_dict() == graph.to_dict()
+    clerk, check_order, archive = loaded.nodes
+    assert check_order.entity is archive.entity
+    assert clerk.entity.aspect is archive.entity.aspect
+    assert clerk.source is archive.source
+    assert loaded.edges[0].source is clerk
+    assert loaded.edges[1].source is clerk
+    assert loaded.edges[1].target is archive
+
+
+def test_conflicting_node_copies_stay_separate():
+    d = make_graph(
+        [("clerk", "actor"), ("check order", "activity")],
+        edges=[("clerk", "performs", "check order")],
+    ).to_dict()
+    # an edge that embeds an outdated copy of its source
+    d["edges"][0]["source"]["name"] = "old clerk"
+    d["edges"][0]["source"]["position"] = {"x": 5, "y": 5}
+
+    loaded = kg.Graph.from_dict(d)
+
+    assert loaded.to_dict() == d
+    assert loaded.edges[0].source is not loaded.nodes[0]
+    assert loaded.edges[0].source.name == "old clerk"
+    assert loaded.edges[0].target is loaded.nodes[1]
+
+
+def test_application_model_shares_entities():
+    actor = make_entity("actor")
+    activity = make_entity("activity")
+    model = ApplicationModel(
+        entities=[actor, activity],
+        relations=[
+            mm.Relation(name="performs", description="", source=actor, target=activity)
+        ],
+    )
+
+    loaded = ApplicationModel.from_dict(model.to_dict())
+
+    assert loaded == model
+    assert loaded.relations[0].source is loaded.entities[0]
+    assert loaded.relations[0].target is loaded.entities[1]
+    assert loaded.entities[0].aspect is loaded.entities[1].aspect
@@ -1,4 +1,13 @@
+import dataclasses
+import difflib
+import pickle
+
+import networkx as nx
+import nltk
+import pytest
+
 import model.knowledge_graph as kg
+from conftest import make_entity, make_graph, make_node, make_source
 from model import match
 
 
@@ -87,3 +96,107 @@ def test_compact():
 
     assert len(graph.nodes) == 5
     assert len(graph.edges) == 3
+
+
+def test_nodes_and_edges_are_identified_by_id():
+    n1 = make_node("n1", "pump")
+    renamed = kg.Node(
+        id="n1",
+        name="vacuum pump",
+        position=(3, 4),
+        entity=make_entity("t2"),
+        source=make_source(page_start=2, page_end=3),
+    )
+    n2 = make_node("n2", "pump")
+
+    assert n1 == renamed
+    assert hash(n1) == hash(renamed)
+    assert n1 != n2
+    assert n1.values() != renamed.values()
+    assert len({n1, renamed, n2}) == 2
+    assert {n1: 1}[renamed] == 1
+
+    e1 = kg.Edge(id="e1", source=n1, target=n2, type="r1")
+    assert e1 == kg.Edge(id="e1", source=n2, target=n1, type="r2")
+    assert e1 != kg.Edge(id="e2", source=n1, target=n2, type="r1")
+    assert e1 != n1
+
+
+def test_nodes_and_edges_are_slotted():
+    n1 = make_node("n1", "pump")
+    e1 = kg.Edge(id="e1", source=n1, target=n1, type="r1")
+
+    for item in [n1, e1]:
+        assert not hasattr(item, "__dict__")
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            item.id = "other"
+
+
+def test_nodes_and_edges_pickle():
+    n1 = make_node("n1", "pump", position=(1.5, 2))
+    n2 = make_node("n2", "valve", entity_type="t2")
+    e1 = kg.Edge(id="e1", source=n1, target=n2, type="r1")
+
+    loaded_n1, loaded_e1 = pickle.loads(pickle.dumps([n1, e1]))
+
+    assert loaded_n1.values() == n1.values()
+    assert hash(loaded_n1) == hash(n1)
+    assert loaded_e1.to_dict() == e1.to_dict()
+    assert loaded_e1.source is loaded_n1
+
+
+def _unmemoized_node_match(threshold: float):
+    # node_match as it was before tokens were precomputed and memoized
+    def match(n1, n2):
+        if n1["type"].lower() != n2["type"].lower():
+            return False
+        n1_tokens = [t.lower() for t in nltk.word_tokenize(n1["name"])]
+        n2_tokens = [t.lower() for t in nltk.word_tokenize(n2["name"])]
+        return difflib.SequenceMatcher(None, n1_tokens, n2_tokens).ratio() > threshold
+
+    return match
+
+
+def test_memoized_node_match_gives_same_edit_distance(monkeypatch):
+    monkeypatch.setattr(nltk, "word_tokenize", str.split)
+    g1 = make_graph(
+        [
+            ("Clerk", "actor"),
+            ("check the order", "activity"),
+            ("send invoice", "activity"),
+            ("archive order", "activity"),
+        ],
+        edges=[
+            ("Clerk", "performs", "check the order"),
+            ("check the order", "flow", "send invoice"),
+            ("send invoice", "flow", "archive order"),
+        ],
+    )
+    g2 = make_graph(
+        [
+            ("clerk", "actor"),
+            ("check order", "activity"),
+            ("send the invoice", "activity"),
+            ("archive", "actor"),
+        ],
+        edges=[
+            ("clerk", "performs", "check order"),
+            ("check order", "flow", "send the invoice"),
+            ("clerk", "flow", "archive"),
+        ],
+    )
+
+    memoized = kg.node_match(threshold=0.6)
+    unmemoized = _unmemoized_node_match(threshold=0.6)
+    t1 = g1.to_nx(with_tokens=True)
+    t2 = g2.to_nx(with_tokens=True)
+    for u in g1.nodes:
+        for v in g2.nodes:
+            assert memoized(t1.nodes[u.id], t2.nodes[v.id]) == unmemoized(
+                g1.to_nx().nodes[u.id], g2.to_nx().nodes[v.id]
+            )
+
+    expected = nx.graph_edit_distance(
+        g1.to_nx(), g2.to_nx(), node_match=unmemoized, edge_match=kg.edge_match
+    )
+    assert g1.graph_edit_distance(g2) == expected
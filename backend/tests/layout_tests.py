@@ -0,0 +1,213 @@
+import concurrent.futures
+import os
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from model import layout
+
+
+def _existing_graph() -> nx.Graph:
+    g = nx.connected_watts_strogatz_graph(60, 4, 0.1, seed=1)
+    return nx.relabel_nodes(g, {n: f"n{n}" for n in g})
+
+
+def test_incremental_keeps_existing_positions():
+    g = _existing_graph()
+    fixed = layout.automatic(g, 500)
+    g.add_edge("new1", "n0")
+    g.add_edge("new2", "new1")
+
+    pos = layout.incremental(g, fixed, 500)
+
+    assert all(pos[n] == p for n, p in fixed.items())
+    # seeded next to their neighbours, not somewhere across the drawing
+    for n, neighbour in [("new1", "n0"), ("new2", "new1")]:
+        assert np.linalg.norm(np.subtract(pos[n], pos[neighbour])) < 250
+
+
+def _extent(pos) -> np.ndarray:
+    return np.ptp(np.array(list(pos.values())), axis=0)
+
+
+def test_incremental_packs_disconnected_nodes_next_to_drawing():
+    g = _existing_graph()
+    fixed = layout.automatic(g, 500)
+    edge_length = np.median(
+        [np.linalg.norm(np.subtract(fixed[u], fixed[v])) for u, v in g.edges]
+    )
+    for i in range(10):
+        g.add_edge(f"a{i}", f"b{i}")
+    g.add_node("isolated")
+
+    pos = layout.incremental(g, fixed, 500)
+
+    assert all(pos[n] == p for n, p in fixed.items())
+    new = np.array([pos[n] for n in g if n not in fixed])
+    assert len(np.unique(new.round(3), axis=0)) == len(new)
+    # right next to the drawing, which spans about 1000 in both directions
+    assert np.all(_extent(pos) < 2000)
+
+    # small additions fill gaps at the border instead of growing the drawing
+    extent = _extent(pos)
+    for upload in range(5):
+        g.add_edge(f"u{upload}a", f"u{upload}b")
+        pos = layout.incremental(g, pos, 500)
+    assert np.all(_extent(pos) - extent < 5 * edge_length)
+
+
+def test_none_positions_are_laid_out_like_new_nodes(tmp_path):
+    g = _existing_graph()
+    fixed = layout.automatic(g, 500)
+    fixed["n0"] = None
+
+    pos = layout.compute(g, 500, fixed=fixed, cache=layout.LayoutCache(tmp_path))
+
+    assert pos["n0"] is not None
+    assert all(pos[n] == p for n, p in fixed.items() if n != "n0")
+
+
+def test_large_graphs_use_sparse_stress(monkeypatch):
+    calls = []
+    monkeypatch.setattr(layout, "LARGE_GRAPH_THRESHOLD", 50)
+    monkeypatch.setattr(
+        layout, "sparse_stress", lambda g, scale: calls.append("stress") or {}
+    )
+    monkeypatch.setattr(
+        layout, "kamada_kawai", lambda g, scale: calls.append("kk") or {}
+    )
+
+    layout.automatic(nx.path_graph(50), 500)
+    layout.automatic(nx.path_graph(51), 500)
+
+    assert calls == ["kk", "stress"]
+
+
+def test_sparse_stress_is_bounded_and_deterministic():
+    g = nx.grid_2d_graph(30, 40)
+
+    pos = layout.sparse_stress(g, 500)
+
+    assert set(pos) == set(g.nodes)
+    xy = np.array(list(pos.values()))
+    assert np.all(np.abs(xy) <= 500 + 1e-6)
+    assert np.isclose(np.abs(xy).max(), 500)
+    assert layout.sparse_stress(g, 500) == pos
+    # neighbours end up much closer than the average pair of nodes
+    neighbours = np.mean(
+        [np.linalg.norm(np.subtract(pos[u], pos[v])) for u, v in g.edges]
+    )
+    assert neighbours < 0.1 * np.mean(np.linalg.norm(xy - xy.mean(axis=0), axis=1))
+
+
+def test_pivot_distances_are_graph_distances():
+    g = nx.disjoint_union(nx.path_graph(6), nx.path_graph(3))
+    adjacency = nx.to_scipy_sparse_array(g, nodelist=list(g), format="csr")
+
+    pivots, distances = layout._pivot_distances(adjacency, 3)
+
+    assert len(set(pivots)) == 3
+    for column, p in enumerate(pivots):
+        lengths = nx.single_source_shortest_path_length(g, p)
+        for n in g:
+            assert distances[n, column] == lengths.get(n, np.inf)
+
+
+def _disconnected_graph() -> nx.Graph:
+    g = nx.Graph()
+    for size in [12, 7, 5, 3, 2, 2, 1, 1]:
+        g = nx.disjoint_union(
+            g, nx.cycle_graph(size) if size > 2 else nx.path_graph(size)
+        )
+    return g
+
+
+def test_components_are_packed_without_overlap():
+    g = _disconnected_graph()
+
+    pos = layout.automatic(g, 500)
+
+    assert set(pos) == set(g.nodes)
+    boxes = []
+    for c in nx.connected_components(g):
+        xy = np.array([pos[n] for n in c])
+        boxes.append((xy.min(axis=0), xy.max(axis=0)))
+    for i, (low1, high1) in enumerate(boxes):
+        for low2, high2 in boxes[i + 1 :]:
+            assert np.any(high1 < low2) or np.any(high2 < low1)
+
+
+def test_parallel_components_match_sequential(monkeypatch):
+    g = _disconnected_graph()
+    sequential = layout.components(g, 500)
+
+    monkeypatch.setattr(layout, "PARALLEL_THRESHOLD", 0)
+    parallel = layout.components(g, 500, processes=2)
+
+    assert parallel == sequential
+
+
+def test_one_process_starts_no_pool(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("started a process pool")
+
+    g = _disconnected_graph()
+    sequential = layout.compute(g, 500)
+
+    monkeypatch.setattr(layout, "PARALLEL_THRESHOLD", 0)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", no_pool)
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+
+    assert layout.compute(g, 500, processes=1) == sequential
+
+
+def test_cache_key_ignores_order_and_direction():
+    g1 = nx.Graph([("a", "b"), ("b", "c")])
+    g2 = nx.Graph()
+    g2.add_nodes_from(["c", "b", "a"])
+    g2.add_edges_from([("c", "b"), ("b", "a")])
+
+    assert layout.LayoutCache.key(g1, scale=500) == layout.LayoutCache.key(
+        g2, scale=500
+    )
+    assert layout.LayoutCache.key(g1, scale=500) != layout.LayoutCache.key(
+        g1, scale=400
+    )
+    g2.add_edge("a", "c")
+    assert layout.LayoutCache.key(g1, scale=500) != layout.LayoutCache.key(
+        g2, scale=500
+    )
+
+
+def test_cache_hits_and_misses(tmp_path, monkeypatch):
+    cache = layout.LayoutCache(tmp_path)
+    g = nx.Graph([("a", "b"), ("b", "c")])
+
+    pos = layout.compute(g, 500, cache=cache)
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+    def fail(*args):
+        raise AssertionError("layout was computed again")
+
+    monkeypatch.setattr(layout, "automatic", fail)
+    assert layout.compute(nx.Graph([("c", "b"), ("b", "a")]), 500, cache=cache) == pos
+    with pytest.raises(AssertionError):
+        layout.compute(g, 400, cache=cache)
+
+    # incremental layouts start from different positions every time
+    layout.compute(g, 500, fixed={"a": (0, 0)}, cache=cache)
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = layout.LayoutCache(tmp_path, max_entries=2)
+
+    cache.put("first", {"a": (0, 0)})
+    cache.put("second", {"a": (1, 1)})
+    assert cache.get("first") == {"a": (0, 0)}
+    cache.put("third", {"a": (2, 2)})
+
+    assert cache.get("second") is None
+    assert cache.get("first") == {"a": (0, 0)}
+    assert cache.get("third") == {"a": (2, 2)}
@@ -0,0 +1,167 @@
+import concurrent.futures
+
+import numpy as np
+
+import model.knowledge_graph as kg
+from conftest import make_graph, make_nodes
+from model import match
+
+
+def test_ngram_similarity_matrix():
+    names1 = ["customer order", "invoice", ""]
+    names2 = ["Customer Order", "customer orders", "invoice", "shipment"]
+
+    similarities = match.ngram_similarity_matrix(names1, names2)
+
+    assert similarities.shape == (3, 4)
+    assert np.isclose(similarities[0, 0], 1.0)
+    assert np.isclose(similarities[1, 2], 1.0)
+    assert similarities[0, 0] > similarities[0, 1] > similarities[0, 3]
+    assert np.all(similarities[2] == 0.0)
+    assert np.isclose(
+        similarities[0, 1], match.ngram_similarity("customer order", "customer orders")
+    )
+
+
+def test_ngram_similarity_matrix_pruned():
+    names1 = ["customer order", "invoice"]
+    names2 = ["customer order", "customer orders", "invoice", "shipment"]
+    dense = match.ngram_similarity_matrix(names1, names2)
+
+    top = match.ngram_similarity_matrix(names1, names2, top_k=1).toarray()
+    assert np.count_nonzero(top, axis=1).tolist() == [1, 1]
+    assert top[0, 0] == dense[0, 0]
+    assert top[1, 2] == dense[1, 2]
+
+    pruned = match.ngram_similarity_matrix(names1, names2, threshold=0.5).toarray()
+    assert np.array_equal(pruned, np.where(dense >= 0.5, dense, 0.0))
+
+
+def test_overlap_uses_cached_tags(tmp_path):
+    cache = match.TaggingCache(max_size=2)
+    cache._put("the order", (("the", "DT"), ("order", "NN")))
+    cache._put("an order", (("an", "DT"), ("order", "NN")))
+    cache.save(tmp_path / "tags.json")
+
+    loaded = match.TaggingCache()
+    loaded.load(tmp_path / "tags.json")
+    tokens1 = match.prepare_overlap("The Order", ["dt"], cache=loaded)
+    tokens2 = match.prepare_overlap("an order", None, cache=loaded)
+
+    assert tokens1 == ("order",)
+    assert tokens2 == ("an", "order")
+    assert match.overlap_score(tokens1, tokens2) == 0.5
+    assert match.overlap_score(tokens2, tokens1) == 0.5
+
+
+def test_tagging_cache_is_bounded():
+    cache = match.TaggingCache(max_size=2)
+    cache._put("a", (("a", "DT"),))
+    cache._put("b", (("b", "NN"),))
+    cache.tag("a")
+    cache._put("c", (("c", "NN"),))
+
+    assert len(cache) == 2
+    assert cache.tag("a") == (("a", "DT"),)
+    assert "b" not in cache._tagged
+
+
+def test_prepared_matcher_compacts_like_callable():
+    nodes = make_nodes(
+        [
+            ("Order", "activity"),
+            ("order", "actor"),
+            ("Orders", "activity"),
+            ("invoice", "activity"),
+            ("the order", "activity"),
+            ("invoices", "activity"),
+        ]
+    )
+    graph = kg.Graph(nodes=nodes, edges=[])
+    matcher = match.node_matcher(match.char_similarity, 0.8)
+
+    prepared = graph.compact(match_node=matcher)
+    plain = graph.compact(match_node=lambda n1, n2: matcher(n1, n2))
+
+    assert [n.name for n in prepared.nodes] == [
+        "Orders",
+        "order",
+        "invoices",
+        "the order",
+    ]
+    assert prepared.to_dict() == plain.to_dict()
+
+
+def test_thresholded_char_similarity():
+    words = ["order", "orders", "the order", "ordering", "o", "", "invoice", "ORDER"]
+    for threshold in [0.0, 0.5, 0.8, 1.0]:
+        for w1 in words:
+            for w2 in words:
+                exact = match.char_similarity(w1, w2)
+                thresholded = match.char_similarity(w1, w2, threshold)
+                if exact >= threshold:
+                    assert thresholded == exact
+                else:
+                    assert thresholded == 0.0
+
+
+def test_compaction_by_type_in_parallel(monkeypatch):
+    monkeypatch.setattr(kg, "PARALLEL_COMPACTION_THRESHOLD", 0)
+    nodes = make_nodes(
+        [
+            ("Order", "activity"),
+            ("order", "actor"),
+            ("invoice", "actor"),
+            ("Orders", "activity"),
+            ("invoices", "actor"),
+            ("the order", "activity"),
+        ]
+    )
+    graph = kg.Graph(nodes=nodes, edges=[])
+    matcher = match.node_matcher(match.char_similarity, 0.8)
+
+    partitioned = graph.compact(match_node=matcher, partition_by_type=True, processes=2)
+
+    assert partitioned.to_dict() == graph.compact(match_node=matcher).to_dict()
+
+
+def test_collapse_partition():
+    nodes = make_nodes(
+        [("a", "t"), ("bbb", "t"), ("cc", "t"), ("dddd", "t"), ("e", "t")]
+    )
+    graph = kg.Graph(
+        nodes=nodes,
+        edges=[kg.Edge(id="e1", source=nodes[0], target=nodes[3], type="r")],
+    )
+
+    collapsed = graph.collapse([[nodes[2], nodes[0]], [nodes[3], nodes[1]]])
+
+    assert [n.name for n in collapsed.nodes] == ["cc", "dddd", "e"]
+    assert collapsed.edges[0].source.name == "cc"
+    assert collapsed.edges[0].target.name == "dddd"
+    assert (
+        graph.collapse({"0": 1, "2": 1, "1": 2, "3": 2}).to_dict()
+        == collapsed.to_dict()
+    )
+
+
+def test_compaction_with_one_process_starts_no_pool(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("started a process pool")
+
+    monkeypatch.setattr(kg, "PARALLEL_COMPACTION_THRESHOLD", 0)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", no_pool)
+    graph = make_graph(
+        [("order", "activity"), ("orders", "activity"), ("clerk", "actor")]
+    )
+    matcher = match.node_matcher(match.char_similarity, 0.8)
+
+    merged = graph.merge(
+        kg.Graph(nodes=[], edges=[]),
+        match_node=matcher,
+        match_edge=None,
+        partition_by_type=True,
+        processes=1,
+    )
+
+    assert merged.to_dict() == graph.compact(match_node=matcher).to_dict()
@@ -0,0 +1,177 @@
+from conftest import make_graph
+from evaluation import metrics
+from model import match
+
+
+def _tagged(monkeypatch, *names):
+    cache = match.TaggingCache()
+    for name in names:
+        cache.put(
+            name.lower(),
+            [(w, "DT" if w == "the" else "NN") for w in name.lower().split()],
+        )
+    monkeypatch.setattr(match, "tagging_cache", cache)
+
+
+def test_optimal_matching_per_type(monkeypatch):
+    _tagged(
+        monkeypatch,
+        "the clerk",
+        "check order",
+        "send invoice",
+        "clerk",
+        "check the order",
+        "archive order",
+        "manager",
+    )
+    predicted = make_graph(
+        [
+            ("the clerk", "Actor"),
+            ("check order", "Activity"),
+            ("send invoice", "Activity"),
+        ]
+    )
+    reference = make_graph(
+        [
+            ("check the order", "activity"),
+            ("clerk", "actor"),
+            ("archive order", "activity"),
+            ("manager", "actor"),
+        ]
+    )
+
+    matches = metrics.optimal_matching(predicted, reference)
+
+    pairs = [
+        (
+            None if m.prediction is None else m.prediction.text,
+            None if m.ground_truth is None else m.ground_truth.text,
+            m.similarity,
+        )
+        for m in matches
+    ]
+    assert pairs == [
+        ("the clerk", "clerk", 0.5),
+        ("check order", "check the order", 2 / 3),
+        ("send invoice", "archive order", 0.0),
+        (None, "manager", 0.0),
+    ]
+
+    stats = metrics.get_stats(
+        predicted_graph=predicted, reference_graph=reference, threshold=0.5
+    )
+    assert (stats.num_ok, stats.num_pred, stats.num_gold) == (2, 3, 4)
+
+
+def test_optimal_matching_at_threshold_zero(monkeypatch):
+    _tagged(monkeypatch, "send invoice", "send", "clerk check")
+    predicted = make_graph([("send invoice", "actor")])
+    reference = make_graph([("send", "activity"), ("clerk check", "actor")])
+
+    matches = metrics.optimal_matching(predicted, reference)
+
+    # all pairs score 0, the first one is formed even though the types differ
+    assert [
+        (m.prediction and m.prediction.text, m.ground_truth.text, m.similarity)
+        for m in matches
+    ] == [("send invoice", "send", 0.0), (None, "clerk check", 0.0)]
+    stats = metrics.get_stats(
+        predicted_graph=predicted, reference_graph=reference, threshold=0.0
+    )
+    assert (stats.num_ok, stats.num_wrong) == (0, 2)
+
+
+def test_sweep_matches_get_stats(monkeypatch):
+    _tagged(
+        monkeypatch, "the clerk", "check order", "send invoice", "clerk", "send order"
+    )
+    predicted = make_graph(
+        [
+            ("the clerk", "actor"),
+            ("check order", "activity"),
+            ("send invoice", "activity"),
+        ]
+    )
+    reference = make_graph(
+        [("clerk", "actor"), ("send order", "activity"), ("check order", "activity")]
+    )
+    thresholds = [0.0, 0.25, 0.5, 0.75, 1.0]
+
+    sweep = metrics.sweep_thresholds(
+        predicted_graph=predicted, reference_graph=reference, thresholds=thresholds
+    )
+
+    for i, threshold in enumerate(thresholds):
+        stats = metrics.get_stats(
+            predicted_graph=predicted, reference_graph=reference, threshold=threshold
+        )
+        assert sweep.stats(i) == stats
+        assert sweep.f1[i] == stats.f1
+        assert sweep.f_beta(2)[i] == stats.f_beta(2)
+
+    averaged = metrics.macro_average([sweep, sweep])
+    assert list(averaged["p"]) == list(sweep.precision)
+
+
+def test_relation_stats_use_node_assignment(monkeypatch):
+    _tagged(monkeypatch, "clerk", "check order", "send invoice", "archive")
+    predicted = make_graph(
+        [("clerk", "actor"), ("check order", "activity"), ("archive", "activity")],
+        edges=[
+            ("clerk", "performs", "check order"),
+            ("clerk", "Performs", "check order"),
+            ("check order", "follows", "clerk"),
+            ("clerk", "performs", "archive"),
+        ],
+    )
+    reference = make_graph(
+        [("clerk", "actor"), ("check order", "activity"), ("send invoice", "activity")],
+        edges=[
+            ("clerk", "performs", "check order"),
+            ("check order", "follows", "send invoice"),
+        ],
+    )
+
+    stats = metrics.get_relation_stats(
+        predicted_graph=predicted, reference_graph=reference, threshold=0.5
+    )
+
+    # the duplicate edge is only counted once, the reversed one is wrong
+    assert stats.num_ok == 1
+    assert stats.num_pred == 4
+    assert stats.num_gold == 2
+
+    matches = metrics.optimal_matching(predicted, reference)
+    assert (
+        metrics.get_relation_stats(
+            predicted_graph=predicted,
+            reference_graph=reference,
+            threshold=0.5,
+            matches=matches,
+        )
+        == stats
+    )
+
+
+def test_relation_stats_ignore_nodes_of_other_types(monkeypatch):
+    _tagged(monkeypatch, "clerk", "send invoice", "invoice")
+    predicted = make_graph(
+        [("clerk", "actor"), ("send invoice", "activity")],
+        edges=[("clerk", "performs", "send invoice")],
+    )
+    reference = make_graph(
+        [("clerk", "actor"), ("invoice", "data")],
+        edges=[("clerk", "performs", "invoice")],
+    )
+    # the only pair left for the activity is the data object
+    matches = metrics.optimal_matching(predicted, reference)
+    assert [(m.prediction.text, m.ground_truth.text) for m in matches] == [
+        ("clerk", "clerk"),
+        ("send invoice", "invoice"),
+    ]
+
+    stats = metrics.get_relation_stats(
+        predicted_graph=predicted, reference_graph=reference, threshold=0.0
+    )
+
+    assert stats.num_ok == 0
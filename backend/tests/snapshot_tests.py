@@ -0,0 +1,89 @@
+import dataclasses
+import os
+
+import model.knowledge_graph as kg
+from conftest import make_entity, make_source
+from model import snapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    source = make_source(page_end=2)
+    n1 = kg.Node(
+        id="n1",
+        name="vacuum chamber",
+        position=(1.5, -2.0),
+        entity=make_entity("t1"),
+        source=source,
+    )
+    n2 = kg.Node(
+        id="n2", name="pump", position=(0, 0), entity=make_entity("t2"), source=source
+    )
+    n3 = kg.Node(
+        id="n3", name="valve", position=(3, 4), entity=make_entity("t1"), source=source
+    )
+    graph = kg.Graph(
+        nodes=[n1, n2, n3],
+        edges=[
+            kg.Edge(id="e1", source=n1, target=n2, type="r1"),
+            kg.Edge(id="e2", source=n3, target=n1, type="r2"),
+        ],
+    )
+
+    snapshot.save_snapshot(graph, tmp_path / "graph.kgs")
+
+    with snapshot.load_snapshot(tmp_path / "graph.kgs") as loaded:
+        assert loaded.num_nodes == 3
+        assert loaded.num_edges == 2
+        assert loaded.entity_counts() == {"t1": 2, "t2": 1}
+        assert loaded.nodes[2].values() == n3.values()
+        assert loaded.edges[1].target is loaded.nodes[0]
+        assert loaded.to_dict() == graph.to_dict()
+        assert loaded.to_graph().to_dict() == graph.to_dict()
+
+
+def test_entity_counts_add_up_definitions_with_one_name(tmp_path):
+    actor = make_entity("actor")
+    other_actor = dataclasses.replace(actor, description="someone else")
+    graph = kg.Graph(
+        nodes=[
+            kg.Node(
+                id=str(i), name=str(i), position=(0, 0), entity=e, source=make_source()
+            )
+            for i, e in enumerate([actor, other_actor, other_actor, make_entity()])
+        ],
+        edges=[],
+    )
+
+    snapshot.save_snapshot(graph, tmp_path / "graph.kgs")
+
+    with snapshot.load_snapshot(tmp_path / "graph.kgs") as loaded:
+        assert len(loaded.entities) == 3
+        assert loaded.entity_counts() == {"actor": 3, "t1": 1}
+
+
+def test_cached_snapshot_follows_json(tmp_path):
+    n1 = kg.Node(
+        id="n1",
+        name="pump",
+        position=(0, 0),
+        entity=make_entity(),
+        source=make_source(),
+    )
+    kg.Graph(nodes=[n1], edges=[]).save(tmp_path / "graph.json")
+
+    with snapshot.cached_snapshot(tmp_path / "graph.json", tmp_path / "s.kgs") as s:
+        assert s.num_nodes == 1
+
+    n2 = kg.Node(
+        id="n2",
+        name="valve",
+        position=(1, 1),
+        entity=make_entity(),
+        source=make_source(),
+    )
+    kg.Graph(nodes=[n1, n2], edges=[]).save(tmp_path / "graph.json")
+    # make sure the JSON is newer even on file systems with coarse timestamps
+    os.utime(tmp_path / "s.kgs", (0, 0))
+
+    with snapshot.cached_snapshot(tmp_path / "graph.json", tmp_path / "s.kgs") as s:
+        assert s.num_nodes == 2